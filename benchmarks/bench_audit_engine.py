@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+"""
+    Time the audits of notebook_audit_methods.py run the way the
+    notebook runs them, a pass over the file each, against all of
+    them registered on one osm_audit.AuditEngine pass.  The results
+    of the two are checked to be the same.
+
+    The file is osm_file, or a synthetic extract of --nodes nodes.
+
+    usage: python benchmarks/bench_audit_engine.py [osm_file] [--nodes N]
+"""
+import argparse
+import contextlib
+import io
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import notebook_audit_methods
+import synthetic_osm
+
+
+def separate_passes(osm_file):
+    """
+        {audit name: result}, a pass over osm_file for each
+    """
+    results = {}
+    paths = io.StringIO()
+    with contextlib.redirect_stdout(paths):
+        notebook_audit_methods.identify_tags_fullpath(osm_file)
+    results['tag_paths'] = paths.getvalue()
+    results['node_keys'] = notebook_audit_methods.audit_tag_keys(osm_file, 'node')
+    results['way_keys'] = notebook_audit_methods.audit_tag_keys(osm_file, 'way')
+    results['streets'] = notebook_audit_methods.get_all_streets(osm_file)
+    return results
+
+
+if __name__ == '__main__':
+    arguments = argparse.ArgumentParser(description="Time one audit pass against a pass per audit")
+    arguments.add_argument('osm_file', nargs='?')
+    arguments.add_argument('--nodes', type=int, default=200000, help="synthetic extract size")
+    args = arguments.parse_args()
+
+    scratch = tempfile.mkdtemp(prefix='bench_')
+    try:
+        osm_file = args.osm_file
+        if osm_file is None:
+            osm_file = os.path.join(scratch, 'synthetic.osm')
+            synthetic_osm.generate_osm(osm_file, args.nodes)
+
+        start = time.perf_counter()
+        expected = separate_passes(osm_file)
+        separate_seconds = time.perf_counter() - start
+        print("{0: <28} {1: >8.2f}s".format("{} passes".format(len(expected)), separate_seconds))
+
+        results = notebook_audit_methods.run_audits(osm_file,
+                                                    notebook_audit_methods.notebook_audits())
+        paths = io.StringIO()
+        with contextlib.redirect_stdout(paths):
+            notebook_audit_methods.print_tag_paths(results['tag_paths'])
+        line = "{0: <28} {1: >8.2f}s {2: >6.1f}x".format(
+            "one pass of {} audits".format(len(results)), results.seconds,
+            separate_seconds / results.seconds)
+        if (paths.getvalue() != expected['tag_paths']
+                or any(results[name] != expected[name] for name in ('node_keys', 'way_keys', 'streets'))):
+            line += "  (results differ)"
+        print(line)
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
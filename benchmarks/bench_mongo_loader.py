@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+"""
+    Time mongo_loader.py: the JSON Lines export, then, against a
+    MongoDB server, a document at a time with insert_one beside
+    mongo_loader.load with 1 to --workers insert threads.  The
+    documents are those of osm_file, or of a synthetic extract of
+    --nodes nodes.  The loads replace the nodes and ways collections
+    of --database.
+
+    usage: python benchmarks/bench_mongo_loader.py [osm_file] [--nodes N] [--workers 4]
+                                                   [--uri mongodb://localhost:27017] [--database osm_bench]
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import mongo_loader
+import synthetic_osm
+
+# insert_one takes minutes at a document a round trip; time this many
+SINGLE_DOCUMENTS = 10000
+
+
+def insert_one_rate(db, osm_file, scratch):
+    """
+        documents / second inserting the first SINGLE_DOCUMENTS
+        documents one at a time
+    """
+    db.drop_collection('single')
+    collection = db['single']
+    documents = mongo_loader.iter_documents(osm_file, scratch)
+    pending = [document for _, document in zip(range(SINGLE_DOCUMENTS), documents)]
+    documents.close()
+    start = time.perf_counter()
+    for document in pending:
+        collection.insert_one(document)
+    seconds = time.perf_counter() - start
+    db.drop_collection('single')
+    return len(pending) / seconds
+
+
+if __name__ == '__main__':
+    arguments = argparse.ArgumentParser(description="Time the MongoDB export and load")
+    arguments.add_argument('osm_file', nargs='?')
+    arguments.add_argument('--nodes', type=int, default=200000, help="synthetic extract size")
+    arguments.add_argument('--workers', type=int, default=mongo_loader.WORKERS)
+    arguments.add_argument('--uri', default=mongo_loader.DEFAULT_URI)
+    arguments.add_argument('--database', default='osm_bench')
+    args = arguments.parse_args()
+
+    scratch = tempfile.mkdtemp(prefix='bench_')
+    try:
+        osm_file = args.osm_file
+        if osm_file is None:
+            osm_file = os.path.join(scratch, 'synthetic.osm')
+            synthetic_osm.generate_osm(osm_file, args.nodes)
+
+        for compression in (None, 'gzip'):
+            start = time.perf_counter()
+            counts = mongo_loader.export_jsonl(osm_file, os.path.join(scratch, 'jsonl'),
+                                               compression=compression)
+            seconds = time.perf_counter() - start
+            documents = sum(counts.values())
+            print("{0: <32} {1: >9} documents {2: >10.0f} documents/s".format(
+                "jsonl, {}".format(compression or "uncompressed"), documents, documents / seconds))
+
+        pymongo = mongo_loader._pymongo()
+        client = pymongo.MongoClient(args.uri, serverSelectionTimeoutMS=2000)
+        try:
+            client.admin.command('ping')
+        except pymongo.errors.ConnectionFailure:
+            sys.exit("no MongoDB server at {}".format(args.uri))
+        single = insert_one_rate(client[args.database], osm_file, scratch)
+        client.close()
+        print("{0: <32} {1: >9} documents {2: >10.0f} documents/s".format(
+            "insert_one", SINGLE_DOCUMENTS, single))
+
+        workers = 1
+        while workers <= args.workers:
+            stats = mongo_loader.load(osm_file, args.uri, args.database, workers=workers)
+            documents = sum(stats['documents'].values())
+            print("{0: <32} {1: >9} documents {2: >10.0f} documents/s  {3:.0f}x, "
+                  "indexed in {4:.2f}s".format(
+                      "load, {} workers".format(workers), documents,
+                      stats['documents_per_second'], stats['documents_per_second'] / single,
+                      stats['index_seconds']))
+            workers *= 2
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+"""
+    Time loading map_node on a MySQL server two ways: a node at a time
+    with Database.add_node (database_mysql/db.py), and in bulk with
+    mysql_loader.load_nodes.  The nodes are the named ones of
+    osm_file, or of a synthetic extract of --nodes nodes.  With
+    --csv, the csv files data.py writes are also loaded into the
+    eight tables with mysql_loader.load_csv_files.
+
+    The server needs the map_node table of Database.create_node_table
+    and, for --csv, the tables of database_mysql/create_tables.sql.
+    Both loads replace what map_node holds.
+
+    usage: python benchmarks/bench_mysql_loader.py [osm_file] [--nodes N] [--csv]
+                                                   [--host 127.0.0.1] [--database udacity] ...
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..',
+                                'database_mysql'))
+
+import data
+import mysql_loader
+import synthetic_osm
+from osm_parsers import iter_shaped_elements
+from db import Database
+
+# add_node takes minutes at a node a round trip; time this many
+SINGLE_NODES = 5000
+
+
+def named_nodes(osm_file):
+    """
+        the dicts Database.add_node takes, for the nodes with a name
+    """
+    nodes = []
+    for element in iter_shaped_elements(osm_file, tags=('node',), rows=True):
+        node = element['node']
+        values = {'id': node[0], 'lat': node[1], 'lon': node[2], 'name': None,
+                  'description': None, 'cuisine': None, 'denomination': None,
+                  'shop': None, 'amenity': None}
+        for _, key, value, tag_type in element['node_tags']:
+            if tag_type == 'regular' and key in values:
+                values[key] = value
+        if values['name']:
+            nodes.append(values)
+    return nodes
+
+
+def rate(rows, seconds):
+    return "{:>10.0f} rows/s".format(rows / seconds if seconds else 0)
+
+
+if __name__ == '__main__':
+    arguments = argparse.ArgumentParser(description="Time bulk loads into MySQL")
+    arguments.add_argument('osm_file', nargs='?')
+    arguments.add_argument('--nodes', type=int, default=200000, help="synthetic extract size")
+    arguments.add_argument('--csv', action='store_true', help="also load the csv files")
+    arguments.add_argument('--host', default='127.0.0.1')
+    arguments.add_argument('--port', type=int, default=3306)
+    arguments.add_argument('--database', default='udacity')
+    arguments.add_argument('--user', default='root')
+    arguments.add_argument('--password', default='')
+    args = arguments.parse_args()
+
+    scratch = tempfile.mkdtemp(prefix='bench_')
+    try:
+        osm_file = args.osm_file
+        if osm_file is None:
+            osm_file = os.path.join(scratch, 'synthetic.osm')
+            synthetic_osm.generate_osm(osm_file, args.nodes)
+        nodes = named_nodes(osm_file)
+        print("{} named nodes".format(len(nodes)))
+
+        db = Database()
+        db.connect(host=args.host, port=args.port, database=args.database,
+                   username=args.user, password=args.password)
+        db.execute("truncate table map_node")
+        single = nodes[:SINGLE_NODES]
+        start = time.perf_counter()
+        for node in single:
+            db.add_node(node)
+        single_seconds = time.perf_counter() - start
+        print("{0: <32} {1: >8} nodes {2}".format("Database.add_node", len(single),
+                                                  rate(len(single), single_seconds)))
+
+        pool = mysql_loader.ConnectionPool(size=1, host=args.host, port=args.port,
+                                           db=args.database, user=args.user,
+                                           passwd=args.password)
+        with pool.connection() as connection:
+            for replace in (True, False):
+                start = time.perf_counter()
+                count = mysql_loader.load_nodes(connection, nodes, replace=replace)
+                seconds = time.perf_counter() - start
+                print("{0: <32} {1: >8} nodes {2}  {3:.0f}x".format(
+                    "load_nodes, replace={}".format(replace), count, rate(count, seconds),
+                    (count / seconds) / (len(single) / single_seconds)))
+
+            if args.csv:
+                directory = os.path.join(scratch, 'csv')
+                os.makedirs(directory)
+                data.process_map(osm_file, False, output_directory=directory)
+                for local_infile in (True, False):
+                    stats = mysql_loader.load_csv_files(connection, directory,
+                                                        local_infile=local_infile)
+                    rows = sum(rows for rows, _ in stats.values())
+                    seconds = sum(seconds for _, seconds in stats.values())
+                    print("{0: <32} {1: >8} rows  {2}".format(
+                        "load_csv_files, local_infile={}".format(local_infile),
+                        rows, rate(rows, seconds)))
+        pool.close()
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
@@ -0,0 +1,43 @@
+#!/usr/bin/env python
+"""
+    Compare serial and sharded process_map throughput
+
+    usage: python benchmarks/bench_parallel_ingest.py [osm_file] [workers ...]
+"""
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import data
+
+
+def time_run(osm_file, workers):
+    """
+        Run process_map into a scratch directory and
+        return the elapsed seconds
+    """
+    output_directory = tempfile.mkdtemp(prefix='bench_')
+    try:
+        start = time.perf_counter()
+        data.process_map(osm_file, validate=False, workers=workers,
+                         output_directory=output_directory)
+        return time.perf_counter() - start
+    finally:
+        shutil.rmtree(output_directory, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    osm_file = sys.argv[1] if len(sys.argv) > 1 else 'new_orleans_city_sample.osm'
+    worker_counts = [int(w) for w in sys.argv[2:]] or [1, 2, 4, os.cpu_count() or 1]
+
+    size_mb = os.path.getsize(osm_file) / (1024.0 * 1024.0)
+    baseline = None
+    for workers in sorted(set(worker_counts)):
+        elapsed = time_run(osm_file, workers)
+        baseline = baseline or elapsed
+        print("workers: {0: >3}  {1: >8.2f}s  {2: >8.1f} MB/s  speedup: {3:.2f}x".format(
+            workers, elapsed, size_mb / elapsed, baseline / elapsed))
@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+"""
+    Compare the parser backends in osm_parsers.py
+
+    usage: python benchmarks/bench_parser_backends.py [osm_file]
+"""
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from osm_parsers import PARSER_BACKENDS, is_pbf, iter_shaped_elements
+
+REPEAT = 3
+
+
+def _consume(osm_file, backend):
+    count = 0
+    for _ in iter_shaped_elements(osm_file, tags=('node', 'way'), backend=backend):
+        count += 1
+    return count
+
+
+def time_backend(osm_file, backend):
+    """
+        Parse and shape every node and way, returning
+        (seconds, number of records, peak traced bytes)
+
+        The best of REPEAT runs is reported.  Memory is traced
+        on a separate pass so tracemalloc does not distort the timing.
+    """
+    elapsed = None
+    for _ in range(REPEAT):
+        start = time.perf_counter()
+        count = _consume(osm_file, backend)
+        run = time.perf_counter() - start
+        elapsed = run if elapsed is None else min(elapsed, run)
+
+    tracemalloc.start()
+    _consume(osm_file, backend)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, count, peak
+
+
+if __name__ == '__main__':
+    osm_file = sys.argv[1] if len(sys.argv) > 1 else 'new_orleans_city_sample.osm'
+    size_mb = os.path.getsize(osm_file) / (1024.0 * 1024.0)
+
+    if is_pbf(osm_file):
+        backends = ['pbf']
+    else:
+        backends = sorted(name for name in PARSER_BACKENDS if name != 'pbf')
+
+    for backend in backends:
+        elapsed, count, peak = time_backend(osm_file, backend)
+        print("{0: <8} {1: >8.2f}s  {2: >8.1f} MB/s  {3: >10} records  peak {4: >8.1f} MB".format(
+            backend, elapsed, size_mb / elapsed, count, peak / (1024.0 * 1024.0)))
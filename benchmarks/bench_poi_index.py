@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+"""
+    Time the grid index of poi_index.py: building and reopening it,
+    nearest / radius / box queries one at a time and in batches, with
+    and without a tag filter.  Each query kind is checked against a
+    brute force measure of every point.
+
+    The index is built from osm_file, or from --points random named
+    points (a third of them clustered, as a downtown is) over the
+    synthetic_osm.py extent with its amenities.
+
+    usage: python benchmarks/bench_poi_index.py [osm_file] [--points N] [--queries 10000] [-k 10]
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import poi_index
+import synthetic_osm
+
+SINGLE_QUERIES = 500
+RADIUS = 500.0
+
+
+def random_index(path, points, seed=0):
+    rng = np.random.default_rng(seed)
+    lats = rng.uniform(synthetic_osm.MIN_LAT, synthetic_osm.MAX_LAT, points)
+    lons = rng.uniform(synthetic_osm.MIN_LON, synthetic_osm.MAX_LON, points)
+    clustered = points // 3
+    mid_lat = (synthetic_osm.MIN_LAT + synthetic_osm.MAX_LAT) / 2
+    mid_lon = (synthetic_osm.MIN_LON + synthetic_osm.MAX_LON) / 2
+    lats[:clustered] = rng.normal(mid_lat, 0.005, clustered)
+    lons[:clustered] = rng.normal(mid_lon, 0.005, clustered)
+    amenities = rng.integers(len(synthetic_osm.AMENITIES), size=points)
+    builder = poi_index.PoiIndexBuilder(path)
+    for i in range(points):
+        builder.add_point(i + 1, lats[i], lons[i], name="Place {}".format(i),
+                          amenity=synthetic_osm.AMENITIES[amenities[i]])
+    return builder.close()
+
+
+def brute_nearest(index, lats, lons, k, mask):
+    points = np.flatnonzero(mask)
+    distances = poi_index.haversine(lats[:, None], lons[:, None],
+                                    index.lats[points][None, :], index.lons[points][None, :])
+    order = np.argsort(distances, axis=1, kind='stable')[:, :k]
+    return points[order]
+
+
+def timed(function, *arguments, **keywords):
+    start = time.perf_counter()
+    result = function(*arguments, **keywords)
+    return time.perf_counter() - start, result
+
+
+if __name__ == '__main__':
+    arguments = argparse.ArgumentParser(description="Time the grid index of points of interest")
+    arguments.add_argument('osm_file', nargs='?')
+    arguments.add_argument('--points', type=int, default=25000, help="random points to index")
+    arguments.add_argument('--queries', type=int, default=10000, help="queries per batch")
+    arguments.add_argument('-k', type=int, default=10)
+    args = arguments.parse_args()
+
+    scratch = tempfile.mkdtemp(prefix='bench_')
+    try:
+        path = os.path.join(scratch, 'poi_index')
+        if args.osm_file:
+            seconds, index = timed(poi_index.build_poi_index, args.osm_file, path)
+        else:
+            seconds, index = timed(random_index, path, args.points)
+        print("built an index of {} points in {:.2f}s".format(len(index), seconds))
+        seconds, index = timed(poi_index.PoiIndex, path)
+        print("reopened in {:.2f}ms".format(seconds * 1000))
+        amenities = index.vocabularies['amenity']
+        amenity = 'restaurant' if 'restaurant' in amenities else (amenities or [None])[0]
+
+        rng = np.random.default_rng(1)
+        lats = rng.uniform(index.lats.min(), index.lats.max(), args.queries)
+        lons = rng.uniform(index.lons.min(), index.lons.max(), args.queries)
+        filters = [{}]
+        if amenity is not None:
+            filters.append({'amenity': amenity})
+            # the first query with a filter grids its points
+            seconds, _ = timed(index.nearest, lats[:1], lons[:1], amenity=amenity)
+            print("gridded the {} points with amenity={} in {:.2f}ms".format(
+                int(index.matching(amenity=amenity).sum()), amenity, seconds * 1000))
+
+        print("{0: <42} {1: >14} {2: >16}".format('query, k={}'.format(args.k),
+                                                  'one at a time', 'batch'))
+        for query_filters in filters:
+            label = ", ".join("{}={}".format(*item) for item in query_filters.items()) or "all"
+            mask = index.matching(**query_filters)
+            checked = slice(0, 1000)
+            expected = brute_nearest(index, lats[checked], lons[checked], args.k, mask)
+
+            cases = [
+                ("nearest ({})".format(label),
+                 lambda lat, lon: index.nearest(lat, lon, args.k, **query_filters),
+                 lambda: index.nearest(lats, lons, args.k, **query_filters)),
+                ("within {:.0f}m ({})".format(RADIUS, label),
+                 lambda lat, lon: index.within_radius(lat, lon, RADIUS, **query_filters),
+                 lambda: index.within_radius(lats, lons, RADIUS, **query_filters)),
+            ]
+            for name, single, batch in cases:
+                start = time.perf_counter()
+                for i in range(SINGLE_QUERIES):
+                    single(lats[i], lons[i])
+                single_us = (time.perf_counter() - start) * 1e6 / SINGLE_QUERIES
+                seconds, result = timed(batch)
+                line = "{0: <42} {1: >9.1f}us/q {2: >10.0f}q/s".format(
+                    name, single_us, args.queries / seconds)
+                if name.startswith('nearest'):
+                    found = result[0][checked][:, :expected.shape[1]]
+                    if not np.array_equal(found, expected):
+                        line += "  (differs from brute force)"
+                print(line)
+
+            start = time.perf_counter()
+            for i in range(SINGLE_QUERIES):
+                index.within_box(lats[i] - 0.005, lons[i] - 0.005, lats[i] + 0.005,
+                                 lons[i] + 0.005, **query_filters)
+            print("{0: <42} {1: >9.1f}us/q".format(
+                "box of 0.01 degrees ({})".format(label),
+                (time.perf_counter() - start) * 1e6 / SINGLE_QUERIES))
+
+        seconds, _ = timed(brute_nearest, index, lats[:1000], lons[:1000], args.k,
+                           np.ones(len(index), dtype=bool))
+        print("brute force nearest, for comparison: {:.0f}q/s".format(1000 / seconds))
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+"""
+    Compare the dict record path (shape_element + DictWriter style rows)
+    with the tuple record path (shape_element_rows + csv.writer batches)
+
+    Reports wall time for a full ingest into scratch csv files and the
+    bytes allocated per element for the record containers.
+
+    usage: python benchmarks/bench_record_path.py [osm_file]
+"""
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import data
+from osm_parsers import iter_shaped_elements
+from street_map_csv_writer import StreetMapCsvWriter
+
+REPEAT = 3
+
+
+def record_size(record):
+    """
+        bytes held by the dicts, lists and tuples making up one
+        shaped record (the strings are shared by both paths)
+    """
+    size = sys.getsizeof(record)
+    for value in record.values():
+        size += sys.getsizeof(value)
+        if isinstance(value, list):
+            size += sum(sys.getsizeof(item) for item in value)
+    return size
+
+
+def time_path(osm_file, rows):
+    best = None
+    for _ in range(REPEAT):
+        output_directory = tempfile.mkdtemp(prefix='bench_')
+        try:
+            start = time.perf_counter()
+            writer = StreetMapCsvWriter(add_csv_headers=False, output_directory=output_directory)
+            records = iter_shaped_elements(osm_file, rows=rows)
+            if rows:
+                data.ingest_rows(records, writer)
+            else:
+                data.ingest_elements(records, writer, validate=False)
+            writer.close()
+            elapsed = time.perf_counter() - start
+        finally:
+            shutil.rmtree(output_directory, ignore_errors=True)
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+if __name__ == '__main__':
+    osm_file = sys.argv[1] if len(sys.argv) > 1 else 'new_orleans_city_sample.osm'
+
+    for name, rows in (('dict', False), ('tuple', True)):
+        num_elements = 0
+        num_bytes = 0
+        for record in iter_shaped_elements(osm_file, rows=rows):
+            num_elements += 1
+            num_bytes += record_size(record)
+
+        elapsed = time_path(osm_file, rows)
+        print("{0: <6} {1: >8.3f}s  {2: >10.0f} elements/s  {3: >7.1f} record bytes/element".format(
+            name, elapsed, num_elements / elapsed, num_bytes / float(num_elements)))
@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+"""
+    Time nearest-neighbour lookups two ways: the cross join sorted by
+    distance of Database.get_closest_nodes (database_mysql/db.py), run
+    on a copy of the points of interest in a plain SQLite table, and
+    the R-tree search of spatial_index.py.  The two answers are
+    checked to be the same nodes.  The distances of the cross join
+    are sqlite's math functions, in C, like st_distance_sphere.
+
+    The database is built from osm_file with sqlite_loader.py, or from
+    a synthetic extract of --nodes nodes.
+
+    usage: python benchmarks/bench_spatial_index.py [osm_file] [--nodes N] [-k 10]
+                                                    [--lookups 200]
+"""
+import argparse
+import os
+import random
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import spatial_index
+import sqlite_loader
+import synthetic_osm
+
+# st_distance_sphere, in sqlite's math functions
+DISTANCE = """
+    2 * {radius} * asin(sqrt(min(1.0,
+        power(sin(radians(other.lat - this.lat) / 2), 2)
+        + cos(radians(this.lat)) * cos(radians(other.lat))
+          * power(sin(radians(other.lon - this.lon) / 2), 2))))""".format(
+    radius=spatial_index.EARTH_RADIUS)
+
+# get_closest_nodes, leaving out the node itself
+CLOSEST_NODES = """
+    select other.node_id, {distance} as distance
+      from map_node this
+     cross join map_node other
+     where this.node_id = ?
+       and other.node_id != this.node_id
+     order by distance
+     limit ?""".format(distance=DISTANCE)
+
+# the nearest of one amenity to a point
+CLOSEST_AMENITY = """
+    select other.node_id, {distance} as distance
+      from (select ? as lat, ? as lon) this
+     cross join map_node other
+     where other.amenity = ?
+     order by distance
+     limit ?""".format(distance=DISTANCE)
+
+
+def mean_ms(lookups, lookup):
+    """
+        (mean milliseconds per lookup, [node ids found])
+    """
+    start = time.perf_counter()
+    found = [lookup(*arguments) for arguments in lookups]
+    return (time.perf_counter() - start) * 1000.0 / len(lookups), found
+
+
+if __name__ == '__main__':
+    arguments = argparse.ArgumentParser(description="Time nearest-neighbour lookups")
+    arguments.add_argument('osm_file', nargs='?')
+    arguments.add_argument('--nodes', type=int, default=200000, help="synthetic extract size")
+    arguments.add_argument('-k', type=int, default=10)
+    arguments.add_argument('--lookups', type=int, default=200)
+    args = arguments.parse_args()
+
+    scratch = tempfile.mkdtemp(prefix='bench_')
+    try:
+        osm_file = args.osm_file
+        if osm_file is None:
+            osm_file = os.path.join(scratch, 'synthetic.osm')
+            synthetic_osm.generate_osm(osm_file, args.nodes)
+        database = os.path.join(scratch, 'bench.db')
+        stats = sqlite_loader.load(osm_file, database)
+        print("loaded {} rows; R-tree built in {:.2f}s".format(
+            sum(stats['rows'].values()), stats['spatial_seconds']))
+
+        connection = sqlite3.connect(database)
+        # the map_node table of database_mysql: the points of interest
+        connection.execute("create table map_node as "
+                           "select node_id, lat, lon, amenity, shop, name from poi_rtree")
+        connection.execute("create unique index map_node_id on map_node(node_id)")
+        pois = connection.execute("select count(*) from map_node").fetchone()[0]
+        amenities = [amenity for amenity, in connection.execute(
+            "select distinct amenity from map_node where amenity is not null order by 1")]
+        if not pois or not amenities:
+            sys.exit("no points of interest in {}".format(osm_file))
+        index = spatial_index.SpatialIndex(connection)
+        # the first search with each filter scans the R-tree once for its density
+        index.nearest(0.0, 0.0)
+        for amenity in amenities:
+            index.nearest(0.0, 0.0, amenity=amenity)
+
+        rand = random.Random(0)
+        node_ids = [node_id for node_id, in connection.execute(
+            "select node_id from map_node order by random() limit ?", (args.lookups,))]
+        extent = connection.execute("select min(lat), max(lat), min(lon), max(lon) "
+                                    "from map_node").fetchone()
+        points = [(rand.uniform(extent[0], extent[1]), rand.uniform(extent[2], extent[3]),
+                   rand.choice(amenities)) for _ in range(args.lookups)]
+
+        cases = [
+            ("closest nodes to a node ({} pois)".format(pois),
+             [(node_id,) for node_id in node_ids],
+             lambda node_id: [row[0] for row in connection.execute(
+                 CLOSEST_NODES, (node_id, args.k))],
+             lambda node_id: [row[1] for row in index.nearest_to_node(node_id, args.k)]),
+            ("closest amenity to a point",
+             points,
+             lambda lat, lon, amenity: [row[0] for row in connection.execute(
+                 CLOSEST_AMENITY, (lat, lon, amenity, args.k))],
+             lambda lat, lon, amenity: [row[1] for row in index.nearest(
+                 lat, lon, args.k, amenity=amenity)]),
+        ]
+        print("{0: <40} {1: >12} {2: >12} {3: >8}".format('lookup, k={}'.format(args.k),
+                                                          'cross join', 'R-tree', 'speedup'))
+        for name, lookups, scan, search in cases:
+            scan_ms, scanned = mean_ms(lookups, scan)
+            search_ms, searched = mean_ms(lookups, search)
+            line = "{0: <40} {1: >10.3f}ms {2: >10.3f}ms {3: >7.0f}x".format(
+                name, scan_ms, search_ms, scan_ms / search_ms)
+            if scanned != searched:
+                line += "  (results differ)"
+            print(line)
+        connection.close()
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
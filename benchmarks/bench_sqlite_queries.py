@@ -0,0 +1,175 @@
+#!/usr/bin/env python
+"""
+    Time the README analytics queries on the SQLite tables three ways:
+    with only the lookup indexes and no statistics (as
+    create_indexes.sql used to build), with the covering indexes and
+    ANALYZE, and as a lookup in the summary tables of
+    create_summaries.sql
+
+    The database is built from osm_file with sqlite_loader.py, or from
+    a synthetic extract of --nodes nodes.  Where a summary query
+    answers the same question, its rows are checked against the
+    README query's.
+
+    usage: python benchmarks/bench_sqlite_queries.py [osm_file] [--nodes N]
+"""
+import argparse
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import sqlite_loader
+import synthetic_osm
+
+REPEAT = 5
+# the covering indexes of create_indexes.sql, dropped for the first timing
+ANALYTICS_INDEXES = ['node_tag_key_value', 'way_tag_key_value', 'node_uid_user',
+                     'way_uid_user', 'way_node_node_id']
+
+
+def tag_value_query(key):
+    return """
+        select tag_value, count(*) as num
+          from (select tag_value from node_tag where tag_key = '{0}'
+                union all
+                select tag_value from way_tag where tag_key = '{0}')
+         group by tag_value
+         order by num desc, tag_value
+         limit 10""".format(key)
+
+
+def tag_value_summary(key):
+    return """
+        select tag_value, total
+          from summary_tag_value
+         where tag_key = '{}'
+         order by total desc, tag_value
+         limit 10""".format(key)
+
+
+# name: (README query, summary table query or None)
+QUERIES = [
+    ('unique_users', """
+        select count(*)
+          from (select distinct node_uid as uid from node
+                union
+                select distinct way_uid as uid from way) combined""",
+     "select count(distinct uid) from summary_user"),
+    ('top_contributors', """
+        select user, count(*)
+          from (select node_uid as uid, node_user as user from node
+                union all
+                select way_uid as uid, way_user as user from way) combined
+         group by combined.uid, combined.user
+         order by count(*) desc, user
+         limit 10""",
+     "select user, edits from summary_user order by edits desc, user limit 10"),
+    ('top_way_tag_keys', """
+        select tag_type, tag_key, count(*)
+          from way_tag
+         group by 1, 2
+         order by 3 desc, 1, 2
+         limit 10""",
+     """
+        select tag_type, tag_key, ways
+          from summary_tag_key
+         order by ways desc, 1, 2
+         limit 10"""),
+    ('amenities', tag_value_query('amenity'), tag_value_summary('amenity')),
+    ('religions', tag_value_query('religion'), tag_value_summary('religion')),
+    ('denominations', tag_value_query('denomination'), tag_value_summary('denomination')),
+    ('restaurant_cuisines', """
+        select n1.tag_value, count(1) as num
+          from node_tag n1
+         inner join node_tag n2
+            on n2.node_id = n1.node_id
+           and n2.tag_value = 'restaurant'
+         where n1.tag_key = 'cuisine'
+         group by 1
+         order by 2 desc, 1
+         limit 10""",
+     """
+        select cuisine, nodes
+          from summary_amenity_cuisine
+         where amenity = 'restaurant'
+         order by nodes desc, cuisine
+         limit 10"""),
+    ('cross_streets', """
+        select cross_street_tags.tag_value
+          from way_node as main_street_nodes
+         inner join way_node as cross_street_nodes
+            on cross_street_nodes.node_id = main_street_nodes.node_id
+           and cross_street_nodes.way_id != main_street_nodes.way_id
+         inner join node
+            on node.node_id = cross_street_nodes.node_id
+         inner join way_tag cross_street_tags
+            on cross_street_tags.way_id = cross_street_nodes.way_id
+           and cross_street_tags.tag_key = 'name'
+         where main_street_nodes.way_id = (
+                select way_id from way_tag
+                 where tag_key = 'name' and tag_value like 'Bourbon Street')
+         order by node.node_lat, node.node_lon""",
+     None),
+]
+
+
+def best_ms(connection, sql):
+    """
+        (best milliseconds over REPEAT runs, rows)
+    """
+    best = None
+    for _ in range(REPEAT):
+        start = time.perf_counter()
+        rows = connection.execute(sql).fetchall()
+        elapsed = (time.perf_counter() - start) * 1000.0
+        best = elapsed if best is None else min(best, elapsed)
+    return best, rows
+
+
+if __name__ == '__main__':
+    arguments = argparse.ArgumentParser(description="Time the README queries on SQLite")
+    arguments.add_argument('osm_file', nargs='?')
+    arguments.add_argument('--nodes', type=int, default=200000, help="synthetic extract size")
+    args = arguments.parse_args()
+
+    scratch = tempfile.mkdtemp(prefix='bench_')
+    try:
+        osm_file = args.osm_file
+        if osm_file is None:
+            osm_file = os.path.join(scratch, 'synthetic.osm')
+            synthetic_osm.generate_osm(osm_file, args.nodes)
+        database = os.path.join(scratch, 'bench.db')
+        stats = sqlite_loader.load(osm_file, database)
+        print("loaded {} rows; indexes {:.2f}s, summaries {:.2f}s".format(
+            sum(stats['rows'].values()), stats['index_seconds'], stats['summary_seconds']))
+
+        connection = sqlite3.connect(database)
+        results = {}
+        for name in ANALYTICS_INDEXES:
+            connection.execute("drop index {}".format(name))
+        # nor were there statistics
+        connection.execute("drop table sqlite_stat1")
+        for name, sql, _ in QUERIES:
+            results[name] = [best_ms(connection, sql)]
+        with open(sqlite_loader.INDEXES_SQL) as handle:
+            connection.executescript(handle.read())
+        for name, sql, summary_sql in QUERIES:
+            results[name].append(best_ms(connection, sql))
+            results[name].append(best_ms(connection, summary_sql) if summary_sql else None)
+        connection.close()
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+
+    print("{0: <20} {1: >12} {2: >12} {3: >12}".format('query', 'lookup idx', 'covering', 'summary'))
+    for name, (before, indexed, summary) in results.items():
+        line = "{0: <20} {1: >10.2f}ms {2: >10.2f}ms".format(name, before[0], indexed[0])
+        if summary is not None:
+            line += " {0: >10.3f}ms".format(summary[0])
+            if summary[1] != indexed[1]:
+                line += "  (rows differ from the README query)"
+        print(line)
@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+"""
+    Compare cerberus.Validator with fast_validator.CompiledValidator
+
+    Times validating every shaped record of the map on its own,
+    and the cost of validation as a percentage of a full ingest.
+
+    usage: python benchmarks/bench_validators.py [osm_file]
+"""
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import data
+from osm_parsers import iter_shaped_elements
+
+
+def time_validator(records, name):
+    validator = data.make_validator(name)
+    start = time.perf_counter()
+    for record in records:
+        data.validate_element(record, validator)
+    return time.perf_counter() - start
+
+
+def time_ingest(osm_file, validate, validator):
+    output_directory = tempfile.mkdtemp(prefix='bench_')
+    try:
+        start = time.perf_counter()
+        data.process_map(osm_file, validate=validate, validator=validator,
+                         output_directory=output_directory)
+        return time.perf_counter() - start
+    finally:
+        shutil.rmtree(output_directory, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    osm_file = sys.argv[1] if len(sys.argv) > 1 else 'new_orleans_city_sample.osm'
+
+    records = list(iter_shaped_elements(osm_file, tags=('node', 'way')))
+    print("validating {} records".format(len(records)))
+    timings = {}
+    for name in ('cerberus', 'compiled'):
+        timings[name] = time_validator(records, name)
+        print("{0: <10} {1: >8.3f}s  {2: >10.0f} records/s".format(
+            name, timings[name], len(records) / timings[name]))
+    print("compiled is {:.1f}x faster".format(timings['cerberus'] / timings['compiled']))
+
+    baseline = time_ingest(osm_file, False, 'compiled')
+    for name in ('cerberus', 'compiled'):
+        elapsed = time_ingest(osm_file, True, name)
+        print("ingest with {0: <10} {1: >8.2f}s  (+{2:.1f}% over unvalidated {3:.2f}s)".format(
+            name, elapsed, 100.0 * (elapsed - baseline) / baseline, baseline))
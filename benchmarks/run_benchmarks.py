@@ -0,0 +1,284 @@
+#!/usr/bin/env python
+"""
+    Benchmark suite: micro-benchmarks of the hot functions and
+    end-to-end ingest throughput, written as JSON to diff between
+    commits
+
+    The input is an OSM file, or a synthetic one written by
+    synthetic_osm.py at the requested scale.  The micro-benchmarks
+    cover get_element, shape_element, shape_element_rows,
+    fix_street_name, validate_element, StreetMapCsvWriter (dict
+    and tuple records) and, with pyarrow installed, the parquet
+    ColumnarWriter.  They run on the first MICRO_ELEMENTS
+    elements, and each reports the best of --repeat runs.  The
+    end-to-end runs time process_map with and without validation in
+    a fresh interpreter each.  They report MB/s, elements/s and peak
+    RSS.
+
+    usage: python benchmarks/run_benchmarks.py [--osm FILE | --nodes N | --size-mb MB]
+                                               [--seed 0] [--output results.json]
+                                               [--compare baseline.json]
+"""
+import argparse
+import datetime
+import importlib.util
+import itertools
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import xml.parsers.expat
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import data
+import synthetic_osm
+
+MICRO_ELEMENTS = 50000
+REPEAT = 3
+MB = 1024.0 * 1024.0
+END_TO_END = {'process_map': dict(validate=False),
+              'process_map_validate': dict(validate=True)}
+
+
+def peak_rss_mb():
+    """
+        Peak resident set size of this process, None where neither
+        /proc nor the resource module is there
+    """
+    # VmHWM starts again at exec; ru_maxrss of a child started by a
+    # fork of this process keeps the parent's high-water mark on Linux
+    try:
+        with open('/proc/self/status') as handle:
+            for line in handle:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024.0
+    except OSError:
+        pass
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on linux, bytes on macOS
+    return peak / (MB if sys.platform == 'darwin' else 1024.0)
+
+
+def count_elements(osm_file):
+    counts = {tag: 0 for tag in data.ELEMENT_TAGS}
+    depth = [0]
+
+    def start_element(name, attrs):
+        depth[0] += 1
+        if depth[0] == 2 and name in counts:
+            counts[name] += 1
+
+    def end_element(name):
+        depth[0] -= 1
+
+    parser = xml.parsers.expat.ParserCreate()
+    parser.StartElementHandler = start_element
+    parser.EndElementHandler = end_element
+    with open(osm_file, 'rb') as handle:
+        parser.ParseFile(handle)
+    return counts
+
+
+def best_time(function, repeat):
+    """
+        (best seconds, items) over repeat calls of function,
+        which returns the number of items it handled
+    """
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        items = function()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, items
+
+
+def _write_all(records, write, output_format='csv'):
+    output_directory = tempfile.mkdtemp(prefix='bench_')
+    try:
+        writer = data.make_writer(output_directory, output_format)
+        for record in records:
+            write(record, writer)
+        writer.close()
+    finally:
+        shutil.rmtree(output_directory, ignore_errors=True)
+    return len(records)
+
+
+def micro_benchmarks(osm_file, repeat):
+    """
+        Return {name: result} for the hot functions
+    """
+    size = os.path.getsize(osm_file)
+    elements = list(itertools.islice(data.get_element(osm_file), MICRO_ELEMENTS))
+    shaped = [data.shape_element(element) for element in elements]
+    rows = [data.shape_element_rows(element) for element in elements]
+    streets = [tag.get('v') for element in elements for tag in element.iter('tag')
+               if data.is_street_name(tag.get('k'))]
+    validator = data.make_validator('compiled')
+
+    def validate():
+        for record in shaped:
+            data.validate_element(record, validator)
+        return len(shaped)
+
+    cases = [
+        ('get_element', lambda: sum(1 for _ in data.get_element(osm_file))),
+        ('shape_element', lambda: len([data.shape_element(element) for element in elements])),
+        ('shape_element_rows', lambda: len([data.shape_element_rows(element) for element in elements])),
+        ('fix_street_name', lambda: len([data.fix_street_name(street) for street in streets])),
+        ('validate_element', validate),
+        ('csv_writer_dicts', lambda: _write_all(shaped, data.write_element)),
+        ('csv_writer_rows', lambda: _write_all(rows, data.write_element_rows)),
+    ]
+    if importlib.util.find_spec('pyarrow') is not None:
+        cases.append(('parquet_writer_rows',
+                      lambda: _write_all(rows, data.write_element_rows, 'parquet')))
+    results = {}
+    for name, function in cases:
+        seconds, items = best_time(function, repeat)
+        results[name] = {'seconds': seconds, 'items': items,
+                         'items_per_s': items / seconds if seconds else None}
+        if name == 'get_element':
+            results[name]['mb_per_s'] = size / MB / seconds
+    return results
+
+
+def run_end_to_end(name, osm_file):
+    """
+        Time one END_TO_END case in this process
+    """
+    output_directory = tempfile.mkdtemp(prefix='bench_')
+    try:
+        start = time.perf_counter()
+        data.process_map(osm_file, output_directory=output_directory, **END_TO_END[name])
+        seconds = time.perf_counter() - start
+    finally:
+        shutil.rmtree(output_directory, ignore_errors=True)
+    return {'seconds': seconds, 'peak_rss_mb': peak_rss_mb()}
+
+
+def end_to_end_benchmarks(osm_file, num_elements, repeat):
+    """
+        Run each END_TO_END case in a fresh interpreter, so peak
+        RSS (VmHWM, see peak_rss_mb) belongs to that case alone
+    """
+    size = os.path.getsize(osm_file)
+    results = {}
+    for name in END_TO_END:
+        best = None
+        for _ in range(repeat):
+            child = subprocess.run([sys.executable, os.path.abspath(__file__), '--end-to-end', name,
+                                    '--osm', osm_file],
+                                   stdout=subprocess.PIPE, check=True, universal_newlines=True)
+            # process_map prints progress; the result is the last line
+            result = json.loads(child.stdout.strip().splitlines()[-1])
+            if best is None or result['seconds'] < best['seconds']:
+                best = result
+        best.update(items=num_elements, items_per_s=num_elements / best['seconds'],
+                    mb_per_s=size / MB / best['seconds'])
+        results[name] = best
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL,
+                                       cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       universal_newlines=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline):
+    """
+        Print the throughput change of each benchmark against baseline
+    """
+    if results['input'] != baseline['input']:
+        print("note: the baseline was run on a different input")
+    print("{0: <22} {1: >14} {2: >14} {3: >8}".format('benchmark', 'baseline/s', 'current/s', 'change'))
+    for name, result in results['benchmarks'].items():
+        old = baseline['benchmarks'].get(name)
+        if not old or not old.get('items_per_s') or not result.get('items_per_s'):
+            continue
+        change = 100.0 * (result['items_per_s'] / old['items_per_s'] - 1)
+        print("{0: <22} {1: >14.0f} {2: >14.0f} {3: >+7.1f}%".format(
+            name, old['items_per_s'], result['items_per_s'], change))
+
+
+if __name__ == '__main__':
+    arguments = argparse.ArgumentParser(description="Run the benchmark suite")
+    arguments.add_argument('--osm', help="benchmark this file instead of a synthetic one")
+    arguments.add_argument('--nodes', type=int, default=200000, help="synthetic file size in nodes")
+    arguments.add_argument('--size-mb', type=float, help="synthetic file size in MB")
+    arguments.add_argument('--seed', type=int, default=0)
+    arguments.add_argument('--dirty-rate', type=float, default=0.3)
+    arguments.add_argument('--repeat', type=int, default=REPEAT)
+    arguments.add_argument('--skip-end-to-end', action='store_true')
+    arguments.add_argument('--output', default='benchmark_results.json')
+    arguments.add_argument('--compare', metavar='BASELINE', help="results file to compare against")
+    arguments.add_argument('--end-to-end', help=argparse.SUPPRESS)
+    args = arguments.parse_args()
+
+    if args.end_to_end:
+        # child process of end_to_end_benchmarks
+        print(json.dumps(run_end_to_end(args.end_to_end, args.osm)))
+        sys.exit(0)
+
+    synthetic = None
+    osm_file = args.osm
+    scratch = None
+    if osm_file is None:
+        options = dict(dirty_rate=args.dirty_rate, seed=args.seed)
+        nodes = synthetic_osm.nodes_for_size(args.size_mb, **options) if args.size_mb else args.nodes
+        scratch = tempfile.mkdtemp(prefix='bench_')
+        osm_file = os.path.join(scratch, 'synthetic.osm')
+        synthetic_osm.generate_osm(osm_file, nodes, **options)
+        synthetic = dict(options, nodes=nodes)
+
+    try:
+        counts = count_elements(osm_file)
+        num_elements = sum(counts.values())
+        results = {
+            'meta': {'commit': git_commit(),
+                     'date': datetime.datetime.now().isoformat(timespec='seconds'),
+                     'python': platform.python_version(),
+                     'platform': platform.platform(),
+                     'cpu_count': os.cpu_count()},
+            'input': {'file': None if synthetic else osm_file,
+                      'synthetic': synthetic,
+                      'bytes': os.path.getsize(osm_file),
+                      'elements': counts},
+            'benchmarks': micro_benchmarks(osm_file, args.repeat),
+        }
+        if not args.skip_end_to_end:
+            results['benchmarks'].update(end_to_end_benchmarks(osm_file, num_elements, args.repeat))
+    finally:
+        if scratch:
+            shutil.rmtree(scratch, ignore_errors=True)
+
+    for name, result in results['benchmarks'].items():
+        line = "{0: <22} {1: >8.3f}s  {2: >10.0f} items/s".format(
+            name, result['seconds'], result['items_per_s'])
+        if 'mb_per_s' in result:
+            line += "  {:7.1f} MB/s".format(result['mb_per_s'])
+        if result.get('peak_rss_mb') is not None:
+            line += "  peak RSS {:.0f} MB".format(result['peak_rss_mb'])
+        print(line)
+
+    with open(args.output, 'w') as handle:
+        json.dump(results, handle, indent=2, sort_keys=True)
+    print("results written to {}".format(args.output))
+
+    if args.compare:
+        with open(args.compare) as handle:
+            compare(results, json.load(handle))
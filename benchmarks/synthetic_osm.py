@@ -0,0 +1,267 @@
+#!/usr/bin/env python
+"""
+    Write a synthetic OSM XML file for benchmarking at any scale
+
+    The output looks like a city extract: nodes come first, with ids
+    that increase and have gaps. A share of the nodes are address
+    points. Ways are made of nearby nodes. Buildings are closed, and
+    streets carry name and tiger tags. A few relations group ways and
+    nodes. The same seed and parameters always give the same file.
+
+    dirty_rate sets the share of street names written the way the
+    audit found them in New Orleans: abbreviated street types
+    ("Magazine St."), direction prefixes ("N Claiborne Ave"), the
+    fullname_mapping oddities of data.py and stray whitespace.
+    problem_key_rate sets the share of tag keys with characters
+    shape_element drops.
+
+    usage: python benchmarks/synthetic_osm.py output.osm [--nodes N | --size-mb MB]
+                                              [--ways N] [--seed 0] [--dirty-rate 0.3]
+"""
+import argparse
+import array
+import io
+import os
+import random
+import sys
+from xml.sax.saxutils import quoteattr
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import data
+
+# New Orleans
+MIN_LAT, MAX_LAT = 29.86, 30.08
+MIN_LON, MAX_LON = -90.14, -89.90
+
+FIRST_NODE_ID = 115000000
+FIRST_WAY_ID = 11000000
+FIRST_RELATION_ID = 100000
+
+STREET_BASES = ["Canal", "Magazine", "Royal", "Bourbon", "Chartres", "Decatur", "Dauphine",
+                "Burgundy", "Rampart", "Esplanade", "Elysian Fields", "Frenchmen", "Napoleon",
+                "Tchoupitoulas", "Saint Charles", "Carrollton", "Claiborne", "Broad", "Gentilly",
+                "Freret", "Prytania", "Coliseum", "Annunciation", "Louisiana", "Jefferson",
+                "Orleans", "Tulane", "Poydras", "Baronne", "Carondelet", "Banks", "Dumaine",
+                "Ursulines", "Marigny", "Press", "Piety", "Desire", "Music", "Arts", "Painters"]
+# street types written out and their abbreviations found in the audit
+ABBREVIATIONS = {}
+for _short, _full in data.to_fix.items():
+    ABBREVIATIONS.setdefault(_full, []).append(_short)
+DIRECTIONS = ['N', 'S', 'E', 'W']
+USERS = ["woodpeck_fixbot", "ELadner", "Kenneth Pardue", "maxerickson", "wvdp", "Matt Toups",
+         "ngwgus", "TIGERcnl", "bhousel", "Jacob Brown"]
+AMENITIES = ["restaurant", "bar", "cafe", "school", "place_of_worship", "fast_food", "bank",
+             "pharmacy", "parking", "fuel"]
+HIGHWAYS = ["residential", "residential", "residential", "service", "tertiary", "secondary",
+            "primary", "footway"]
+PROBLEM_KEYS = ["fixme?", "addr street", "note#1", "name;old", "url/path"]
+# share of nodes with tags; they carry node_tags / TAGGED_NODES tags on average
+TAGGED_NODES = 0.15
+NODE_ATTRS = ('id', 'lat', 'lon', 'version', 'timestamp', 'changeset', 'uid', 'user')
+
+
+class _Generator():
+
+    def __init__(self, seed, dirty_rate, problem_key_rate):
+        self.random = random.Random(seed)
+        self.dirty_rate = dirty_rate
+        self.problem_key_rate = problem_key_rate
+        self.messy_names = sorted(data.fullname_mapping)
+
+    def street_name(self):
+        rand = self.random
+        base = rand.choice(STREET_BASES)
+        street_type = rand.choice(data.expected)
+        if rand.random() >= self.dirty_rate:
+            return "{} {}".format(base, street_type)
+        kind = rand.randrange(4)
+        if kind == 0 and street_type in ABBREVIATIONS:
+            return "{} {}".format(base, rand.choice(ABBREVIATIONS[street_type]))
+        elif kind == 1:
+            return "{} {} {}".format(rand.choice(DIRECTIONS), base, street_type)
+        elif kind == 2:
+            return rand.choice(self.messy_names)
+        return " {} {} ".format(base, street_type)
+
+    def key(self, key):
+        if self.problem_key_rate and self.random.random() < self.problem_key_rate:
+            return self.random.choice(PROBLEM_KEYS)
+        return key
+
+    def count(self, mean):
+        """
+            A tag count with the given mean
+        """
+        whole = int(mean)
+        return whole + (1 if self.random.random() < mean - whole else 0)
+
+    def meta(self):
+        rand = self.random
+        user = rand.randrange(len(USERS))
+        return {'version': str(rand.randint(1, 9)),
+                'timestamp': "20{:02d}-{:02d}-{:02d}T{:02d}:{:02d}:{:02d}Z".format(
+                    rand.randint(8, 20), rand.randint(1, 12), rand.randint(1, 28),
+                    rand.randrange(24), rand.randrange(60), rand.randrange(60)),
+                'changeset': str(rand.randint(1000000, 60000000)),
+                'uid': str(10000 + user * 137),
+                'user': USERS[user]}
+
+    def node_tags(self, mean):
+        rand = self.random
+        tags = []
+        num_tags = self.count(mean)
+        if num_tags >= 2:
+            tags.append((self.key('addr:housenumber'), str(rand.randint(1, 9999))))
+            tags.append((self.key('addr:street'), self.street_name()))
+            num_tags -= 2
+        for _ in range(num_tags):
+            if rand.random() < 0.5:
+                tags.append((self.key('amenity'), rand.choice(AMENITIES)))
+            else:
+                tags.append((self.key('name'), "{} {}".format(rand.choice(STREET_BASES),
+                                                              rand.choice(AMENITIES).title())))
+        return tags
+
+    def way_tags(self, mean, building):
+        rand = self.random
+        tags = []
+        num_tags = self.count(mean)
+        if building:
+            tags.append((self.key('building'), 'yes'))
+            if num_tags >= 3:
+                tags.append((self.key('addr:housenumber'), str(rand.randint(1, 9999))))
+                tags.append((self.key('addr:street'), self.street_name()))
+        else:
+            name = self.street_name()
+            tags.append((self.key('highway'), rand.choice(HIGHWAYS)))
+            tags.append((self.key('name'), name))
+            extra = [('tiger:county', 'Orleans, LA'), ('tiger:cfcc', 'A41'),
+                     ('tiger:name_base', name.strip().rsplit(' ', 1)[0]),
+                     ('tiger:reviewed', 'no'), ('oneway', 'yes'), ('source', 'tiger_import')]
+            for key, value in extra[:max(num_tags - 2, 0)]:
+                tags.append((self.key(key), value))
+        return tags
+
+
+def _write_tags(output, tags):
+    for key, value in tags:
+        output.write('    <tag k={} v={}/>\n'.format(quoteattr(key), quoteattr(value)))
+
+
+def write_osm(output, nodes, ways=None, relations=None, node_tags=0.4, way_tags=3.0,
+              nodes_per_way=8, dirty_rate=0.3, problem_key_rate=0.005, seed=0):
+    """
+        Write a synthetic extract to the text stream output
+
+        nodes / ways / relations: element counts (ways default to one
+        per ten nodes, relations to one per hundred ways)
+        node_tags / way_tags: mean tags per node / way
+        nodes_per_way: mean nodes per way
+    """
+    if ways is None:
+        ways = nodes // 10
+    if relations is None:
+        relations = ways // 100
+    generator = _Generator(seed, dirty_rate, problem_key_rate)
+    rand = generator.random
+    write = output.write
+
+    write('<?xml version="1.0" encoding="UTF-8"?>\n'
+          '<osm version="0.6" generator="synthetic_osm.py">\n')
+    # 8 bytes a node, for the way and relation references
+    node_ids = array.array('q')
+    node_id = FIRST_NODE_ID
+    for _ in range(nodes):
+        node_id += rand.randint(1, 3)
+        node_ids.append(node_id)
+        attrs = generator.meta()
+        attrs['id'] = str(node_id)
+        attrs['lat'] = '{:.7f}'.format(rand.uniform(MIN_LAT, MAX_LAT))
+        attrs['lon'] = '{:.7f}'.format(rand.uniform(MIN_LON, MAX_LON))
+        attr_string = ' '.join('{}={}'.format(name, quoteattr(attrs[name])) for name in NODE_ATTRS)
+        tags = generator.node_tags(node_tags / TAGGED_NODES) if rand.random() < TAGGED_NODES else []
+        if tags:
+            write('  <node {}>\n'.format(attr_string))
+            _write_tags(output, tags)
+            write('  </node>\n')
+        else:
+            write('  <node {}/>\n'.format(attr_string))
+
+    for way_index in range(ways):
+        building = rand.random() < 0.6
+        size = max(2, int(rand.expovariate(1.0 / nodes_per_way))) if nodes else 0
+        start = rand.randrange(max(nodes - size, 1)) if nodes else 0
+        refs = node_ids[start:start + size]
+        if building and len(refs) >= 3:
+            refs = refs + refs[:1]
+        attrs = generator.meta()
+        write('  <way id="{}" {}>\n'.format(
+            FIRST_WAY_ID + way_index,
+            ' '.join('{}={}'.format(name, quoteattr(attrs[name])) for name in NODE_ATTRS[3:])))
+        for ref in refs:
+            write('    <nd ref="{}"/>\n'.format(ref))
+        _write_tags(output, generator.way_tags(way_tags, building))
+        write('  </way>\n')
+
+    for relation_index in range(relations):
+        attrs = generator.meta()
+        write('  <relation id="{}" {}>\n'.format(
+            FIRST_RELATION_ID + relation_index,
+            ' '.join('{}={}'.format(name, quoteattr(attrs[name])) for name in NODE_ATTRS[3:])))
+        for _ in range(rand.randint(2, 12)):
+            if ways and rand.random() < 0.8:
+                write('    <member type="way" ref="{}" role="{}"/>\n'.format(
+                    FIRST_WAY_ID + rand.randrange(ways), rand.choice(['outer', 'inner', ''])))
+            elif nodes:
+                write('    <member type="node" ref="{}" role="stop"/>\n'.format(rand.choice(node_ids)))
+        _write_tags(output, [('type', rand.choice(['multipolygon', 'route'])),
+                             ('name', generator.street_name())])
+        write('  </relation>\n')
+    write('</osm>\n')
+
+
+def generate_osm(path, nodes, **kwargs):
+    """
+        Write a synthetic extract to path (see write_osm)
+        and return its size in bytes
+    """
+    with open(path, 'w', encoding='utf-8', buffering=1024 * 1024) as output:
+        write_osm(output, nodes, **kwargs)
+    return os.path.getsize(path)
+
+
+def nodes_for_size(size_mb, **kwargs):
+    """
+        The node count that makes a file of about size_mb
+        with these parameters
+    """
+    sample_nodes = 20000
+    output = io.StringIO()
+    write_osm(output, sample_nodes, **kwargs)
+    bytes_per_node = len(output.getvalue().encode('utf-8')) / float(sample_nodes)
+    return int(size_mb * 1024 * 1024 / bytes_per_node)
+
+
+if __name__ == '__main__':
+    arguments = argparse.ArgumentParser(description="Write a synthetic OSM file")
+    arguments.add_argument('output')
+    arguments.add_argument('--nodes', type=int, default=200000)
+    arguments.add_argument('--size-mb', type=float, help="pick the node count for this size")
+    arguments.add_argument('--ways', type=int)
+    arguments.add_argument('--relations', type=int)
+    arguments.add_argument('--node-tags', type=float, default=0.4, help="mean tags per node")
+    arguments.add_argument('--way-tags', type=float, default=3.0, help="mean tags per way")
+    arguments.add_argument('--dirty-rate', type=float, default=0.3,
+                           help="share of street names needing a fix")
+    arguments.add_argument('--problem-key-rate', type=float, default=0.005)
+    arguments.add_argument('--seed', type=int, default=0)
+    args = arguments.parse_args()
+
+    options = dict(node_tags=args.node_tags, way_tags=args.way_tags, dirty_rate=args.dirty_rate,
+                   problem_key_rate=args.problem_key_rate, seed=args.seed)
+    nodes = args.nodes
+    if args.size_mb:
+        nodes = nodes_for_size(args.size_mb, **options)
+    size = generate_osm(args.output, nodes, ways=args.ways, relations=args.relations, **options)
+    print("wrote {} ({:.1f} MB, {} nodes)".format(args.output, size / (1024.0 * 1024.0), nodes))
@@ -0,0 +1,176 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+    Checkpoints for long running process_map runs
+
+    Every few elements the csv (and rejects) files are flushed and
+    a checkpoint is written next to them:
+
+        {"input": "new-orleans_louisiana.osm",
+         "input_size": 123456789,
+         "offset": 98765432,        <- where the next element starts
+         "last_id": ["way", "1234"],
+         "elements": 950000,
+         "files": {"nodes.csv": {"bytes": ..., "rows": ...}, ...},
+         "rejects": {...rejects summary...}}
+
+    To resume, every output file is cut back to its checkpointed size
+    and parsing restarts at offset, so no row is written twice or lost.
+    The checkpoint is removed once the run completes.
+
+    Only serial runs on the expat backend can be checkpointed: the
+    offsets come from the expat parser (see osm_parsers.iter_expat).
+"""
+import json
+import os
+
+import parallel_ingest
+from rejects import REJECTS_SUFFIX
+
+CHECKPOINT_FILENAME = "checkpoint.json"
+# elements between checkpoints
+CHECKPOINT_EVERY = 100000
+
+
+def load_checkpoint(path):
+    """
+        Return the checkpoint at path, or None when there is none
+    """
+    if not os.path.exists(path):
+        return None
+    with open(path) as handle:
+        return json.load(handle)
+
+
+def _save_json(path, document):
+    """
+        Write document to path atomically, so a crash never
+        leaves a half written checkpoint behind
+    """
+    temp_path = path + ".tmp"
+    with open(temp_path, 'w') as handle:
+        json.dump(document, handle, indent=2)
+        handle.flush()
+        os.fsync(handle.fileno())
+    os.replace(temp_path, path)
+
+
+def _element_id(el):
+    """
+        ('node' | 'way' | 'relation', id) of a shaped dict or tuple record
+    """
+    kind = next(kind for kind in ('node', 'way', 'relation') if kind in el)
+    main = el[kind]
+    return [kind, main['id'] if isinstance(main, dict) else main[0]]
+
+
+def restore_outputs(checkpoint, output_directory):
+    """
+        Cut every output file back to its size at the checkpoint,
+        dropping rows written after it
+    """
+    for filename, state in checkpoint['files'].items():
+        filepath = os.path.join(output_directory, filename)
+        if not os.path.exists(filepath) or os.path.getsize(filepath) < state['bytes']:
+            raise ValueError("{} is shorter than its checkpoint, cannot resume".format(filepath))
+        with open(filepath, 'r+b') as handle:
+            handle.truncate(state['bytes'])
+
+    # rejects files started after the checkpoint
+    for filename in os.listdir(output_directory):
+        if filename.endswith(REJECTS_SUFFIX) and filename not in checkpoint['files']:
+            os.remove(os.path.join(output_directory, filename))
+
+
+def resume_input(file_in, checkpoint):
+    """
+        Return (file-like object, base offset) to parse file_in from
+        the checkpointed offset (see osm_parsers.iter_expat)
+    """
+    input_size = os.path.getsize(file_in)
+    if input_size != checkpoint['input_size']:
+        raise ValueError("{} has changed since the checkpoint was written".format(file_in))
+
+    # the elements after offset are wrapped in a root element, as the
+    # parallel shards are; the rest of the file closes it
+    prefix = b'<osm>'
+    reader = parallel_ingest.ByteRangeReader(file_in, checkpoint['offset'], input_size,
+                                             prefix=prefix)
+    return reader, checkpoint['offset'] - len(prefix)
+
+
+class Checkpointer():
+    """
+        Writes a checkpoint every `every` elements of a serial run
+    """
+
+    def __init__(self, path, file_in, output_directory, writer, rejects=None,
+                 every=CHECKPOINT_EVERY, checkpoint=None):
+        """
+            path: checkpoint file
+            writer: the run's StreetMapCsvWriter
+            rejects: the run's RejectSink, if any
+            checkpoint: the checkpoint being resumed from, if any
+        """
+        self._path = path
+        self._output_directory = output_directory
+        self._file_in = file_in
+        self._input_size = os.path.getsize(file_in)
+        self._writer = writer
+        self._rejects = rejects
+        self._every = every
+        self.elements = checkpoint['elements'] if checkpoint else 0
+        self.last_id = checkpoint['last_id'] if checkpoint else None
+
+    def track(self, records):
+        """
+            Take (offset, record) pairs and yield the records,
+            checkpointing between them
+
+            The consumer has handed every earlier record to the
+            writer by the time the next one is asked for, so
+            flushing then captures exactly the records before offset.
+        """
+        for offset, el in records:
+            if self.elements and self.elements % self._every == 0:
+                self.save(offset)
+            yield el
+            self.elements += 1
+            self.last_id = _element_id(el)
+
+    def save(self, offset):
+        """
+            Flush the outputs and checkpoint with parsing
+            to restart at offset
+        """
+        self._writer.flush()
+        directory = self._output_directory
+        files = {}
+        row_counts = self._writer.row_counts
+        for filename in self._writer.filenames:
+            files[filename] = {'bytes': os.path.getsize(os.path.join(directory, filename)),
+                               'rows': row_counts[filename]}
+
+        rejects = None
+        if self._rejects is not None:
+            self._rejects.flush()
+            for filename in self._rejects.filenames:
+                files[filename] = {'bytes': os.path.getsize(os.path.join(directory, filename))}
+            rejects = self._rejects.summary()
+
+        _save_json(self._path, {
+            'input': os.path.abspath(self._file_in),
+            'input_size': self._input_size,
+            'offset': offset,
+            'last_id': self.last_id,
+            'elements': self.elements,
+            'files': files,
+            'rejects': rejects,
+        })
+
+    def complete(self):
+        """
+            The run finished: the checkpoint is no longer needed
+        """
+        if os.path.exists(self._path):
+            os.remove(self._path)
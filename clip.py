@@ -0,0 +1,457 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+    Cut a bounding box or polygon out of an OSM XML file
+
+    The output is an OSM XML file of its own, so it can go through
+    data.py like any other extract.  It holds:
+
+        - the nodes inside the area
+        - the ways that reference at least one of those nodes
+        - with complete_ways, every node of those ways, so the
+          ways keep their full geometry
+        - the relations with a member among the above
+
+    The input is streamed twice:
+
+        pass 1  decides what to keep.  Node coordinates are tested
+                against the area a batch at a time (vectorized ray
+                casting), and the ids that pass are recorded in
+                bitmaps: one bit per id, in blocks allocated as ids
+                show up, so memory stays small on multi-GB inputs.
+        pass 2  copies the bytes of the kept elements to the output,
+                unchanged.
+
+    usage: python clip.py input.osm output.osm --bbox min_lat,min_lon,max_lat,max_lon
+           python clip.py input.osm output.osm --poly parish.poly [--complete-ways]
+"""
+import argparse
+import xml.parsers.expat
+
+import numpy as np
+
+from parallel_ingest import _find_document_end
+
+READ_SIZE = 64 * 1024
+# nodes / ways tested per batch
+BATCH_SIZE = 65536
+# ids per bitmap block (2 ** 9 ids = 64 bytes)
+BLOCK_SHIFT = 9
+
+
+class IdBitmap():
+    """
+        A set of element ids, one bit per id
+
+        The id space is split into blocks of 2 ** BLOCK_SHIFT ids.
+        Only blocks holding an id get bits (a row of self._bits);
+        self._directory maps each block to its row, or -1.  OSM ids
+        are scattered over ~1e10, so this takes a small fraction of
+        a flat bitmap while every operation stays vectorized.
+
+        Negative ids (new objects in editor files) go, as ~id, to
+        an IdBitmap of their own.
+    """
+
+    def __init__(self):
+        self._directory = np.full(0, -1, dtype=np.int32)
+        self._bits = np.zeros((0, 1 << (BLOCK_SHIFT - 3)), dtype=np.uint8)
+        self._rows = 0
+        self._mask = (1 << BLOCK_SHIFT) - 1
+        self._negative = None
+
+    def add(self, ids):
+        ids = np.asarray(ids, dtype=np.int64)
+        negative = ids < 0
+        if negative.any():
+            if self._negative is None:
+                self._negative = IdBitmap()
+            self._negative.add(~ids[negative])
+            ids = ids[~negative]
+        if len(ids) == 0:
+            return
+        blocks = ids >> BLOCK_SHIFT
+        if blocks.max() >= len(self._directory):
+            grown = np.full(max(int(blocks.max()) + 1, 2 * len(self._directory)), -1, dtype=np.int32)
+            grown[:len(self._directory)] = self._directory
+            self._directory = grown
+
+        new_blocks = np.unique(blocks[self._directory[blocks] < 0])
+        if len(new_blocks):
+            needed = self._rows + len(new_blocks)
+            if needed > len(self._bits):
+                grown = np.zeros((max(needed, 2 * len(self._bits)), self._bits.shape[1]), dtype=np.uint8)
+                grown[:self._rows] = self._bits[:self._rows]
+                self._bits = grown
+            self._directory[new_blocks] = np.arange(self._rows, needed, dtype=np.int32)
+            self._rows = needed
+
+        offsets = ids & self._mask
+        np.bitwise_or.at(self._bits, (self._directory[blocks], offsets >> 3),
+                         (1 << (offsets & 7)).astype(np.uint8))
+
+    def contains(self, ids):
+        """
+            Return a boolean array: which of ids are in the set
+        """
+        ids = np.asarray(ids, dtype=np.int64)
+        blocks = ids >> BLOCK_SHIFT
+        rows = np.full(len(ids), -1, dtype=np.int32)
+        known = (blocks >= 0) & (blocks < len(self._directory))
+        rows[known] = self._directory[blocks[known]]
+        found = rows >= 0
+        offsets = ids[found] & self._mask
+        found[found] = (self._bits[rows[found], offsets >> 3] >> (offsets & 7)) & 1 == 1
+        if self._negative is not None:
+            negative = ids < 0
+            found[negative] = self._negative.contains(~ids[negative])
+        return found
+
+    def __contains__(self, element_id):
+        return bool(self.contains([int(element_id)])[0])
+
+    def __len__(self):
+        negatives = 0 if self._negative is None else len(self._negative)
+        return int(np.unpackbits(self._bits[:self._rows]).sum()) + negatives
+
+    @property
+    def nbytes(self):
+        negatives = 0 if self._negative is None else self._negative.nbytes
+        return self._directory.nbytes + self._bits.nbytes + negatives
+
+
+# ================================================== #
+#               Areas                                #
+# ================================================== #
+class BoundingBox():
+
+    def __init__(self, min_lat, min_lon, max_lat, max_lon):
+        self.bounds = (min_lat, min_lon, max_lat, max_lon)
+
+    def contains(self, lats, lons):
+        min_lat, min_lon, max_lat, max_lon = self.bounds
+        return (lats >= min_lat) & (lats <= max_lat) & (lons >= min_lon) & (lons <= max_lon)
+
+
+def _in_ring(ring, lats, lons):
+    """
+        Even-odd ray casting of every point against one ring,
+        looping over the edges and vectorized over the points
+    """
+    inside = np.zeros(len(lats), dtype=bool)
+    ring_lats, ring_lons = ring[:, 0], ring[:, 1]
+    previous = len(ring) - 1
+    for current in range(len(ring)):
+        lat_i, lon_i = ring_lats[current], ring_lons[current]
+        lat_j, lon_j = ring_lats[previous], ring_lons[previous]
+        crosses = (lat_i > lats) != (lat_j > lats)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            edge_lon = (lon_j - lon_i) * (lats - lat_i) / (lat_j - lat_i) + lon_i
+        inside ^= crosses & (lons < edge_lon)
+        previous = current
+    return inside
+
+
+class Polygon():
+    """
+        Outer rings and holes, each a list of (lat, lon)
+    """
+
+    def __init__(self, rings, holes=()):
+        self.rings = [np.asarray(ring, dtype=np.float64) for ring in rings]
+        self.holes = [np.asarray(hole, dtype=np.float64) for hole in holes]
+        points = np.concatenate(self.rings)
+        self._box = BoundingBox(points[:, 0].min(), points[:, 1].min(),
+                                points[:, 0].max(), points[:, 1].max())
+
+    def contains(self, lats, lons):
+        inside = self._box.contains(lats, lons)
+        candidates = np.flatnonzero(inside)
+        if len(candidates) == 0:
+            return inside
+        lats, lons = lats[candidates], lons[candidates]
+        in_rings = np.zeros(len(candidates), dtype=bool)
+        for ring in self.rings:
+            in_rings |= _in_ring(ring, lats, lons)
+        for hole in self.holes:
+            in_rings &= ~_in_ring(hole, lats, lons)
+        inside[candidates] = in_rings
+        return inside
+
+
+def load_poly(path):
+    """
+        Read an osmosis .poly file (the polygon format used for OSM
+        extracts): a name, then sections of "lon lat" lines each
+        closed by END.  Sections whose name starts with ! are holes.
+    """
+    rings, holes = [], []
+    with open(path) as handle:
+        lines = [line.strip() for line in handle]
+    # the first line is the polygon's name
+    index = 1
+    while index < len(lines) and lines[index] != 'END':
+        name = lines[index]
+        index += 1
+        ring = []
+        while lines[index] != 'END':
+            lon, lat = lines[index].split()[:2]
+            ring.append((float(lat), float(lon)))
+            index += 1
+        index += 1
+        (holes if name.startswith('!') else rings).append(ring)
+    return Polygon(rings, holes)
+
+
+# ================================================== #
+#               Pass 1: select                       #
+# ================================================== #
+class _Selector():
+    """
+        expat callbacks for pass 1
+    """
+
+    def __init__(self, area, complete_ways):
+        self._area = area
+        self._complete_ways = complete_ways
+        self.nodes = IdBitmap()
+        self.way_nodes = IdBitmap()
+        self.ways = IdBitmap()
+        self.relations = IdBitmap()
+        self._depth = 0
+        self._node_batch = ([], [], [])
+        self._way_batch = ([], [], [])
+        self._refs = None
+        self._members = None
+        self._element_id = None
+
+    def start_element(self, name, attrs):
+        self._depth += 1
+        if self._depth == 2:
+            self._element_id = attrs.get('id')
+            if name == 'node':
+                ids, lats, lons = self._node_batch
+                ids.append(attrs['id'])
+                lats.append(attrs['lat'])
+                lons.append(attrs['lon'])
+                if len(ids) >= BATCH_SIZE:
+                    self.flush_nodes()
+            elif name == 'way':
+                self.flush_nodes()
+                self._refs = []
+            elif name == 'relation':
+                self.flush_ways()
+                self._members = []
+        elif self._depth == 3:
+            if name == 'nd' and self._refs is not None:
+                self._refs.append(attrs['ref'])
+            elif name == 'member' and self._members is not None:
+                self._members.append((attrs.get('type'), int(attrs['ref'])))
+
+    def end_element(self, name):
+        if self._depth == 2:
+            if self._refs is not None:
+                way_ids, counts, refs = self._way_batch
+                way_ids.append(self._element_id)
+                counts.append(len(self._refs))
+                refs.extend(self._refs)
+                self._refs = None
+                if len(way_ids) >= BATCH_SIZE:
+                    self.flush_ways()
+            elif self._members is not None:
+                self._select_relation()
+                self._members = None
+        self._depth -= 1
+
+    def flush_nodes(self):
+        ids, lats, lons = self._node_batch
+        if ids:
+            inside = self._area.contains(np.array(lats, dtype=np.float64),
+                                         np.array(lons, dtype=np.float64))
+            self.nodes.add(np.array(ids, dtype=np.int64)[inside])
+            self._node_batch = ([], [], [])
+
+    def flush_ways(self):
+        way_ids, counts, refs = self._way_batch
+        if not way_ids:
+            return
+        refs = np.array(refs, dtype=np.int64)
+        counts = np.array(counts, dtype=np.int64)
+        way_index = np.repeat(np.arange(len(way_ids)), counts)
+        hits = np.bincount(way_index, weights=self.nodes.contains(refs), minlength=len(way_ids))
+        selected = hits > 0
+        self.ways.add(np.array(way_ids, dtype=np.int64)[selected])
+        if self._complete_ways:
+            self.way_nodes.add(refs[selected[way_index]])
+        self._way_batch = ([], [], [])
+
+    def _select_relation(self):
+        for member_type, ref in self._members:
+            if ((member_type == 'node' and (ref in self.nodes or ref in self.way_nodes))
+                    or (member_type == 'way' and ref in self.ways)
+                    or (member_type == 'relation' and ref in self.relations)):
+                self.relations.add([int(self._element_id)])
+                return
+
+    def close(self):
+        self.flush_nodes()
+        self.flush_ways()
+
+
+def _parse(osm_file, start_element, end_element=None):
+    parser = xml.parsers.expat.ParserCreate()
+    parser.StartElementHandler = start_element
+    if end_element is not None:
+        parser.EndElementHandler = end_element
+    with open(osm_file, 'rb') as handle:
+        while True:
+            chunk = handle.read(READ_SIZE)
+            parser.Parse(chunk, not chunk)
+            if not chunk:
+                break
+    return parser
+
+
+def select(osm_file, area, complete_ways=False):
+    """
+        Pass 1: return a _Selector holding the id bitmaps
+    """
+    selector = _Selector(area, complete_ways)
+    _parse(osm_file, selector.start_element, selector.end_element)
+    selector.close()
+    return selector
+
+
+# ================================================== #
+#               Pass 2: copy                         #
+# ================================================== #
+def _kept_ranges(osm_file, tests):
+    """
+        Yield the (start, end) byte ranges of the kept elements, in
+        file order.  An element runs up to the start of the next top
+        level element (or the closing </osm>); adjacent ranges are
+        merged.
+
+        tests maps element names to functions that take an array of
+        ids and return which to keep; other elements are dropped.
+    """
+    parser = xml.parsers.expat.ParserCreate()
+    starts, names, ids = [], [], []
+    depth = [0]
+
+    def start_element(name, attrs):
+        depth[0] += 1
+        if depth[0] == 2:
+            starts.append(parser.CurrentByteIndex)
+            names.append(name)
+            ids.append(attrs.get('id', 0))
+
+    def end_element(name):
+        depth[0] -= 1
+
+    def kept(count, ends):
+        """
+            ranges of the first count elements found so far
+        """
+        batch_names = np.array(names[:count])
+        batch_ids = np.array(ids[:count], dtype=np.int64)
+        keep = np.zeros(count, dtype=bool)
+        for name, test in tests.items():
+            selected = batch_names == name
+            if selected.any():
+                keep[selected] = test(batch_ids[selected])
+        return [(starts[i], ends[i]) for i in np.flatnonzero(keep).tolist()]
+
+    parser.StartElementHandler = start_element
+    parser.EndElementHandler = end_element
+    pending = None
+    with open(osm_file, 'rb') as handle:
+        handle.seek(0, 2)
+        document_end = _find_document_end(handle, handle.tell())
+        handle.seek(0)
+        while True:
+            chunk = handle.read(READ_SIZE)
+            parser.Parse(chunk, not chunk)
+            if len(starts) > BATCH_SIZE or not chunk:
+                # the last element's end is the start of the next one,
+                # so it waits for the next batch unless this is the end
+                count = len(starts) - 1 if chunk else len(starts)
+                ends = starts[1:count + 1] + [document_end]
+                for start, end in kept(count, ends):
+                    if pending is not None and pending[1] == start:
+                        pending = (pending[0], end)
+                        continue
+                    if pending is not None:
+                        yield pending
+                    pending = (start, end)
+                del starts[:count], names[:count], ids[:count]
+            if not chunk:
+                break
+    if pending is not None:
+        yield pending
+
+
+def copy_elements(osm_file, output_file, tests, generator='clip.py'):
+    """
+        Copy the top level elements of osm_file that pass tests
+        (see _kept_ranges) to output_file, byte for byte
+    """
+    with open(osm_file, 'rb') as source, open(output_file, 'wb') as output:
+        output.write('<?xml version="1.0" encoding="UTF-8"?>\n<osm version="0.6" generator="{}">\n  '
+                     .format(generator).encode('utf-8'))
+        for start, end in _kept_ranges(osm_file, tests):
+            source.seek(start)
+            remaining = end - start
+            while remaining:
+                block = source.read(min(remaining, READ_SIZE))
+                output.write(block)
+                remaining -= len(block)
+        output.write(b'</osm>\n')
+
+
+def write_clip(osm_file, output_file, selector):
+    """
+        Pass 2: copy the kept elements to output_file
+    """
+    copy_elements(osm_file, output_file,
+                  {'node': lambda ids: selector.nodes.contains(ids) | selector.way_nodes.contains(ids),
+                   'way': selector.ways.contains,
+                   'relation': selector.relations.contains})
+
+
+def clip(osm_file, output_file, bbox=None, polygon=None, complete_ways=False):
+    """
+        Write the part of osm_file inside bbox (min_lat, min_lon,
+        max_lat, max_lon) or polygon (a Polygon, or a .poly path)
+        to output_file.  Returns the pass 1 selector (its bitmaps
+        hold the kept ids).
+    """
+    if (bbox is None) == (polygon is None):
+        raise ValueError("clip needs either a bbox or a polygon")
+    if bbox is not None:
+        area = BoundingBox(*bbox)
+    elif isinstance(polygon, str):
+        area = load_poly(polygon)
+    else:
+        area = polygon
+
+    selector = select(osm_file, area, complete_ways)
+    write_clip(osm_file, output_file, selector)
+    return selector
+
+
+if __name__ == '__main__':
+    arguments = argparse.ArgumentParser(description="Cut an area out of an OSM XML file")
+    arguments.add_argument('input')
+    arguments.add_argument('output')
+    arguments.add_argument('--bbox', help="min_lat,min_lon,max_lat,max_lon")
+    arguments.add_argument('--poly', help="osmosis .poly file")
+    arguments.add_argument('--complete-ways', action='store_true',
+                           help="keep every node of the selected ways")
+    args = arguments.parse_args()
+
+    bbox = tuple(float(value) for value in args.bbox.split(',')) if args.bbox else None
+    selector = clip(args.input, args.output, bbox=bbox, polygon=args.poly,
+                    complete_ways=args.complete_ways)
+    print("kept {} nodes ({} more for complete ways), {} ways, {} relations".format(
+        len(selector.nodes), len(selector.way_nodes), len(selector.ways), len(selector.relations)))
@@ -0,0 +1,271 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+    Parquet / Arrow IPC output, in place of the csv files
+
+    ColumnarWriter takes the same records as StreetMapCsvWriter and
+    writes each table to nodes.parquet, ways_nodes.parquet, ... (or
+    .arrow) with the column types of schema.py:
+
+        integer -> int64    float -> float64    string -> string
+
+    Rows are buffered per table.  Every BATCH_SIZE rows the buffer
+    is turned into an arrow record batch, a column at a time, which
+    takes a fraction of the memory of the row tuples.  Arrow IPC
+    files get each record batch as it is made; parquet files collect
+    them into row groups of row_group_size rows.  So memory stays at
+    about BATCH_SIZE python rows plus one row group of arrow data per
+    table, whatever the size of the input.
+
+    A Parquet file gets its footer on close(): until then it cannot
+    be read, flush() or not.  Arrow IPC files are the same.
+
+    merge_files joins shard files a row group at a time, for
+    parallel_ingest.py.
+
+    Needs the pyarrow package.
+"""
+import os.path
+
+from schema import schema as SCHEMA
+from street_map_csv_writer import TABLES, StreetMapWriter
+
+FORMATS = {'parquet': '.parquet', 'arrow': '.arrow'}
+# rows per record batch
+BATCH_SIZE = 8192
+# rows per parquet row group
+ROW_GROUP_SIZE = 128 * 1024
+PARQUET_COMPRESSION = 'zstd'
+ARROW_TYPES = {'integer': 'int64', 'float': 'float64', 'string': 'string'}
+
+
+def _pyarrow():
+    try:
+        import pyarrow
+    except ImportError:
+        raise ImportError("parquet / arrow output needs the pyarrow package (pip install pyarrow)")
+    return pyarrow
+
+
+def check_output_format(output_format, compression=None):
+    """
+        Raise ValueError for an unknown output format ('csv' or
+        one of FORMATS), or a csv compression with another format
+    """
+    if output_format != 'csv' and output_format not in FORMATS:
+        raise ValueError("Unknown output format '{}', expected one of: {}".format(
+            output_format, ", ".join(['csv'] + sorted(FORMATS))))
+    if output_format != 'csv':
+        if compression is not None:
+            raise ValueError("compression applies to csv output; {} files compress their columns"
+                             .format(output_format))
+        _pyarrow()
+
+
+def table_filename(filename, output_format):
+    """
+        nodes.csv -> nodes.parquet for 'parquet'
+    """
+    return os.path.splitext(filename)[0] + FORMATS[output_format]
+
+
+def is_columnar(filename):
+    return os.path.splitext(filename)[1] in FORMATS.values()
+
+
+def arrow_schema(writer_name, fields):
+    """
+        The pyarrow schema of a table, from its schema.py types
+    """
+    pa = _pyarrow()
+    table_schema = SCHEMA[writer_name]
+    if table_schema['type'] == 'list':
+        table_schema = table_schema['schema']
+    field_schemas = table_schema['schema']
+    return pa.schema([pa.field(field, getattr(pa, ARROW_TYPES[field_schemas[field]['type']])())
+                      for field in fields])
+
+
+def _column(values, arrow_type):
+    """
+        A pyarrow array of values.  Shaped records hold strings,
+        which arrow parses in one cast; positions are already ints.
+    """
+    pa = _pyarrow()
+    sample = next((value for value in values if value is not None), None)
+    if isinstance(sample, str) and not pa.types.is_string(arrow_type):
+        return pa.array(values, type=pa.string()).cast(arrow_type)
+    return pa.array(values, type=arrow_type)
+
+
+def _open_table(path, table_schema, output_format, compression=PARQUET_COMPRESSION):
+    """
+        (writer, file) for a new table file; the file is None
+        where the writer owns it
+    """
+    pa = _pyarrow()
+    if output_format == 'parquet':
+        import pyarrow.parquet as pq
+        return pq.ParquetWriter(path, table_schema, compression=compression), None
+    sink = pa.OSFile(path, 'wb')
+    return pa.ipc.new_file(sink, table_schema), sink
+
+
+class ColumnarWriter(StreetMapWriter):
+
+    def __init__(self, output_directory, output_format='parquet',
+                 row_group_size=ROW_GROUP_SIZE, compression=PARQUET_COMPRESSION):
+        """
+            output_format: 'parquet' or 'arrow' (Arrow IPC file)
+            row_group_size: rows per parquet row group
+            compression: the parquet column codec
+        """
+        if output_format not in FORMATS:
+            raise ValueError("Unknown columnar format '{}', expected one of: {}".format(
+                output_format, ", ".join(sorted(FORMATS))))
+        self._format = output_format
+        self._row_group_size = row_group_size
+        self._fields = {}
+        self._schemas = {}
+        self._batches = {}
+        self._record_batches = {}
+        self._row_counts = {}
+        self._writers = {}
+        self._sinks = []
+        self._filenames = []
+        self._paths = []
+        for writer_name, filename, fields in TABLES:
+            filename = table_filename(filename, output_format)
+            path = os.path.join(output_directory, filename)
+            self._schemas[writer_name] = arrow_schema(writer_name, fields)
+            writer, sink = _open_table(path, self._schemas[writer_name], output_format, compression)
+            self._writers[writer_name] = writer
+            if sink is not None:
+                self._sinks.append(sink)
+            self._fields[writer_name] = fields
+            self._batches[writer_name] = []
+            self._record_batches[writer_name] = []
+            self._row_counts[writer_name] = 0
+            self._filenames.append(filename)
+            self._paths.append(path)
+
+    def close(self):
+        """
+            write out the batched rows and finish the files
+        """
+        if not self._writers:
+            return
+        self.flush()
+        for writer in self._writers.values():
+            writer.close()
+        for sink in self._sinks:
+            sink.close()
+        self._writers = {}
+        self._sinks = []
+
+    def flush(self):
+        """
+            write out any batched rows, as short row groups
+        """
+        for writer_name, batch in self._batches.items():
+            if batch:
+                self._write_batch(writer_name, batch)
+            self._write_row_group(writer_name)
+
+    @property
+    def filenames(self):
+        return list(self._filenames)
+
+    @property
+    def row_counts(self):
+        """
+            {filename: rows written}, batched rows included
+        """
+        return {filename: self._row_counts[writer_name]
+                for (writer_name, _, _), filename in zip(TABLES, self._filenames)}
+
+    @property
+    def byte_counts(self):
+        """
+            {filename: bytes written}, not counting rows
+            still in the batches
+        """
+        return {filename: os.path.getsize(path)
+                for filename, path in zip(self._filenames, self._paths)}
+
+    def _write_batch(self, writer_name, batch):
+        """
+            Turn the batch for writer_name into a record
+            batch and empty it
+        """
+        pa = _pyarrow()
+        table_schema = self._schemas[writer_name]
+        columns = [_column(list(values), field.type)
+                   for values, field in zip(zip(*batch), table_schema)]
+        record_batch = pa.RecordBatch.from_arrays(columns, schema=table_schema)
+        del batch[:]
+        if self._format == 'arrow':
+            self._writers[writer_name].write_batch(record_batch)
+            return
+        record_batches = self._record_batches[writer_name]
+        record_batches.append(record_batch)
+        if sum(len(pending) for pending in record_batches) >= self._row_group_size:
+            self._write_row_group(writer_name)
+
+    def _write_row_group(self, writer_name):
+        """
+            Write the record batches made for writer_name
+            as one parquet row group
+        """
+        record_batches = self._record_batches[writer_name]
+        if record_batches:
+            table = _pyarrow().Table.from_batches(record_batches)
+            self._writers[writer_name].write_table(table, row_group_size=len(table))
+            del record_batches[:]
+
+    def add_row(self, writer_name, row):
+        batch = self._batches[writer_name]
+        batch.append(row)
+        self._row_counts[writer_name] += 1
+        if len(batch) >= BATCH_SIZE:
+            self._write_batch(writer_name, batch)
+
+    def add_rows(self, writer_name, rows):
+        batch = self._batches[writer_name]
+        batch.extend(rows)
+        self._row_counts[writer_name] += len(rows)
+        if len(batch) >= BATCH_SIZE:
+            self._write_batch(writer_name, batch)
+
+
+def merge_files(paths, output_path, compression=PARQUET_COMPRESSION):
+    """
+        Write the row groups of the table files paths,
+        in order, to output_path
+    """
+    pa = _pyarrow()
+    output_format = 'parquet' if output_path.endswith(FORMATS['parquet']) else 'arrow'
+    writer = sink = None
+    try:
+        for path in paths:
+            if output_format == 'parquet':
+                import pyarrow.parquet as pq
+                source = pq.ParquetFile(path)
+                table_schema = source.schema_arrow
+                groups = (source.read_row_group(i) for i in range(source.num_row_groups))
+            else:
+                source = pa.ipc.open_file(pa.memory_map(path))
+                table_schema = source.schema
+                groups = (source.get_batch(i) for i in range(source.num_record_batches))
+            if writer is None:
+                writer, sink = _open_table(output_path, table_schema, output_format, compression)
+            for group in groups:
+                if isinstance(group, pa.Table):
+                    writer.write_table(group)
+                else:
+                    writer.write_batch(group)
+    finally:
+        if writer is not None:
+            writer.close()
+        if sink is not None:
+            sink.close()
@@ -0,0 +1,171 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+    gzip / zstd compressed csv output and streaming input
+
+    CompressedTextFile gives csv.writer the io.StringIO it writes to.
+    Once CHUNK_SIZE characters have built up, spill() encodes them and
+    hands them to a thread pool to compress, so the parse loop only
+    waits when more than max_pending chunks are in flight.  zlib and
+    zstd release the GIL while compressing, so threads compress in
+    parallel.
+
+    Every chunk is compressed on its own: a gzip member or a zstd
+    frame.  Concatenated members / frames are themselves a valid
+    .gz / .zst file, so a file cut back at a flush boundary (a
+    checkpoint) can be appended to, and shard files can be merged by
+    concatenation, exactly as with plain csv.
+
+    open_text opens a plain, .gz or .zst csv for streaming reads.
+
+    zstd needs the zstandard package; gzip only the standard library.
+"""
+import collections
+import concurrent.futures
+import gzip
+import io
+import os
+import threading
+
+COMPRESSIONS = {'gzip': '.gz', 'zstd': '.zst'}
+# characters of csv text compressed at a time
+CHUNK_SIZE = 1024 * 1024
+# level 1 keeps up with the parser and gets most of the size reduction
+GZIP_LEVEL = 1
+ZSTD_LEVEL = 3
+
+
+def _zstandard():
+    try:
+        import zstandard
+    except ImportError:
+        raise ImportError("zstd compression needs the zstandard package (pip install zstandard)")
+    return zstandard
+
+
+def check_compression(compression):
+    """
+        Raise ValueError for an unknown compression name
+        (None means plain csv)
+    """
+    if compression is not None and compression not in COMPRESSIONS:
+        raise ValueError("Unknown compression '{}', expected one of: {}".format(
+            compression, ", ".join(sorted(COMPRESSIONS))))
+    if compression == 'zstd':
+        _zstandard()
+
+
+def compressed_filename(filename, compression):
+    """
+        nodes.csv -> nodes.csv.gz for 'gzip'
+    """
+    if compression is None:
+        return filename
+    return filename + COMPRESSIONS[compression]
+
+
+def make_compressor(compression):
+    """
+        A function compressing one chunk of bytes into a
+        complete gzip member / zstd frame
+    """
+    if compression == 'gzip':
+        return lambda chunk: gzip.compress(chunk, GZIP_LEVEL)
+
+    zstandard = _zstandard()
+    # ZstdCompressor objects must not be shared between threads
+    local = threading.local()
+
+    def compress(chunk):
+        if not hasattr(local, 'compressor'):
+            local.compressor = zstandard.ZstdCompressor(level=ZSTD_LEVEL)
+        return local.compressor.compress(chunk)
+    return compress
+
+
+def make_executor(workers=None):
+    """
+        The thread pool compressing the chunks of a writer's files
+    """
+    return concurrent.futures.ThreadPoolExecutor(max_workers=workers or min(4, os.cpu_count() or 1),
+                                                 thread_name_prefix='compress')
+
+
+class CompressedTextFile(io.StringIO):
+    """
+        A text buffer for csv.writer whose contents are compressed
+        on executor and appended to path in order
+    """
+
+    def __init__(self, path, compress, executor, append=False, max_pending=8):
+        super().__init__(newline='')
+        self._raw = open(path, 'ab' if append else 'wb')
+        self._compress = compress
+        self._executor = executor
+        self._max_pending = max_pending
+        self._pending = collections.deque()
+
+    @property
+    def bytes_written(self):
+        """
+            compressed bytes in the file so far
+        """
+        return self._raw.tell()
+
+    def spill(self, force=False):
+        """
+            Send the buffered text off to be compressed once there is
+            a chunk of it (or whatever there is, when force is True)
+        """
+        if not self.tell() or (self.tell() < CHUNK_SIZE and not force):
+            return
+        chunk = self.getvalue().encode('utf-8')
+        self.seek(0)
+        self.truncate(0)
+        self._pending.append(self._executor.submit(self._compress, chunk))
+        while len(self._pending) > self._max_pending:
+            self._raw.write(self._pending.popleft().result())
+
+    def flush(self):
+        """
+            Compress and write out everything written so far
+        """
+        if self.closed or self._raw.closed:
+            return
+        self.spill(force=True)
+        while self._pending:
+            self._raw.write(self._pending.popleft().result())
+        self._raw.flush()
+
+    def close(self):
+        if not self.closed:
+            self.flush()
+            self._raw.close()
+        super().close()
+
+
+def open_text(path):
+    """
+        Open a csv file for reading as text, decompressing
+        .gz / .zst files as they are read
+    """
+    if path.endswith(COMPRESSIONS['gzip']):
+        return gzip.open(path, 'rt', encoding='utf-8', newline='')
+    if path.endswith(COMPRESSIONS['zstd']):
+        reader = _zstandard().ZstdDecompressor().stream_reader(open(path, 'rb'),
+                                                               read_across_frames=True,
+                                                               closefd=True)
+        return io.TextIOWrapper(reader, encoding='utf-8', newline='')
+    return open(path, 'r', encoding='utf-8', newline='')
+
+
+def find_table(directory, filename):
+    """
+        The path of filename in directory, plain or compressed,
+        whichever exists (the plain path if none does)
+    """
+    for suffix in [''] + sorted(COMPRESSIONS.values()):
+        path = os.path.join(directory, filename + suffix)
+        if os.path.exists(path):
+            return path
+    return os.path.join(directory, filename)
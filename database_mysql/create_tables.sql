@@ -0,0 +1,85 @@
+-- The MySQL tables for the csv files written by data.py, column for
+-- column as database_sqlite/create_tables.sql.  mysql_loader.py loads
+-- them; create them once with:
+--
+--     mysql udacity < create_tables.sql
+--
+-- There are no foreign keys: an extract refers to nodes and ways
+-- outside it, and mysql_loader.py swaps freshly loaded tables in by
+-- renaming them, which foreign keys would follow.  The indexes are
+-- those of database_sqlite/create_indexes.sql; tag values are
+-- indexed on their first 64 characters.
+CREATE TABLE IF NOT EXISTS node (
+    node_id BIGINT NOT NULL PRIMARY KEY,
+    node_lat DOUBLE,
+    node_lon DOUBLE,
+    node_user VARCHAR(255),
+    node_uid BIGINT,
+    node_version INT,
+    node_changeset BIGINT,
+    node_timestamp VARCHAR(32),
+    INDEX node_uid_user (node_uid, node_user)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
+CREATE TABLE IF NOT EXISTS node_tag (
+    node_id BIGINT NOT NULL,
+    tag_key VARCHAR(255),
+    tag_value TEXT,
+    tag_type VARCHAR(255),
+    INDEX node_tag_node_id (node_id),
+    INDEX node_tag_key_value (tag_key, tag_value(64), node_id)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
+CREATE TABLE IF NOT EXISTS way (
+    way_id BIGINT NOT NULL PRIMARY KEY,
+    way_user VARCHAR(255),
+    way_uid BIGINT,
+    way_version INT,
+    way_changeset BIGINT,
+    way_timestamp VARCHAR(32),
+    INDEX way_uid_user (way_uid, way_user)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
+CREATE TABLE IF NOT EXISTS way_node (
+    way_id BIGINT NOT NULL,
+    node_id BIGINT NOT NULL,
+    position INT NOT NULL,
+    INDEX way_node_way_id (way_id),
+    INDEX way_node_node_id (node_id, way_id)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
+CREATE TABLE IF NOT EXISTS way_tag (
+    way_id BIGINT NOT NULL,
+    tag_key VARCHAR(255) NOT NULL,
+    tag_value TEXT NOT NULL,
+    tag_type VARCHAR(255),
+    INDEX way_tag_way_id (way_id),
+    INDEX way_tag_key_value (tag_key, tag_value(64), way_id)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
+CREATE TABLE IF NOT EXISTS relation (
+    relation_id BIGINT NOT NULL PRIMARY KEY,
+    relation_user VARCHAR(255),
+    relation_uid BIGINT,
+    relation_version INT,
+    relation_changeset BIGINT,
+    relation_timestamp VARCHAR(32)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
+-- member_id refers to node, way or relation depending on member_type
+CREATE TABLE IF NOT EXISTS relation_member (
+    relation_id BIGINT NOT NULL,
+    member_id BIGINT NOT NULL,
+    member_type VARCHAR(16) NOT NULL,
+    role VARCHAR(255),
+    position INT NOT NULL,
+    INDEX relation_member_relation_id (relation_id)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
+CREATE TABLE IF NOT EXISTS relation_tag (
+    relation_id BIGINT NOT NULL,
+    tag_key VARCHAR(255) NOT NULL,
+    tag_value TEXT NOT NULL,
+    tag_type VARCHAR(255),
+    INDEX relation_tag_relation_id (relation_id)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
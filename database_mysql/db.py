@@ -1,5 +1,34 @@
+import math
+import os
+import sys
+
 import MySQLdb as sql
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import mysql_loader
+
+# metres, as st_distance_sphere measures by default
+EARTH_RADIUS = 6370986.0
+# metres; the first box get_closest_nodes searches reaches this far
+START_RADIUS = 250.0
+
+
+def bounding_box(lat, lon, radius):
+    """
+        (min_lat, max_lat, min_lon, max_lon) of the smallest box
+        holding every point within radius metres of lat, lon
+        (as spatial_index.bounding_box)
+    """
+    angle = radius / EARTH_RADIUS
+    min_lat = lat - math.degrees(angle)
+    max_lat = lat + math.degrees(angle)
+    if min_lat <= -90 or max_lat >= 90 or math.sin(angle) >= math.cos(math.radians(lat)):
+        return max(min_lat, -90.0), min(max_lat, 90.0), -180.0, 180.0
+    delta_lon = math.degrees(math.asin(math.sin(angle) / math.cos(math.radians(lat))))
+    return min_lat, max_lat, max(lon - delta_lon, -180.0), min(lon + delta_lon, 180.0)
+
+
 class Database():
 
 
@@ -39,7 +68,8 @@ class Database():
                description text,
                cuisine text,
                denomination text,
-               coordinates point
+               coordinates point not null,
+               spatial index map_node_coordinates (coordinates)
             );
         """
         c = self._connection.cursor()
@@ -47,7 +77,63 @@ class Database():
 
 
     def get_closest_nodes(self, map_node_id, limit):
+        """
+            The limit nodes closest to map_node_id, itself first,
+            nearest first.
+
+            Searches the boxes around the node through the spatial
+            index on coordinates, doubling the box from START_RADIUS
+            until limit nodes lie within the circle it encloses.
+            A table made before the index was added needs:
+
+                alter table map_node modify coordinates point not null,
+                    add spatial index map_node_coordinates (coordinates);
+        """
         print("Getting close nodes")
+        sql = """
+            select 
+                  other.map_node_id
+                , other.opm_id
+                , other.name
+                , other.amenity 
+                , other.shop
+                , other.description
+                , other.cuisine
+                , other.denomination
+                , st_x(other.coordinates) as lon
+                , st_y(other.coordinates) as lat
+                , st_distance_sphere(other.coordinates, thisthis.coordinates) as distance
+                from 
+                udacity.map_node thisthis 
+                inner join udacity.map_node other
+                   on mbrcontains(st_makeenvelope(point(%s, %s), point(%s, %s)), other.coordinates)
+                where thisthis.map_node_id = %s 
+                order by distance
+                limit {}""".format(limit)
+
+        c = self._connection.cursor()
+        c.execute("select st_y(coordinates), st_x(coordinates) from udacity.map_node "
+                  "where map_node_id = %s", (map_node_id,))
+        position = c.fetchone()
+        if position is None:
+            return []
+        lat, lon = position
+        radius = START_RADIUS
+        while True:
+            min_lat, max_lat, min_lon, max_lon = bounding_box(lat, lon, radius)
+            c.execute(sql, (min_lon, min_lat, max_lon, max_lat, map_node_id))
+            results = list(c.fetchall())
+            if len(results) >= limit and results[-1][-1] <= radius:
+                return results
+            if (min_lat, max_lat, min_lon, max_lon) == (-90.0, 90.0, -180.0, 180.0):
+                return results
+            radius *= 2
+
+    def get_closest_nodes_full_scan(self, map_node_id, limit):
+        """
+            get_closest_nodes by measuring the distance to every
+            node, without the spatial index
+        """
         sql = """
             select 
                   other.map_node_id
@@ -123,6 +209,14 @@ class Database():
             raise
         c.execute("commit")
 
+    def add_nodes(self, nodes, replace=False):
+        """
+            add_node for many nodes at once: multi-row inserts into a
+            staging table, moved into map_node in one transaction
+            (see mysql_loader.load_nodes)
+        """
+        return mysql_loader.load_nodes(self._connection, nodes, replace=replace)
+
 if __name__ == "__main__":
     db = Database()
     db.connect(host="127.0.0.1",
@@ -2,8 +2,15 @@ import xml.etree.cElementTree as ET
 import pprint
 from collections import defaultdict
 import re
+import os
+import sys
 from db import Database
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import osm_audit
+from osm_audit import run_audits
+
 """
     - Audit
     - Develop plan for Cleaning
@@ -125,64 +132,60 @@ class MapParser():
             all of the tag types found
             with the count of each
         """
-        tag_types = {}
         self._logger.info("Discovering Tag Types in %s" % filepath)
-        with open(filepath, "r") as handle:
-            for event, elem in ET.iterparse(handle, events=("start",)):
-                tag_type = elem.tag
-                tag_types.setdefault(tag_type, 0)
-                tag_types[tag_type] += 1
-        return tag_types
+        results = run_audits(filepath, {'tag_types': osm_audit.ElementCounts()})
+        return results['tag_types']
 
 
-    def _describe_tag_attributes(self, filepath, tag_type):
+    def _describe_tag_attributes(self, filepath, tag_type, attributes=None):
         """
             Pase the XML and reports the 
             attributes of the tag type
+            (attributes: an AttributeSamples result,
+             to describe without parsing again)
         """
         num_samples = 8
-        attribute_counts = {}
-        attribute_samples = {}
-
-        with open(filepath, "r") as handle:
-            for event, elem in ET.iterparse(handle, events=("start",)):
-                if elem.tag == tag_type:
-                    for key, value in elem.attrib.items():
-                        attribute_counts.setdefault(key, 0)
-                        attribute_samples.setdefault(key, {})
-                        attribute_counts[key] += 1
-                        if value not in attribute_samples[key]:
-                            attribute_samples[key].setdefault(value, 0)
-                            attribute_samples[key][value] += 1
+        if attributes is None:
+            results = run_audits(filepath, {'attributes': osm_audit.AttributeSamples([tag_type])})
+            attributes = results['attributes']
 
         print("  -- attributes for {} --".format(tag_type))
-        for attribute, count in attribute_counts.items():
+        for attribute, (count, values) in attributes.get(tag_type, {}).items():
             print("  {}: {} num distinct values: {} ({})".format(attribute, 
                                                                  count, 
-                                                                 len(attribute_samples[attribute].keys()),
-                                                                 ", ".join(list(attribute_samples[attribute].keys())[:num_samples])))
+                                                                 len(values),
+                                                                 ", ".join(list(values)[:num_samples])))
 
-    def _describe_tag_children(self, filepath, tag_type):
+    def _describe_tag_children(self, filepath, tag_type, children=None):
         """
             Pase the XML and reports the 
             child tags of the tag type
+            (children: a ChildTagCounts result,
+             to describe without parsing again)
         """
-        num_samples = 5
-        tag_counts = {}
-
-        with open(filepath, "r") as handle:
-            for event, elem in ET.iterparse(handle, events=("start",)):
-                if elem.tag == tag_type:
-                  for child_tag in elem:
-                    tag_name = child_tag.tag
-                    tag_counts.setdefault(tag_name, 0)
-                    tag_counts[tag_name] += 1
+        if children is None:
+            results = run_audits(filepath, {'children': osm_audit.ChildTagCounts()})
+            children = results['children']
+        tag_counts = children.get(tag_type, {})
 
         if tag_counts:
             print("  -- tags for {} --".format(tag_type))
             for tag_name, count in tag_counts.items():
                 print("  {}: {}".format(tag_name, count))
 
+    def describe_map(self, filepath):
+        """
+            The tag types of the XML with the attributes
+            and child tags of each, from a single parse
+        """
+        results = run_audits(filepath, {'tag_types': osm_audit.ElementCounts(),
+                                        'attributes': osm_audit.AttributeSamples(),
+                                        'children': osm_audit.ChildTagCounts()})
+        for name, count in results['tag_types'].items():
+            print("{}: {}".format(name, count))
+            self._describe_tag_attributes(filepath, name, results['attributes'])
+            self._describe_tag_children(filepath, name, results['children'])
+
 
     def clean_string(self, string):
         string = string.encode('utf-8')
@@ -240,25 +243,9 @@ class MapParser():
         """
             Identifies tags along with their parent heirarcy
         """
-        tag_types = {}
-        tag_types_ordered = []
-        stack = []
-        events = {}
-        with open(filepath, "r") as handle:
-            for event, elem in ET.iterparse(handle, events=("start","end")):
-                if event == "start":
-                    stack.append(elem.tag)
-                    tag_path = "/".join(stack)
-                    tag_types.setdefault(tag_path, 0)
-                    if tag_types[tag_path] == 0:
-                        print(tag_path)
-                        tag_types_ordered.append(tag_path)
-                    tag_types[tag_path] += 1
-                if event == "end":
-                    stack.pop()
-                    
-        for item in tag_types_ordered:
-            print("{} {}".format(item, tag_types[item]))
+        results = run_audits(filepath, {'tag_paths': osm_audit.TagPathCounts()})
+        for item, count in results['tag_paths'].items():
+            print("{} {}".format(item, count))
 
     def _identify_tags(self, filepath):
         """
@@ -266,14 +253,8 @@ class MapParser():
             to identify all of the top-level
             tag types in the document
         """
-
-        tag_types = {}
-        with open(filepath, "r") as handle:
-            for event, elem in ET.iterparse(handle, events=("start",)):
-                tag_types.setdefault(elem.tag, 0)
-                tag_types[elem.tag] += 1
-
-        pprint.pprint(tag_types)
+        results = run_audits(filepath, {'tag_types': osm_audit.ElementCounts()})
+        pprint.pprint(dict(results['tag_types']))
 
     def _parse_node_tags(self, filepath, db):
 
@@ -282,6 +263,7 @@ class MapParser():
 
         tag_counts = {}
         tag_values = {}
+        nodes = []
         with open(filepath, "r") as handle:
             for event, elem in ET.iterparse(handle, events=("start",)):
                 if elem.tag == "node":
@@ -360,7 +342,9 @@ class MapParser():
                     node_data['name'] = node_names.get('name', node_names.get('name:en'))
                     
                     if node_data['name']:
-                        db.add_node(node_data)
+                        nodes.append(node_data)
+
+        db.add_nodes(nodes)
 
         #for key, values in tag_values.items():
         #    print("{}".format(key))
@@ -375,12 +359,7 @@ class MapParser():
         self._parse_node_tags(filepath, db)
         return
 
-        tag_types = self._discover_tag_types(filepath)
-
-        for name, count in tag_types.items():
-            print("{}: {}".format(name, count))
-            self._describe_tag_attributes(filepath, name)
-            #self._describe_tag_children(filepath, name)
+        self.describe_map(filepath)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,22 @@
+-- Run after load_tables.sql
+-- Indexes for looking up the child rows of a node / way / relation,
+-- used when applying change files (osm_changes.py)
+CREATE INDEX IF NOT EXISTS node_tag_node_id ON node_tag(node_id);
+CREATE INDEX IF NOT EXISTS way_tag_way_id ON way_tag(way_id);
+CREATE INDEX IF NOT EXISTS way_node_way_id ON way_node(way_id);
+CREATE INDEX IF NOT EXISTS relation_member_relation_id ON relation_member(relation_id);
+CREATE INDEX IF NOT EXISTS relation_tag_relation_id ON relation_tag(relation_id);
+
+-- Covering indexes for the analytics queries in the README: tag value
+-- breakdowns by key, users and their edit counts, and the ways that
+-- pass through a node
+CREATE INDEX IF NOT EXISTS node_tag_key_value ON node_tag(tag_key, tag_value, node_id);
+CREATE INDEX IF NOT EXISTS way_tag_key_value ON way_tag(tag_key, tag_value, way_id);
+CREATE INDEX IF NOT EXISTS node_uid_user ON node(node_uid, node_user);
+CREATE INDEX IF NOT EXISTS way_uid_user ON way(way_uid, way_user);
+CREATE INDEX IF NOT EXISTS way_node_node_id ON way_node(node_id, way_id);
+
+-- Table and index statistics, without which the planner can pick a
+-- covering index over the better join order (e.g. for the streets
+-- crossing Bourbon Street)
+ANALYZE;
@@ -0,0 +1,43 @@
+-- R-tree spatial index of the points of interest, for the bounding box
+-- and nearest-neighbour searches of spatial_index.py.  sqlite_loader.py
+-- builds it and osm_changes.py keeps it up to date; after any other
+-- change to the node or node_tag tables, run this again:
+--
+--     sqlite3 new_orleans.db < create_spatial_index.sql
+--
+-- The R-tree keeps its boxes as 32-bit floats, rounded outwards; the
+-- exact position is kept alongside, in the lat / lon columns.
+BEGIN;
+
+-- the points of interest: nodes tagged amenity or shop, as the
+-- map_node table of database_mysql holds.  Only these: an R-tree of
+-- every node would take longer to build than the rest of the load.
+DROP TABLE IF EXISTS poi_rtree;
+CREATE VIRTUAL TABLE poi_rtree USING rtree(
+    node_id,
+    min_lat, max_lat,
+    min_lon, max_lon,
+    +lat REAL,
+    +lon REAL,
+    +amenity TEXT,
+    +shop TEXT,
+    +name TEXT
+);
+INSERT INTO poi_rtree
+select node_id, node_lat, node_lat, node_lon, node_lon, node_lat, node_lon,
+       (select tag_value from node_tag
+         where node_tag.node_id = node.node_id and tag_key = 'amenity' and tag_type = 'regular'
+         limit 1),
+       (select tag_value from node_tag
+         where node_tag.node_id = node.node_id and tag_key = 'shop' and tag_type = 'regular'
+         limit 1),
+       (select tag_value from node_tag
+         where node_tag.node_id = node.node_id and tag_key = 'name' and tag_type = 'regular'
+         limit 1)
+  from node
+ where node_lat is not null
+   and node_lon is not null
+   and node_id in (select node_id from node_tag
+                    where tag_key in ('amenity', 'shop') and tag_type = 'regular');
+
+COMMIT;
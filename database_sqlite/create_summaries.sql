@@ -0,0 +1,90 @@
+-- Summary tables for the analytics queries in the README, built from
+-- the loaded tables.  sqlite_loader.py and osm_changes.py rebuild
+-- them; after any other change to the tables, run this again:
+--
+--     sqlite3 new_orleans.db < create_summaries.sql
+--
+-- The rebuild is one transaction: readers see the old summaries or the new.
+BEGIN;
+
+-- nodes and ways by user
+DROP TABLE IF EXISTS summary_user;
+CREATE TABLE summary_user (
+    uid INTEGER,
+    user TEXT,
+    nodes INTEGER NOT NULL,
+    ways INTEGER NOT NULL,
+    edits INTEGER NOT NULL
+);
+INSERT INTO summary_user (uid, user, nodes, ways, edits)
+select uid, user, sum(nodes), sum(ways), sum(nodes) + sum(ways)
+  from (select node_uid as uid, node_user as user, count(*) as nodes, 0 as ways
+          from node
+         group by 1, 2
+        union all
+        select way_uid, way_user, 0, count(*)
+          from way
+         group by 1, 2)
+ group by uid, user;
+CREATE INDEX summary_user_edits ON summary_user(edits);
+
+-- node and way tags by type and key
+DROP TABLE IF EXISTS summary_tag_key;
+CREATE TABLE summary_tag_key (
+    tag_type TEXT,
+    tag_key TEXT,
+    nodes INTEGER NOT NULL,
+    ways INTEGER NOT NULL,
+    total INTEGER NOT NULL
+);
+INSERT INTO summary_tag_key (tag_type, tag_key, nodes, ways, total)
+select tag_type, tag_key, sum(nodes), sum(ways), sum(nodes) + sum(ways)
+  from (select tag_type, tag_key, count(*) as nodes, 0 as ways
+          from node_tag
+         group by 1, 2
+        union all
+        select tag_type, tag_key, 0, count(*)
+          from way_tag
+         group by 1, 2)
+ group by tag_type, tag_key;
+CREATE INDEX summary_tag_key_total ON summary_tag_key(total);
+
+-- node and way tags by key and value (amenity, religion, denomination ...)
+DROP TABLE IF EXISTS summary_tag_value;
+CREATE TABLE summary_tag_value (
+    tag_key TEXT,
+    tag_value TEXT,
+    nodes INTEGER NOT NULL,
+    ways INTEGER NOT NULL,
+    total INTEGER NOT NULL
+);
+INSERT INTO summary_tag_value (tag_key, tag_value, nodes, ways, total)
+select tag_key, tag_value, sum(nodes), sum(ways), sum(nodes) + sum(ways)
+  from (select tag_key, tag_value, count(*) as nodes, 0 as ways
+          from node_tag
+         group by 1, 2
+        union all
+        select tag_key, tag_value, 0, count(*)
+          from way_tag
+         group by 1, 2)
+ group by tag_key, tag_value;
+CREATE INDEX summary_tag_value_key_total ON summary_tag_value(tag_key, total);
+
+-- cuisines of the nodes tagged with each amenity
+DROP TABLE IF EXISTS summary_amenity_cuisine;
+CREATE TABLE summary_amenity_cuisine (
+    amenity TEXT,
+    cuisine TEXT,
+    nodes INTEGER NOT NULL
+);
+INSERT INTO summary_amenity_cuisine (amenity, cuisine, nodes)
+select amenity.tag_value, cuisine.tag_value, count(*)
+  from node_tag cuisine
+ inner join node_tag amenity
+    on amenity.node_id = cuisine.node_id
+   and amenity.tag_key = 'amenity'
+ where cuisine.tag_key = 'cuisine'
+ group by 1, 2;
+CREATE INDEX summary_amenity_cuisine_amenity ON summary_amenity_cuisine(amenity, nodes);
+
+COMMIT;
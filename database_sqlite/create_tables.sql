@@ -1,6 +1,6 @@
 -- Create the sqllite tables
 --
-CREATE TABLE node (
+CREATE TABLE IF NOT EXISTS node (
     node_id INTEGER PRIMARY KEY NOT NULL,
     node_lat REAL,
     node_lon REAL,
@@ -11,7 +11,7 @@ CREATE TABLE node (
     node_timestamp TEXT
 );
 
-CREATE TABLE node_tag (
+CREATE TABLE IF NOT EXISTS node_tag (
     node_id INTEGER,
     tag_key TEXT,
     tag_value TEXT,
@@ -19,7 +19,7 @@ CREATE TABLE node_tag (
     FOREIGN KEY (node_id) REFERENCES node(node_id)
 );
 
-CREATE TABLE way (
+CREATE TABLE IF NOT EXISTS way (
     way_id INTEGER PRIMARY KEY NOT NULL,
     way_user TEXT,
     way_uid INTEGER,
@@ -28,7 +28,7 @@ CREATE TABLE way (
     way_timestamp TEXT
 );
 
-CREATE TABLE way_node (
+CREATE TABLE IF NOT EXISTS way_node (
     way_id INTEGER NOT NULL,
     node_id INTEGER NOT NULL,
     position INTEGER NOT NULL,
@@ -36,7 +36,7 @@ CREATE TABLE way_node (
     FOREIGN KEY (node_id) REFERENCES node(node_id)
 );
 
-CREATE TABLE way_tag (
+CREATE TABLE IF NOT EXISTS way_tag (
     way_id INTEGER NOT NULL,
     tag_key TEXT NOT NULL,
     tag_value TEXT NOT NULL,
@@ -44,3 +44,53 @@ CREATE TABLE way_tag (
     FOREIGN KEY (way_id) REFERENCES way(way_id)
 );
 
+CREATE TABLE IF NOT EXISTS relation (
+    relation_id INTEGER PRIMARY KEY NOT NULL,
+    relation_user TEXT,
+    relation_uid INTEGER,
+    relation_version TEXT,
+    relation_changeset INTEGER,
+    relation_timestamp TEXT
+);
+
+-- member_id refers to node, way or relation depending on member_type
+CREATE TABLE IF NOT EXISTS relation_member (
+    relation_id INTEGER NOT NULL,
+    member_id INTEGER NOT NULL,
+    member_type TEXT NOT NULL,
+    role TEXT,
+    position INTEGER NOT NULL,
+    FOREIGN KEY (relation_id) REFERENCES relation(relation_id)
+);
+
+CREATE TABLE IF NOT EXISTS relation_tag (
+    relation_id INTEGER NOT NULL,
+    tag_key TEXT NOT NULL,
+    tag_value TEXT NOT NULL,
+    tag_type TEXT,
+    FOREIGN KEY (relation_id) REFERENCES relation(relation_id)
+);
+
+-- Optional: written by process_map(..., node_locations=..., way_metrics=True)
+-- and loaded with load_way_geometry.sql
+CREATE TABLE IF NOT EXISTS way_coord (
+    way_id INTEGER NOT NULL,
+    position INTEGER NOT NULL,
+    lat REAL,
+    lon REAL,
+    FOREIGN KEY (way_id) REFERENCES way(way_id)
+);
+
+-- length in metres, area in square metres (closed ways only)
+CREATE TABLE IF NOT EXISTS way_metric (
+    way_id INTEGER PRIMARY KEY NOT NULL,
+    length REAL,
+    min_lat REAL,
+    min_lon REAL,
+    max_lat REAL,
+    max_lon REAL,
+    centroid_lat REAL,
+    centroid_lon REAL,
+    area REAL,
+    FOREIGN KEY (way_id) REFERENCES way(way_id)
+);
@@ -5,3 +5,13 @@ drop table node_tag;
 drop table way;
 drop table way_node;
 drop table way_tag;
+drop table relation;
+drop table relation_member;
+drop table relation_tag;
+drop table way_coord;
+drop table way_metric;
+drop table if exists summary_user;
+drop table if exists summary_tag_key;
+drop table if exists summary_tag_value;
+drop table if exists summary_amenity_cuisine;
+drop table if exists poi_rtree;
@@ -5,6 +5,9 @@ delete from node_tag;
 delete from way;
 delete from way_node;
 delete from way_tag;
+delete from relation;
+delete from relation_member;
+delete from relation_tag;
 
 .mode csv
 
@@ -13,3 +16,6 @@ delete from way_tag;
 .import ../generated_data/ways.csv way
 .import ../generated_data/ways_nodes.csv way_node
 .import ../generated_data/ways_tags.csv way_tag
+.import ../generated_data/relations.csv relation
+.import ../generated_data/relations_members.csv relation_member
+.import ../generated_data/relations_tags.csv relation_tag
@@ -0,0 +1,22 @@
+-- the compressed data csv files (process_map(..., compression='gzip'))
+-- need to be created before this load script can be run; they are
+-- decompressed on the fly by piping them through gzip
+delete from node;
+delete from node_tag;
+delete from way;
+delete from way_node;
+delete from way_tag;
+delete from relation;
+delete from relation_member;
+delete from relation_tag;
+
+.mode csv
+
+.import '|gzip -dc ../generated_data/nodes.csv.gz' node
+.import '|gzip -dc ../generated_data/nodes_tags.csv.gz' node_tag
+.import '|gzip -dc ../generated_data/ways.csv.gz' way
+.import '|gzip -dc ../generated_data/ways_nodes.csv.gz' way_node
+.import '|gzip -dc ../generated_data/ways_tags.csv.gz' way_tag
+.import '|gzip -dc ../generated_data/relations.csv.gz' relation
+.import '|gzip -dc ../generated_data/relations_members.csv.gz' relation_member
+.import '|gzip -dc ../generated_data/relations_tags.csv.gz' relation_tag
@@ -0,0 +1,22 @@
+-- the compressed data csv files (process_map(..., compression='zstd'))
+-- need to be created before this load script can be run; they are
+-- decompressed on the fly by piping them through zstd
+delete from node;
+delete from node_tag;
+delete from way;
+delete from way_node;
+delete from way_tag;
+delete from relation;
+delete from relation_member;
+delete from relation_tag;
+
+.mode csv
+
+.import '|zstd -dc ../generated_data/nodes.csv.zst' node
+.import '|zstd -dc ../generated_data/nodes_tags.csv.zst' node_tag
+.import '|zstd -dc ../generated_data/ways.csv.zst' way
+.import '|zstd -dc ../generated_data/ways_nodes.csv.zst' way_node
+.import '|zstd -dc ../generated_data/ways_tags.csv.zst' way_tag
+.import '|zstd -dc ../generated_data/relations.csv.zst' relation
+.import '|zstd -dc ../generated_data/relations_members.csv.zst' relation_member
+.import '|zstd -dc ../generated_data/relations_tags.csv.zst' relation_tag
@@ -0,0 +1,15 @@
+-- Load the optional way geometry csv files
+-- (see ../way_geometry.py and ../way_metrics.py)
+delete from way_coord;
+delete from way_metric;
+
+.mode csv
+
+.import ../generated_data/ways_coords.csv way_coord
+.import ../generated_data/ways_metrics.csv way_metric
+
+-- empty csv fields import as '', make them NULL
+update way_coord set lat = null, lon = null where lat = '';
+update way_metric set length = null, min_lat = null, min_lon = null, max_lat = null,
+    max_lon = null, centroid_lat = null, centroid_lon = null where length = '';
+update way_metric set area = null where area = '';
@@ -21,3 +21,15 @@ select 'testing way_tag';
 select count(*) from  way_tag;
 select * from way_tag limit 1;
 
+
+select 'testing relation';
+select count(*) from  relation;
+select * from relation limit 1;
+
+select 'testing relation_member';
+select count(*) from  relation_member;
+select * from relation_member limit 1;
+
+select 'testing relation_tag';
+select count(*) from  relation_tag;
+select * from relation_tag limit 1;
@@ -0,0 +1,303 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+    A drop-in replacement for cerberus.Validator, compiled from schema.py
+
+    compile_schema generates a specialized check function for each
+    record type in the schema ('node', 'node_tags', 'way', ...).  The
+    generated code calls the schema's own coerce functions and tests
+    types inline, with no rule lookups, so a valid record costs a
+    handful of dictionary reads.
+
+    Valid records are the overwhelming majority, so only they take the
+    fast path.  When a check fails the record is walked again by a
+    generic interpreter of the schema that reproduces cerberus' error
+    messages and error tree, so validate_element reports exactly what
+    cerberus would.
+"""
+import collections.abc
+import functools
+import re
+
+import schema
+
+SCHEMA = schema.schema
+
+# cerberus error codes, used to order messages the way cerberus does
+REQUIRED_FIELD = 0x02
+UNKNOWN_FIELD = 0x03
+NOT_NULLABLE = 0x22
+BAD_TYPE = 0x24
+REGEX_MISMATCH = 0x41
+COERCION_FAILED = 0x61
+
+# rules the generated fast path checks; a field with any other
+# rule always takes the slow path
+FAST_RULES = frozenset(['required', 'nullable', 'type', 'coerce', 'regex'])
+
+# python types accepted for each cerberus type name
+TYPES = {
+    'boolean': (bool,),
+    'dict': (collections.abc.Mapping,),
+    'float': (float,),
+    'integer': (int,),
+    'list': (collections.abc.Sequence,),
+    'number': (int, float),
+    'string': (str,),
+}
+
+# exact classes the generated fast path accepts without an isinstance call
+FAST_TYPES = {
+    'boolean': 'bool',
+    'dict': 'dict',
+    'float': 'float',
+    'integer': 'int',
+    'list': 'list',
+    'string': 'str',
+}
+
+
+# ================================================== #
+#               Slow path: exact cerberus errors     #
+# ================================================== #
+def _is_type(value, type_name):
+    if type_name == 'list' and isinstance(value, str):
+        return False
+    if type_name in ('integer', 'number') and isinstance(value, bool):
+        return type_name == 'integer'
+    return isinstance(value, TYPES[type_name])
+
+
+@functools.lru_cache(maxsize=None)
+def _regex(pattern):
+    """
+        The compiled pattern, anchored at the end as cerberus does
+    """
+    return re.compile(pattern if pattern.endswith('$') else pattern + '$')
+
+
+def _value_errors(field, rules, value):
+    """
+        Return the cerberus error list for a single value
+        (messages followed by a nested error tree, if any)
+    """
+    messages = []
+    if 'coerce' in rules:
+        try:
+            value = rules['coerce'](value)
+        except Exception as error:
+            messages.append((COERCION_FAILED, "field '{}' cannot be coerced: {}".format(field, error)))
+
+    nested = None
+    if value is None:
+        if not rules.get('nullable', False):
+            messages.append((NOT_NULLABLE, 'null value not allowed'))
+    elif 'type' in rules and not _is_type(value, rules['type']):
+        messages.append((BAD_TYPE, 'must be of {} type'.format(rules['type'])))
+    else:
+        if 'regex' in rules and isinstance(value, str) and not _regex(rules['regex']).match(value):
+            messages.append((REGEX_MISMATCH, "value does not match regex '{}'".format(rules['regex'])))
+        if 'schema' in rules:
+            if rules.get('type') == 'list':
+                nested = {}
+                for index, item in enumerate(value):
+                    item_errors = _value_errors(index, rules['schema'], item)
+                    if item_errors:
+                        nested[index] = item_errors
+            else:
+                nested = _mapping_errors(rules['schema'], value)
+
+    errors = [message for _, message in sorted(messages, key=lambda m: m[0])]
+    if nested:
+        errors.append(nested)
+    return errors
+
+
+def _mapping_errors(mapping_schema, document):
+    """
+        Return {field: [errors]} for a dictionary validated
+        against mapping_schema
+    """
+    errors = {}
+    for field in document:
+        if field not in mapping_schema:
+            errors[field] = ['unknown field']
+
+    for field, rules in mapping_schema.items():
+        if field not in document:
+            if rules.get('required', False):
+                errors[field] = ['required field']
+            continue
+        field_errors = _value_errors(field, rules, document[field])
+        if field_errors:
+            errors[field] = field_errors
+    return errors
+
+
+def _normalize(rules, value):
+    """
+        Apply the coerce rules the way cerberus builds validator.document
+    """
+    if 'coerce' in rules:
+        try:
+            value = rules['coerce'](value)
+        except Exception:
+            pass
+    if 'schema' in rules and value is not None:
+        if rules.get('type') == 'list' and _is_type(value, 'list'):
+            return [_normalize(rules['schema'], item) for item in value]
+        if _is_type(value, 'dict'):
+            return _normalize_mapping(rules['schema'], value)
+    return value
+
+
+def _normalize_mapping(mapping_schema, document):
+    return {field: _normalize(mapping_schema[field], value) if field in mapping_schema else value
+            for field, value in document.items()}
+
+
+# ================================================== #
+#               Fast path: generated check functions #
+# ================================================== #
+def _fast_type_check(expression, type_name, lines, indent):
+    """
+        Append a line that bails out unless expression has exactly
+        the python class for type_name
+        (anything unusual is left for the slow path to judge)
+    """
+    lines.append("{}if {}.__class__ is not {}: return False".format(
+        indent, expression, FAST_TYPES[type_name]))
+
+
+def _compile_mapping(mapping_schema, name, lines, namespace, indent):
+    """
+        Append the checks for a dictionary held in variable name
+    """
+    fields = list(mapping_schema.items())
+    all_required = all(rules.get('required', False) for _, rules in fields)
+
+    lines.append("{}if {}.__class__ is not dict: return False".format(indent, name))
+    if all_required:
+        # every field is required, so any other length means a missing or unknown field
+        lines.append("{}if len({}) != {}: return False".format(indent, name, len(fields)))
+    else:
+        known = "known_{}".format(len(namespace))
+        namespace[known] = frozenset(mapping_schema)
+        lines.append("{}if not {}.keys() <= {}: return False".format(indent, name, known))
+
+    for field, rules in fields:
+        value = "{}[{!r}]".format(name, field)
+        if not rules.get('required', False):
+            lines.append("{}if {!r} in {}:".format(indent, field, name))
+            field_indent = indent + "    "
+        else:
+            field_indent = indent
+
+        if not rules.keys() <= FAST_RULES:
+            # unusual rule: let the slow path decide
+            lines.append("{}return False".format(field_indent))
+            continue
+
+        if 'coerce' in rules:
+            coerce = "coerce_{}".format(len(namespace))
+            namespace[coerce] = rules['coerce']
+            value = "{}({})".format(coerce, value)
+            if (rules['coerce'], rules.get('type')) in ((int, 'integer'), (float, 'float')):
+                # int() / float() can only return their own type (or raise)
+                lines.append("{}{}".format(field_indent, value))
+                continue
+            lines.append("{}coerced = {}".format(field_indent, value))
+            value = "coerced"
+
+        if 'type' in rules and rules['type'] in FAST_TYPES:
+            _fast_type_check(value, rules['type'], lines, field_indent)
+        else:
+            # unusual rule: let the slow path decide
+            lines.append("{}return False".format(field_indent))
+            continue
+
+        if 'regex' in rules:
+            regex = "regex_{}".format(len(namespace))
+            namespace[regex] = _regex(rules['regex'])
+            lines.append("{}if {}.__class__ is str and not {}.match({}): return False".format(
+                field_indent, value, regex, value))
+
+
+def _compile_field(field, rules, namespace):
+    """
+        Build a function returning True when a top level
+        value certainly validates against rules
+    """
+    lines = ["def check_{}(value):".format(field), "    try:"]
+    indent = "        "
+
+    if rules.get('type') == 'dict' and 'schema' in rules:
+        _compile_mapping(rules['schema'], 'value', lines, namespace, indent)
+    elif rules.get('type') == 'list' and rules.get('schema', {}).get('type') == 'dict':
+        lines.append("{}if value.__class__ is not list: return False".format(indent))
+        lines.append("{}for item in value:".format(indent))
+        _compile_mapping(rules['schema']['schema'], 'item', lines, namespace, indent + "    ")
+    else:
+        lines.append("{}return False".format(indent))
+
+    lines.append("    except Exception:")
+    lines.append("        return False")
+    lines.append("    return True")
+
+    source = "\n".join(lines)
+    exec(compile(source, "<fast_validator:{}>".format(field), 'exec'), namespace)
+    return namespace["check_{}".format(field)], source
+
+
+def compile_schema(document_schema):
+    """
+        Return {field: check_function} for each top level field
+    """
+    checks = {}
+    for field, rules in document_schema.items():
+        checks[field], _ = _compile_field(field, rules, {})
+    return checks
+
+
+class CompiledValidator():
+    """
+        Validates documents against a schema like cerberus.Validator,
+        with the same errors, using check functions compiled from it
+    """
+
+    def __init__(self, schema=SCHEMA):
+        self.errors = {}
+        self._document = None
+        self._use_schema(schema)
+
+    def _use_schema(self, schema):
+        self.schema = schema
+        self._checks = compile_schema(schema)
+
+    def validate(self, document, schema=None):
+        """
+            Return True if document matches the schema; otherwise
+            False with the cerberus style error tree in self.errors
+        """
+        if schema is not None and schema is not self.schema:
+            self._use_schema(schema)
+
+        self._document = document
+        checks = self._checks
+        for field, value in document.items():
+            check = checks.get(field)
+            if check is None or not check(value):
+                self.errors = _mapping_errors(self.schema, document)
+                return not self.errors
+
+        self.errors = {}
+        return True
+
+    @property
+    def document(self):
+        """
+            The last validated document, with coercions applied
+        """
+        if self._document is None:
+            return None
+        return _normalize_mapping(self.schema, self._document)
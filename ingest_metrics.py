@@ -0,0 +1,223 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+    Throughput metrics for process_map
+
+    IngestMetrics tracks a running ingest. It counts the rows and
+    bytes written to each table, the seconds spent in each stage
+    (parse, shape, validate and write), and input progress as bytes
+    consumed against the file size, from which it derives rates and
+    an ETA.  Every interval seconds a snapshot goes to an exporter:
+
+        JsonLinesExporter    one JSON object per line ('-' for stderr)
+        PrometheusExporter   a node_exporter textfile, replaced atomically
+
+    make_exporter picks the exporter from the path: .prom files get
+    the Prometheus format, anything else JSON lines.
+
+    The expat and pbf backends shape records while they parse, so for
+    them shape time is part of parse; the etree backend times its
+    shape_element calls separately.  The timers cost one
+    time.perf_counter() call per element and stage, and snapshots are
+    only taken when one is due.
+"""
+import json
+import os
+import sys
+import time
+
+STAGES = ('parse', 'shape', 'validate', 'write')
+# seconds between exported snapshots
+EXPORT_INTERVAL = 10.0
+PROMETHEUS_PREFIX = 'osm_ingest'
+
+
+class CountingReader():
+    """
+        Wraps a binary file object and counts the bytes read from it
+    """
+
+    def __init__(self, handle, already_read=0):
+        self._handle = handle
+        # the path, so osm_parsers.is_pbf still picks the parser
+        self.name = getattr(handle, 'name', None)
+        self.bytes_read = already_read
+
+    def read(self, size=-1):
+        chunk = self._handle.read(size)
+        self.bytes_read += len(chunk)
+        return chunk
+
+    def close(self):
+        self._handle.close()
+
+
+class IngestMetrics():
+    """
+        Counters and timers of one ingest, exported every interval
+    """
+
+    def __init__(self, exporter, interval=EXPORT_INTERVAL):
+        self.exporter = exporter
+        self.interval = interval
+        self.stage_seconds = dict.fromkeys(STAGES, 0.0)
+        self.elements = 0
+        self.file_name = None
+        self.input_size = None
+        self._reader = None
+        self._writer = None
+        self._rejects = None
+        self._start = time.perf_counter()
+        self.next_export = self._start + interval
+
+    def open_input(self, file_in, already_read=0):
+        """
+            Return the input to parse, a CountingReader, so progress
+            can be measured in bytes (XML or pbf alike).
+            already_read is where a resumed run starts.
+        """
+        if isinstance(file_in, str):
+            self.file_name = file_in
+            self.input_size = os.path.getsize(file_in)
+            file_in = open(file_in, 'rb')
+        self._reader = CountingReader(file_in, already_read)
+        return self._reader
+
+    def watch(self, writer, rejects=None):
+        """
+            Report the row and byte counts of writer
+            (a street_map_csv_writer.StreetMapWriter) and the rejects sink
+        """
+        self._writer = writer
+        self._rejects = rejects
+
+    def snapshot(self, final=False):
+        """
+            Return the current metrics as a dict
+        """
+        elapsed = time.perf_counter() - self._start
+        stages = dict(self.stage_seconds)
+        bytes_read = self._reader.bytes_read if self._reader is not None else None
+        snapshot = {
+            'time': round(time.time(), 3),
+            'elapsed_seconds': round(elapsed, 3),
+            'final': final,
+            'elements': self.elements,
+            'elements_per_second': round(self.elements / elapsed, 1) if elapsed else 0.0,
+            'stage_seconds': {stage: round(seconds, 3) for stage, seconds in stages.items()},
+            'input': {'file': self.file_name,
+                      'bytes_total': self.input_size,
+                      'bytes_read': bytes_read},
+            'tables': {},
+        }
+        if bytes_read is not None and elapsed:
+            rate = bytes_read / elapsed
+            snapshot['input']['bytes_per_second'] = round(rate, 1)
+            if self.input_size:
+                snapshot['input']['fraction'] = round(min(bytes_read / float(self.input_size), 1.0), 4)
+                remaining = max(self.input_size - bytes_read, 0)
+                snapshot['eta_seconds'] = round(remaining / rate, 1) if rate else None
+        if self._writer is not None:
+            byte_counts = self._writer.byte_counts
+            for filename, rows in self._writer.row_counts.items():
+                snapshot['tables'][filename] = {'rows': rows, 'bytes': byte_counts[filename]}
+        if self._rejects is not None:
+            snapshot['rejected'] = self._rejects.num_rejected
+        return snapshot
+
+    def export(self, final=False):
+        self.exporter.export(self.snapshot(final))
+        self.next_export = time.perf_counter() + self.interval
+
+    def close(self):
+        """
+            Export the final snapshot
+        """
+        self.export(final=True)
+        self.exporter.close()
+        if self._reader is not None and self.file_name is not None:
+            self._reader.close()
+
+
+class JsonLinesExporter():
+    """
+        Appends each snapshot to path as one line of JSON
+    """
+
+    def __init__(self, path):
+        if path == '-':
+            self._handle, self._should_close = sys.stderr, False
+        else:
+            self._handle, self._should_close = open(path, 'a', encoding='utf-8'), True
+
+    def export(self, snapshot):
+        self._handle.write(json.dumps(snapshot, sort_keys=True) + '\n')
+        self._handle.flush()
+
+    def close(self):
+        if self._should_close:
+            self._handle.close()
+
+
+def _prometheus_lines(snapshot):
+    prefix = PROMETHEUS_PREFIX
+    lines = []
+
+    def metric(name, kind, help_text, samples):
+        samples = [(labels, value) for labels, value in samples if value is not None]
+        if not samples:
+            return
+        lines.append('# HELP {}_{} {}'.format(prefix, name, help_text))
+        lines.append('# TYPE {}_{} {}'.format(prefix, name, kind))
+        for labels, value in samples:
+            label_string = ','.join('{}="{}"'.format(key, label) for key, label in labels)
+            lines.append('{}_{}{} {}'.format(prefix, name,
+                                             '{' + label_string + '}' if label_string else '', value))
+
+    metric('elapsed_seconds', 'gauge', 'Seconds since the ingest started.',
+           [((), snapshot['elapsed_seconds'])])
+    metric('elements_total', 'counter', 'Elements read.', [((), snapshot['elements'])])
+    metric('input_bytes_read', 'gauge', 'Bytes of input consumed.',
+           [((), snapshot['input']['bytes_read'])])
+    metric('input_bytes_total', 'gauge', 'Size of the input file.',
+           [((), snapshot['input']['bytes_total'])])
+    metric('eta_seconds', 'gauge', 'Estimated seconds until the input is consumed.',
+           [((), snapshot.get('eta_seconds'))])
+    metric('stage_seconds_total', 'counter', 'Seconds spent in each stage.',
+           [((('stage', stage),), seconds) for stage, seconds in sorted(snapshot['stage_seconds'].items())])
+    metric('rows_total', 'counter', 'Rows written to each table.',
+           [((('table', table),), counts['rows']) for table, counts in sorted(snapshot['tables'].items())])
+    metric('bytes_written', 'gauge', 'Bytes written to each table.',
+           [((('table', table),), counts['bytes']) for table, counts in sorted(snapshot['tables'].items())])
+    metric('rejected_total', 'counter', 'Elements rejected by validation.',
+           [((), snapshot.get('rejected'))])
+    return lines
+
+
+class PrometheusExporter():
+    """
+        Rewrites path as a Prometheus textfile with each snapshot
+        (for the node_exporter textfile collector)
+    """
+
+    def __init__(self, path):
+        self._path = path
+
+    def export(self, snapshot):
+        # written aside and renamed, so a scrape never sees half a file
+        temp_path = self._path + '.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as handle:
+            handle.write('\n'.join(_prometheus_lines(snapshot)) + '\n')
+        os.replace(temp_path, self._path)
+
+    def close(self):
+        pass
+
+
+def make_exporter(path):
+    """
+        PrometheusExporter for .prom paths, JsonLinesExporter otherwise
+    """
+    if path.endswith('.prom'):
+        return PrometheusExporter(path)
+    return JsonLinesExporter(path)
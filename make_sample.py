@@ -1,37 +1,259 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
-# This script provided by Udacity
+"""
+    Make a small, self-contained sample of an OSM file
 
-import xml.etree.ElementTree as ET  # Use cElementTree or lxml if too slow
+    (Originally provided by Udacity as "take every k-th top level
+    element"; rewritten so the sample is reproducible, can weight
+    element types and tags, and has no dangling node references.)
 
-OSM_FILE = "downloaded_maps/new_orleans_city.osm"  # Replace this with your osm file
+    Elements are picked by a hash of their type and id, so the same
+    seed and rates always pick the same elements, whatever the order
+    or size of the input.  Rates can be set per element type and per
+    tag key: an element is kept at the highest rate that applies to
+    it, e.g. by_tag={'amenity': 1.0} keeps every amenity.
+
+    With closure (the default) every node a sampled way uses, and
+    every node member of a sampled relation, is kept as well, so the
+    <nd> refs of the sample resolve.  Way and relation members of a
+    sampled relation are not added: they can point outside the
+    sample.  That takes two passes over the file (ways come after
+    the nodes they use); the ids are recorded in compact bitmaps
+    (clip.IdBitmap).  The second pass copies the kept elements'
+    bytes straight from the source.
+
+    usage: python make_sample.py [input.osm] [sample.osm] [-k 100] [--seed 0]
+                                 [--type-rate way=0.05] [--tag-rate amenity=1] [--no-closure]
+"""
+import argparse
+import xml.parsers.expat
+
+import numpy as np
+
+from clip import READ_SIZE, IdBitmap, copy_elements
+
+OSM_FILE = "downloaded_maps/new_orleans_city.osm"  # Replace this with your osm (or .osm.pbf) file
 SAMPLE_FILE = "new_orleans_city_sample.osm"
 
-k = 100 # Parameter: take every k-th top level element
+k = 100 # Parameter: keep about one in k top level elements
+
+ELEMENT_CODES = {'node': 1, 'way': 2, 'relation': 3}
+# elements decided per batch
+BATCH_SIZE = 65536
 
-def get_element(osm_file, tags=('node', 'way', 'relation')):
-    """Yield element if it is the right type of tag
 
-    Reference:
-    http://stackoverflow.com/questions/3095434/inserting-newlines-in-xml-file-generated-via-xml-etree-elementtree-in-python
+def sample_hash(codes, ids, seed=0):
+    """
+        Map (element type code, id) pairs to floats in [0, 1)
+        with the splitmix64 mixer
+    """
+    z = (np.asarray(ids, dtype=np.int64).astype(np.uint64)
+         + np.asarray(codes, dtype=np.uint64) * np.uint64(0x9E3779B97F4A7C15)
+         + np.uint64(seed * 0xD1B54A32D192ED03 & 0xFFFFFFFFFFFFFFFF))
+    z = (z ^ (z >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    z = (z ^ (z >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    z = z ^ (z >> np.uint64(31))
+    return (z >> np.uint64(11)).astype(np.float64) / float(1 << 53)
+
+
+class SampleRates():
+    """
+        The share of elements to keep, overall, by element type
+        and by tag key
     """
-    context = iter(ET.iterparse(osm_file, events=('start', 'end')))
-    _, root = next(context)
-    for event, elem in context:
-        if event == 'end' and elem.tag in tags:
-            yield elem
-            root.clear()
 
+    def __init__(self, rate, by_type=None, by_tag=None):
+        self.rate = rate
+        self.by_type = dict(by_type or {})
+        self.by_tag = dict(by_tag or {})
+
+    def for_element(self, element_type, tag_keys=()):
+        rate = self.by_type.get(element_type, self.rate)
+        for key in tag_keys:
+            if key in self.by_tag and self.by_tag[key] > rate:
+                rate = self.by_tag[key]
+        return rate
+
+    def type_test(self, element_type, seed):
+        """
+            Return a function picking which of an array of ids
+            to keep, for rates that do not depend on tags
+        """
+        code = ELEMENT_CODES[element_type]
+        rate = self.for_element(element_type)
+        return lambda ids: sample_hash(np.full(len(ids), code), ids, seed) < rate
+
+
+class _Sampler():
+    """
+        expat callbacks (or feed() calls) for pass 1: decide which
+        elements are sampled and which nodes they need
+    """
+
+    def __init__(self, rates, seed=0, closure=True):
+        self._rates = rates
+        self._seed = seed
+        self._closure = closure
+        self.kept = {name: IdBitmap() for name in ELEMENT_CODES}
+        self.needed_nodes = IdBitmap()
+        self._batch = ([], [], [], [], [])
+        self._depth = 0
+        self._element = None
+
+    def start_element(self, name, attrs):
+        self._depth += 1
+        if self._depth == 2:
+            self._element = None
+            if name in ELEMENT_CODES:
+                self._element = (name, attrs['id'], [], [])
+        elif self._depth == 3 and self._element is not None:
+            if name == 'tag':
+                self._element[2].append(attrs['k'])
+            elif name == 'nd':
+                self._element[3].append(attrs['ref'])
+            elif name == 'member' and attrs.get('type') == 'node':
+                self._element[3].append(attrs['ref'])
+
+    def end_element(self, name):
+        if self._depth == 2 and self._element is not None:
+            self.feed(*self._element)
+            self._element = None
+        self._depth -= 1
+
+    def feed(self, element_type, element_id, tag_keys, node_refs):
+        """
+            One element: its tag keys and the nodes it references
+        """
+        codes, ids, rates, counts, refs = self._batch
+        codes.append(ELEMENT_CODES[element_type])
+        ids.append(element_id)
+        rates.append(self._rates.for_element(element_type, tag_keys))
+        counts.append(len(node_refs))
+        refs.extend(node_refs)
+        if len(ids) >= BATCH_SIZE:
+            self.flush()
+
+    def flush(self):
+        codes, ids, rates, counts, refs = self._batch
+        if not ids:
+            return
+        codes = np.array(codes, dtype=np.int64)
+        ids = np.array(ids, dtype=np.int64)
+        keep = sample_hash(codes, ids, self._seed) < np.array(rates)
+        for name, code in ELEMENT_CODES.items():
+            self.kept[name].add(ids[keep & (codes == code)])
+        if self._closure and refs:
+            element_index = np.repeat(np.arange(len(ids)), counts)
+            self.needed_nodes.add(np.array(refs, dtype=np.int64)[keep[element_index]])
+        self._batch = ([], [], [], [], [])
+
+    def tests(self):
+        """
+            pass 2 tests for clip.copy_elements
+        """
+        return {'node': lambda ids: self.kept['node'].contains(ids) | self.needed_nodes.contains(ids),
+                'way': self.kept['way'].contains,
+                'relation': self.kept['relation'].contains}
+
+
+def _select_xml(osm_file, sampler):
+    parser = xml.parsers.expat.ParserCreate()
+    parser.StartElementHandler = sampler.start_element
+    parser.EndElementHandler = sampler.end_element
+    with open(osm_file, 'rb') as handle:
+        while True:
+            chunk = handle.read(READ_SIZE)
+            parser.Parse(chunk, not chunk)
+            if not chunk:
+                break
+    sampler.flush()
+
+
+def sample(osm_file, sample_file, rate=1.0 / k, by_type=None, by_tag=None, closure=True, seed=0):
+    """
+        Write a sample of osm_file to sample_file
+
+        rate: share of elements kept; by_type / by_tag: rates for
+        element types / tag keys; closure: also keep the nodes the
+        sampled ways and relations reference
+    """
+    rates = SampleRates(rate, by_type, by_tag)
+    if osm_file.lower().endswith('.pbf'):
+        return _sample_pbf(osm_file, sample_file, rates, closure, seed)
+
+    if not closure and not rates.by_tag:
+        # the hash alone decides: no first pass needed
+        tests = {name: rates.type_test(name, seed) for name in ELEMENT_CODES}
+    else:
+        sampler = _Sampler(rates, seed, closure)
+        _select_xml(osm_file, sampler)
+        tests = sampler.tests()
+    copy_elements(osm_file, sample_file, tests, generator='make_sample.py')
+
+
+def _sample_pbf(pbf_file, sample_file, rates, closure, seed):
+    """
+        .osm.pbf input: the same selection, with the kept
+        elements written out as XML
+    """
+    import xml.etree.ElementTree as ET
+    import osm_pbf
+
+    sampler = _Sampler(rates, seed, closure)
+    for element_type, attrs, tags, children in osm_pbf.iter_pbf_elements(pbf_file):
+        if element_type == 'way':
+            refs = children
+        elif element_type == 'relation':
+            refs = [ref for member_type, ref, _ in children if member_type == 'node']
+        else:
+            refs = []
+        sampler.feed(element_type, attrs['id'], [key for key, _ in tags], refs)
+    sampler.flush()
+    tests = sampler.tests()
+
+    with open(sample_file, 'w', encoding='utf-8') as output:
+        output.write('<?xml version="1.0" encoding="UTF-8"?>\n<osm version="0.6" generator="make_sample.py">\n')
+        for element_type, attrs, tags, children in osm_pbf.iter_pbf_elements(pbf_file):
+            if not tests[element_type](np.array([int(attrs['id'])]))[0]:
+                continue
+            elem = ET.Element(element_type, attrs)
+            for key, value in tags:
+                ET.SubElement(elem, 'tag', {'k': key, 'v': value})
+            if element_type == 'way':
+                for ref in children:
+                    ET.SubElement(elem, 'nd', {'ref': ref})
+            elif element_type == 'relation':
+                for member_type, ref, role in children:
+                    ET.SubElement(elem, 'member', {'type': member_type, 'ref': ref, 'role': role})
+            output.write('  ' + ET.tostring(elem, encoding='unicode') + '\n')
+        output.write('</osm>\n')
+
+
+def _parse_rates(values):
+    """
+        ['way=0.05', 'amenity=1'] -> {'way': 0.05, 'amenity': 1.0}
+    """
+    rates = {}
+    for value in values or []:
+        name, rate = value.split('=')
+        rates[name] = float(rate)
+    return rates
 
-with open(SAMPLE_FILE, 'w') as output:
-    output.write("""<?xml version="1.0" encoding="UTF-8"?>\n""")
-    output.write("""<osm>\n  """)
 
-    # Write every kth top level element
-    for i, element in enumerate(get_element(OSM_FILE)):
-        if i % k == 0:
-            s = ET.tostring(element, encoding='utf-8')
-            s = "{}".format(s)
-            output.write(s)
+if __name__ == '__main__':
+    arguments = argparse.ArgumentParser(description="Sample an OSM file")
+    arguments.add_argument('input', nargs='?', default=OSM_FILE)
+    arguments.add_argument('output', nargs='?', default=SAMPLE_FILE)
+    arguments.add_argument('-k', type=float, default=k, help="keep about one in k elements")
+    arguments.add_argument('--seed', type=int, default=0)
+    arguments.add_argument('--type-rate', action='append', metavar='TYPE=RATE',
+                           help="rate for an element type (node, way, relation)")
+    arguments.add_argument('--tag-rate', action='append', metavar='KEY=RATE',
+                           help="rate for elements with a tag key")
+    arguments.add_argument('--no-closure', action='store_true',
+                           help="do not add the nodes used by sampled ways / relations")
+    args = arguments.parse_args()
 
-    output.write('</osm>')
+    sample(args.input, args.output, rate=1.0 / args.k,
+           by_type=_parse_rates(args.type_rate), by_tag=_parse_rates(args.tag_rate),
+           closure=not args.no_closure, seed=args.seed)
@@ -0,0 +1,404 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+    Export an OSM file as MongoDB documents, or load it into MongoDB
+
+    One document per node and per way, with the element's tags
+    embedded and, for a way, the ids of its nodes in order:
+
+        {"_id": 331263945, "user": "...", "uid": 102, "version": 3,
+         "changeset": 3424, "timestamp": "2013-03-10T20:10:04Z",
+         "geometry": {"type": "Point", "coordinates": [-90.0577836, 29.9625727]},
+         "tags": [{"key": "amenity", "value": "restaurant", "type": "regular"}]}
+
+        {"_id": 30529617, "user": "...", ...,
+         "node_refs": [338107446, 338107447, 338107449],
+         "geometry": {"type": "LineString", "coordinates": [[lon, lat], ...]},
+         "tags": [{"key": "street", "value": "Magazine Street", "type": "addr"}]}
+
+    Tags are a list of key / value / type as in the tag tables, so one
+    index on tags.key and tags.value serves every tag, and keys with a
+    '.' need no escaping.  Way coordinates come from a node location
+    store (node_locations.py) filled as the nodes stream past, as
+    IngestGeometry does; nodes missing from the extract are left out,
+    and a way left with fewer than two points gets no geometry.
+
+    export_jsonl writes nodes.jsonl and ways.jsonl (or .gz / .zst),
+    a document a line, for mongoimport.  load inserts the documents
+    straight into a database: unordered insert_many calls of
+    BATCH_SIZE documents on workers threads sharing one MongoClient,
+    into staging collections which are indexed once full (INDEXES)
+    and then renamed over nodes and ways.
+
+    usage: python mongo_loader.py map.osm --jsonl output_directory [--compression gzip]
+           python mongo_loader.py map.osm [--uri mongodb://localhost:27017] [--database osm]
+                                          [--workers 4] [--batch-size 1000]
+"""
+import argparse
+import collections
+import concurrent.futures
+import json
+import os
+import tempfile
+import time
+
+import csv_compression
+import data
+from node_locations import NodeLocationBuilder
+from street_map_csv_writer import WRITE_BUFFER_SIZE
+from way_geometry import WayGeometry, _node_location
+
+COLLECTIONS = ('nodes', 'ways')
+JSONL_FILENAMES = {'nodes': 'nodes.jsonl', 'ways': 'ways.jsonl'}
+STAGING_SUFFIX = '_staging'
+
+DEFAULT_URI = 'mongodb://localhost:27017'
+DEFAULT_DATABASE = 'osm'
+# documents per insert_many call
+BATCH_SIZE = 1000
+WORKERS = 4
+
+TAG_INDEX = [('tags.key', 1), ('tags.value', 1)]
+INDEXES = {'nodes': [[('geometry', '2dsphere')], TAG_INDEX],
+           'ways': [[('geometry', '2dsphere')], TAG_INDEX, [('node_refs', 1)]]}
+
+INTEGER_FIELDS = ('uid', 'version', 'changeset')
+
+
+def _pymongo():
+    try:
+        import pymongo
+    except ImportError:
+        raise ImportError("MongoDB loads need the pymongo package (pip install pymongo)")
+    return pymongo
+
+
+def _attributes(document, record, fields):
+    """
+        Copy the attributes of a shaped dict or tuple record after
+        its id into document, leaving out the missing ones
+    """
+    values = record if isinstance(record, dict) else dict(zip(fields, record))
+    for field in fields:
+        value = values.get(field)
+        if field in ('id', 'lat', 'lon') or value in (None, ''):
+            continue
+        document[field] = int(value) if field in INTEGER_FIELDS else value
+    return document
+
+
+def _tags(tag_records):
+    tags = []
+    for tag in tag_records:
+        if isinstance(tag, dict):
+            tags.append({'key': tag['key'], 'value': tag['value'], 'type': tag['type']})
+        else:
+            tags.append({'key': tag[1], 'value': tag[2], 'type': tag[3]})
+    return tags
+
+
+def point(lat, lon):
+    """
+        A GeoJSON Point, or None where lat / lon are missing or
+        out of range (a 2dsphere index rejects those)
+    """
+    if lat in (None, '') or lon in (None, ''):
+        return None
+    lat, lon = float(lat), float(lon)
+    if not (-90.0 <= lat <= 90.0 and -180.0 <= lon <= 180.0):
+        return None
+    return {'type': 'Point', 'coordinates': [lon, lat]}
+
+
+def line_string(lats, lons):
+    """
+        A GeoJSON LineString of the known points (NaN lat for a
+        node outside the extract), or None if fewer than two
+        distinct points are known
+    """
+    coordinates = []
+    for lat, lon in zip(lats, lons):
+        if lat != lat:
+            continue
+        # rounding to 1e-7 gives back the digits of the source file
+        position = [round(lon, 7), round(lat, 7)]
+        # a 2dsphere index rejects repeated vertices
+        if not coordinates or coordinates[-1] != position:
+            coordinates.append(position)
+    if len(coordinates) < 2:
+        return None
+    return {'type': 'LineString', 'coordinates': coordinates}
+
+
+def node_document(el):
+    """
+        The document of a shaped node record (dicts or tuples)
+    """
+    node_id, lat, lon = _node_location(el['node'])
+    document = {'_id': int(node_id)}
+    _attributes(document, el['node'], data.NODE_FIELDS)
+    geometry = point(lat, lon)
+    if geometry is not None:
+        document['geometry'] = geometry
+    document['tags'] = _tags(el['node_tags'])
+    return document
+
+
+def way_document(el):
+    """
+        The document of a shaped way record, without its geometry
+    """
+    way = el['way']
+    document = {'_id': int(way['id'] if isinstance(way, dict) else way[0])}
+    _attributes(document, way, data.WAY_FIELDS)
+    refs = [way_node['node_id'] if isinstance(way_node, dict) else way_node[1]
+            for way_node in el['way_nodes']]
+    document['node_refs'] = [int(ref) for ref in refs]
+    document['tags'] = _tags(el['way_tags'])
+    return document
+
+
+class DocumentStream():
+    """
+        Turns shaped node and way records into (collection, document)
+        pairs.  Ways are held back in batches until WayGeometry has
+        looked their nodes up in the store.
+    """
+
+    def __init__(self, path):
+        """
+            path: directory for the node location store
+        """
+        self._builder = NodeLocationBuilder(path)
+        self._geometry = None
+        self._waiting = collections.deque()
+        self._ready = []
+
+    def write(self, batch):
+        """
+            Give the waiting ways of a WayBatch their geometry
+        """
+        lats = batch.lats.tolist()
+        lons = batch.lons.tolist()
+        offsets = batch.offsets.tolist()
+        for index in range(len(batch.way_ids)):
+            document = self._waiting.popleft()
+            geometry = line_string(lats[offsets[index]:offsets[index + 1]],
+                                   lons[offsets[index]:offsets[index + 1]])
+            if geometry is not None:
+                document['geometry'] = geometry
+            self._ready.append(document)
+
+    def close(self):
+        pass
+
+    def documents(self, records):
+        """
+            Yield (collection, document) for the nodes and ways of records
+        """
+        for el in records:
+            if 'node' in el:
+                if self._geometry is not None:
+                    raise ValueError("node {} follows a way: node locations need the nodes first"
+                                     .format(_node_location(el['node'])[0]))
+                self._builder.add_node(*_node_location(el['node']))
+                yield 'nodes', node_document(el)
+            elif 'way' in el:
+                if self._geometry is None:
+                    self._geometry = WayGeometry(self._builder.close(), [self])
+                document = way_document(el)
+                self._waiting.append(document)
+                self._geometry.add_way(document['_id'], document['node_refs'])
+                if self._ready:
+                    for document in self._ready:
+                        yield 'ways', document
+                    self._ready = []
+        if self._geometry is None:
+            self._builder.close()
+            return
+        self._geometry.close()
+        for document in self._ready:
+            yield 'ways', document
+        self._ready = []
+
+
+def iter_documents(osm_file, scratch, backend=data.DEFAULT_BACKEND, workers=1):
+    """
+        Yield (collection, document) for the nodes and ways of
+        osm_file (OSM XML or .osm.pbf); scratch is a directory for
+        the node location store
+    """
+    from osm_parsers import iter_shaped_elements
+
+    records = iter_shaped_elements(osm_file, tags=('node', 'way'), backend=backend,
+                                   workers=workers, rows=True)
+    stream = DocumentStream(os.path.join(scratch, 'node_locations'))
+    return stream.documents(records)
+
+
+def export_jsonl(osm_file, output_directory, compression=None, backend=data.DEFAULT_BACKEND,
+                 workers=1):
+    """
+        Write the documents of osm_file to nodes.jsonl and ways.jsonl
+        in output_directory, gzip / zstd compressed with compression.
+
+        Returns {collection: documents written}.
+    """
+    csv_compression.check_compression(compression)
+    os.makedirs(output_directory, exist_ok=True)
+    executor = csv_compression.make_executor() if compression is not None else None
+    handles = {}
+    for collection in COLLECTIONS:
+        filename = csv_compression.compressed_filename(JSONL_FILENAMES[collection], compression)
+        filepath = os.path.join(output_directory, filename)
+        if compression is None:
+            handles[collection] = open(filepath, 'w', encoding='utf-8',
+                                       buffering=WRITE_BUFFER_SIZE)
+        else:
+            handles[collection] = csv_compression.CompressedTextFile(
+                filepath, csv_compression.make_compressor(compression), executor)
+    counts = collections.Counter({collection: 0 for collection in COLLECTIONS})
+    try:
+        with tempfile.TemporaryDirectory(prefix='mongo_') as scratch:
+            for collection, document in iter_documents(osm_file, scratch, backend, workers):
+                handle = handles[collection]
+                handle.write(json.dumps(document, ensure_ascii=False, separators=(',', ':')))
+                handle.write('\n')
+                counts[collection] += 1
+                if compression is not None and not counts[collection] % BATCH_SIZE:
+                    handle.spill()
+    finally:
+        for handle in handles.values():
+            handle.close()
+        if executor is not None:
+            executor.shutdown()
+    return dict(counts)
+
+
+class BatchInserter():
+    """
+        Inserts documents with unordered insert_many calls of
+        batch_size documents, up to workers calls at a time
+    """
+
+    def __init__(self, database, workers=WORKERS, batch_size=BATCH_SIZE):
+        self._database = database
+        self._batch_size = batch_size
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers,
+                                                               thread_name_prefix='insert')
+        # batches parsed ahead of the inserts, at most
+        self._max_pending = 2 * workers
+        self._pending = collections.deque()
+        self._batches = collections.defaultdict(list)
+        self.counts = collections.Counter()
+
+    def add(self, collection, document):
+        batch = self._batches[collection]
+        batch.append(document)
+        if len(batch) >= self._batch_size:
+            self._submit(collection)
+
+    def _submit(self, collection):
+        batch = self._batches.pop(collection)
+        self.counts[collection] += len(batch)
+        self._pending.append(self._executor.submit(self._insert, collection, batch))
+        while len(self._pending) > self._max_pending:
+            self._pending.popleft().result()
+
+    def _insert(self, collection, documents):
+        self._database[collection].insert_many(documents, ordered=False)
+
+    def close(self):
+        """
+            Insert the batched documents and wait for every insert
+        """
+        try:
+            for collection in list(self._batches):
+                self._submit(collection)
+            while self._pending:
+                self._pending.popleft().result()
+        finally:
+            self._executor.shutdown()
+
+
+def create_indexes(database, names=COLLECTIONS, suffix=''):
+    """
+        Build the INDEXES of the collections names (each named
+        name + suffix in database)
+    """
+    pymongo = _pymongo()
+    for collection in names:
+        database[collection + suffix].create_indexes(
+            [pymongo.IndexModel(keys) for keys in INDEXES[collection]])
+
+
+def load(osm_file, uri=DEFAULT_URI, database=DEFAULT_DATABASE, workers=WORKERS,
+         batch_size=BATCH_SIZE, backend=data.DEFAULT_BACKEND, parse_workers=1):
+    """
+        Load the nodes and ways of osm_file (OSM XML or .osm.pbf) into
+        the nodes and ways collections of database, replacing them.
+        parse_workers are the .osm.pbf decode workers.
+
+        Returns the documents loaded per collection, the seconds
+        spent loading and indexing, and documents_per_second.
+    """
+    start = time.perf_counter()
+    client = _pymongo().MongoClient(uri, maxPoolSize=workers + 1)
+    try:
+        db = client[database]
+        for collection in COLLECTIONS:
+            db.drop_collection(collection + STAGING_SUFFIX)
+        inserter = BatchInserter(db, workers=workers, batch_size=batch_size)
+        try:
+            with tempfile.TemporaryDirectory(prefix='mongo_') as scratch:
+                for collection, document in iter_documents(osm_file, scratch, backend,
+                                                           parse_workers):
+                    inserter.add(collection + STAGING_SUFFIX, document)
+        finally:
+            inserter.close()
+        loaded = time.perf_counter()
+
+        # creating the indexes also creates a collection nothing went into
+        create_indexes(db, suffix=STAGING_SUFFIX)
+        for collection in COLLECTIONS:
+            db[collection + STAGING_SUFFIX].rename(collection, dropTarget=True)
+        indexed = time.perf_counter()
+    finally:
+        client.close()
+
+    stats = {'documents': {collection: inserter.counts[collection + STAGING_SUFFIX]
+                           for collection in COLLECTIONS},
+             'load_seconds': loaded - start,
+             'index_seconds': indexed - loaded}
+    total = sum(stats['documents'].values())
+    stats['documents_per_second'] = total / stats['load_seconds'] if stats['load_seconds'] else None
+    return stats
+
+
+if __name__ == '__main__':
+    arguments = argparse.ArgumentParser(description="Export or load an OSM file as MongoDB documents")
+    arguments.add_argument('osm_file')
+    arguments.add_argument('--jsonl', metavar='OUTPUT_DIRECTORY',
+                           help="write JSON Lines files rather than load a database")
+    arguments.add_argument('--compression', choices=sorted(csv_compression.COMPRESSIONS))
+    arguments.add_argument('--uri', default=DEFAULT_URI)
+    arguments.add_argument('--database', default=DEFAULT_DATABASE)
+    arguments.add_argument('--workers', type=int, default=WORKERS, help="insert threads")
+    arguments.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+    arguments.add_argument('--backend', default=data.DEFAULT_BACKEND)
+    args = arguments.parse_args()
+
+    if args.jsonl:
+        start = time.perf_counter()
+        counts = export_jsonl(args.osm_file, args.jsonl, compression=args.compression,
+                              backend=args.backend)
+        print("wrote {} nodes and {} ways in {:.2f}s".format(
+            counts['nodes'], counts['ways'], time.perf_counter() - start))
+    else:
+        stats = load(args.osm_file, args.uri, args.database, workers=args.workers,
+                     batch_size=args.batch_size, backend=args.backend)
+        print("loaded {} nodes and {} ways in {:.2f}s ({:.0f} documents/s), "
+              "indexes built in {:.2f}s".format(
+                  stats['documents']['nodes'], stats['documents']['ways'],
+                  stats['load_seconds'], stats['documents_per_second'] or 0,
+                  stats['index_seconds']))
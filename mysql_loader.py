@@ -0,0 +1,409 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+    Bulk loads into MySQL: the csv files written by data.py, and the
+    map_node table of database_mysql/db.py
+
+    Database.add_node deletes, inserts a single row and commits for
+    every node: a network round trip or three and a log flush each.
+    Here instead:
+
+    * rows go to a staging table, made LIKE the live table with its
+      secondary indexes dropped.  Plain csv files are read by the
+      server with LOAD DATA LOCAL INFILE.  Compressed ones (and the
+      map_node rows) go in multi-row INSERTs of BATCH_SIZE rows,
+      committed every COMMIT_ROWS rows.
+    * the indexes are added back with one ALTER TABLE per table
+    * a single RENAME TABLE then swaps every staging table in for
+      its live table, so readers see all the old rows or all the new
+    * load_nodes(..., replace=False) merges instead of swapping: the
+      nodes loaded replace those with the same opm_id, in one
+      transaction, where add_node deletes them one at a time
+
+    ConnectionPool keeps connections open for reuse; a load uses one
+    connection throughout.  Empty csv fields are loaded as NULL in
+    the columns that allow it, and as '' in the NOT NULL ones (e.g.
+    the tag_value of way_tag).
+
+    LOAD DATA LOCAL INFILE needs local_infile=ON on the server; with
+    local_infile=False every file is inserted instead.
+
+    Needs the mysqlclient package.
+
+    usage: python mysql_loader.py generated_data [--host 127.0.0.1] [--port 3306]
+                                  [--database udacity] [--user root] [--password '']
+                                  [--create-tables] [--no-local-infile]
+"""
+import argparse
+import collections
+import contextlib
+import csv
+import os
+import queue
+import time
+
+from csv_compression import find_table, open_text
+from sqlite_loader import SQL_TABLES
+from street_map_csv_writer import TABLES
+
+TABLES_SQL = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                          'database_mysql', 'create_tables.sql')
+STAGING_SUFFIX = '_staging'
+OLD_SUFFIX = '_old'
+
+# rows per multi-row INSERT; well under the 4MB max_allowed_packet of MySQL 5.7
+BATCH_SIZE = 2000
+# rows per transaction
+COMMIT_ROWS = 1000000
+
+# map_node columns, in the order add_node takes them
+MAP_NODE_COLUMNS = ('opm_id', 'name', 'coordinates', 'description', 'cuisine',
+                    'denomination', 'amenity', 'shop')
+MAP_NODE_VALUES = "(%s, %s, point(%s, %s), %s, %s, %s, %s, %s)"
+
+
+def _mysqldb():
+    try:
+        import MySQLdb
+    except ImportError:
+        raise ImportError("MySQL loads need the mysqlclient package (pip install mysqlclient)")
+    return MySQLdb
+
+
+class ConnectionPool():
+    """
+        Keeps up to size open MySQLdb connections for reuse;
+        connect_args are those of MySQLdb.connect
+    """
+
+    def __init__(self, size=4, **connect_args):
+        self._connect_args = dict(connect_args)
+        self._connect_args.setdefault('charset', 'utf8mb4')
+        self._connect_args.setdefault('local_infile', 1)
+        self._idle = queue.LifoQueue(maxsize=size)
+
+    def get(self):
+        """
+            An idle connection still alive, or a new one
+        """
+        while True:
+            try:
+                connection = self._idle.get_nowait()
+            except queue.Empty:
+                return _mysqldb().connect(**self._connect_args)
+            try:
+                connection.ping()
+                return connection
+            except _mysqldb().Error:
+                connection.close()
+
+    def put(self, connection):
+        """
+            Hand a connection back, rolling back anything
+            left uncommitted; closed if the pool is full
+        """
+        connection.rollback()
+        try:
+            self._idle.put_nowait(connection)
+        except queue.Full:
+            connection.close()
+
+    @contextlib.contextmanager
+    def connection(self):
+        connection = self.get()
+        try:
+            yield connection
+        finally:
+            self.put(connection)
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+def create_tables(connection, tables_sql=TABLES_SQL):
+    """
+        Run the statements of create_tables.sql
+    """
+    with open(tables_sql) as handle:
+        lines = [line for line in handle if not line.lstrip().startswith('--')]
+    cursor = connection.cursor()
+    for statement in "".join(lines).split(';'):
+        if statement.strip():
+            cursor.execute(statement)
+    connection.commit()
+
+
+def insert_rows(connection, table, rows, batch_size=BATCH_SIZE, values_sql=None,
+                columns=None, commit_rows=COMMIT_ROWS):
+    """
+        Insert rows into table with multi-row INSERTs of batch_size
+        rows, committing every commit_rows rows.  values_sql is the
+        VALUES tuple of one row (all %s by default).  Returns the
+        number of rows inserted.
+    """
+    cursor = connection.cursor()
+    prefix = "insert into {}{} values ".format(
+        table, " ({})".format(", ".join(columns)) if columns else "")
+    count = 0
+    uncommitted = 0
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= batch_size:
+            _insert_batch(cursor, prefix, values_sql, batch)
+            count += len(batch)
+            uncommitted += len(batch)
+            batch = []
+            if uncommitted >= commit_rows:
+                connection.commit()
+                uncommitted = 0
+    if batch:
+        _insert_batch(cursor, prefix, values_sql, batch)
+        count += len(batch)
+    connection.commit()
+    return count
+
+
+def _insert_batch(cursor, prefix, values_sql, batch):
+    values_sql = values_sql or "({})".format(", ".join(["%s"] * len(batch[0])))
+    cursor.execute(prefix + ", ".join([values_sql] * len(batch)),
+                   [value for row in batch for value in row])
+
+
+def secondary_indexes(cursor, table):
+    """
+        [(index name, ALTER TABLE clause adding it)] of the
+        indexes of table other than the primary key
+    """
+    cursor.execute("show index from {}".format(table))
+    names = [description[0].lower() for description in cursor.description]
+    indexes = collections.OrderedDict()
+    for row in cursor.fetchall():
+        row = dict(zip(names, row))
+        if row['key_name'] == 'PRIMARY':
+            continue
+        index = indexes.setdefault(row['key_name'], {'row': row, 'columns': {}})
+        column = "`{}`".format(row['column_name'])
+        # 5.7 gives spatial columns a sub_part, which they cannot be declared with
+        if row['sub_part'] and row['index_type'] != 'SPATIAL':
+            column += "({})".format(row['sub_part'])
+        index['columns'][int(row['seq_in_index'])] = column
+
+    clauses = []
+    for name, index in indexes.items():
+        row = index['row']
+        if row['index_type'] in ('SPATIAL', 'FULLTEXT'):
+            kind = row['index_type'].lower() + " index"
+        else:
+            kind = "index" if int(row['non_unique']) else "unique index"
+        columns = ", ".join(column for _, column in sorted(index['columns'].items()))
+        clauses.append((name, "add {} `{}` ({})".format(kind, name, columns)))
+    return clauses
+
+
+def stage_table(connection, table):
+    """
+        Make an empty staging table like table, without its
+        secondary indexes.  Returns (staging table, the clauses
+        that add the indexes back).
+    """
+    cursor = connection.cursor()
+    staging = table + STAGING_SUFFIX
+    cursor.execute("drop table if exists {}".format(staging))
+    cursor.execute("create table {} like {}".format(staging, table))
+    indexes = secondary_indexes(cursor, staging)
+    if indexes:
+        cursor.execute("alter table {} {}".format(
+            staging, ", ".join("drop index `{}`".format(name) for name, _ in indexes)))
+    return staging, [clause for _, clause in indexes]
+
+
+def add_indexes(connection, table, clauses):
+    if clauses:
+        connection.cursor().execute("alter table {} {}".format(table, ", ".join(clauses)))
+
+
+def swap_tables(connection, tables):
+    """
+        Put the staging table of each of tables in its place with
+        one atomic RENAME TABLE, and drop the tables replaced
+    """
+    cursor = connection.cursor()
+    old_tables = ", ".join(table + OLD_SUFFIX for table in tables)
+    cursor.execute("drop table if exists {}".format(old_tables))
+    renames = []
+    for table in tables:
+        renames.append("{0} to {0}{1}".format(table, OLD_SUFFIX))
+        renames.append("{0}{1} to {0}".format(table, STAGING_SUFFIX))
+    cursor.execute("rename table {}".format(", ".join(renames)))
+    cursor.execute("drop table {}".format(old_tables))
+
+
+def load_nodes(connection, nodes, replace=False, batch_size=BATCH_SIZE):
+    """
+        Load nodes (the dicts Database.add_node takes) into map_node.
+
+        replace=True swaps in a map_node of just these nodes.
+        Otherwise they replace the rows with the same opm_id, and
+        the others stay.  Where an id comes more than once, the
+        last node wins, as it does with add_node.
+
+        Returns the number of nodes loaded.
+    """
+    latest = {}
+    for node in nodes:
+        latest[node['id']] = node
+    rows = ((node['id'], node['name'], node['lon'], node['lat'], node['description'],
+             node['cuisine'], node['denomination'], node['amenity'], node['shop'])
+            for node in latest.values())
+
+    staging, indexes = stage_table(connection, 'map_node')
+    count = insert_rows(connection, staging, rows, batch_size, MAP_NODE_VALUES, MAP_NODE_COLUMNS)
+    cursor = connection.cursor()
+    if replace:
+        add_indexes(connection, staging, indexes)
+        swap_tables(connection, ['map_node'])
+        return count
+
+    columns = ", ".join(MAP_NODE_COLUMNS)
+    try:
+        cursor.execute("delete map_node from {} staging "
+                       "inner join map_node on map_node.opm_id = staging.opm_id".format(staging))
+        cursor.execute("insert into map_node ({0}) select {0} from {1}".format(columns, staging))
+        connection.commit()
+    except Exception:
+        connection.rollback()
+        raise
+    finally:
+        cursor.execute("drop table {}".format(staging))
+    return count
+
+
+def table_columns(cursor, table):
+    """
+        [(column, allows NULL)] of table, in order
+    """
+    cursor.execute("show columns from {}".format(table))
+    return [(row[0], row[2] == 'YES') for row in cursor.fetchall()]
+
+
+def _has_header(path, fields):
+    with open_text(path) as handle:
+        return next(csv.reader(handle), None) == list(fields)
+
+
+def _csv_rows(path, fields, nullable):
+    """
+        The rows of a csv file (plain, .gz or .zst), without its
+        header, with the empty fields of nullable columns (a flag
+        per field) as None
+    """
+    with open_text(path) as handle:
+        reader = csv.reader(handle)
+        first = next(reader, None)
+        if first is not None and first != list(fields):
+            yield [None if value == '' and null else value for value, null in zip(first, nullable)]
+        for row in reader:
+            yield [None if value == '' and null else value for value, null in zip(row, nullable)]
+
+
+def _field_value(variable, nullable):
+    """
+        The SET expression of a LOAD DATA column read into variable.
+        With escaped by '' LOAD DATA reads an unquoted NULL field as
+        NULL: it is the text 'NULL' (csv.writer only quotes fields
+        when it must), as on the insert path.
+    """
+    value = "coalesce({}, 'NULL')".format(variable)
+    return "nullif({}, '')".format(value) if nullable else value
+
+
+def load_data_infile(connection, table, path, fields):
+    """
+        LOAD DATA LOCAL INFILE a plain csv file into table.
+        Returns the number of rows loaded.
+    """
+    cursor = connection.cursor()
+    columns = table_columns(cursor, table)
+    variables = ["@c{}".format(position) for position in range(len(columns))]
+    cursor.execute("""
+        load data local infile %s into table {}
+        character set utf8mb4
+        fields terminated by ',' optionally enclosed by '"' escaped by ''
+        lines terminated by '\\r\\n'
+        {}
+        ({})
+        set {}""".format(table, "ignore 1 lines" if _has_header(path, fields) else "",
+                         ", ".join(variables),
+                         ", ".join("`{}` = {}".format(column, _field_value(variable, nullable))
+                                   for (column, nullable), variable in zip(columns, variables))),
+                   (os.path.abspath(path),))
+    connection.commit()
+    return cursor.rowcount
+
+
+def load_csv_files(connection, directory, local_infile=True, batch_size=BATCH_SIZE):
+    """
+        Load the csv files data.py wrote to directory (plain, .gz or
+        .zst) into the eight tables, replacing what they held.
+        LOAD DATA LOCAL INFILE needs a connection made with
+        local_infile=1, as ConnectionPool makes them.
+
+        Returns {table: (rows, seconds)}; the seconds include
+        adding the indexes.
+    """
+    stats = collections.OrderedDict()
+    cursor = connection.cursor()
+    cursor.execute("set session unique_checks = 0")
+    try:
+        for writer_name, filename, fields in TABLES:
+            table = SQL_TABLES[writer_name]
+            path = find_table(directory, filename)
+            start = time.perf_counter()
+            staging, indexes = stage_table(connection, table)
+            if local_infile and path.endswith('.csv'):
+                rows = load_data_infile(connection, staging, path, fields)
+            else:
+                nullable = [null for _, null in table_columns(cursor, staging)]
+                rows = insert_rows(connection, staging, _csv_rows(path, fields, nullable),
+                                   batch_size)
+            add_indexes(connection, staging, indexes)
+            stats[table] = (rows, time.perf_counter() - start)
+    finally:
+        cursor.execute("set session unique_checks = 1")
+    swap_tables(connection, list(stats))
+    return stats
+
+
+if __name__ == '__main__':
+    arguments = argparse.ArgumentParser(description="Load the csv files into MySQL")
+    arguments.add_argument('directory')
+    arguments.add_argument('--host', default='127.0.0.1')
+    arguments.add_argument('--port', type=int, default=3306)
+    arguments.add_argument('--database', default='udacity')
+    arguments.add_argument('--user', default='root')
+    arguments.add_argument('--password', default='')
+    arguments.add_argument('--create-tables', action='store_true',
+                           help="run database_mysql/create_tables.sql first")
+    arguments.add_argument('--no-local-infile', action='store_true',
+                           help="insert every file rather than LOAD DATA LOCAL INFILE")
+    args = arguments.parse_args()
+
+    pool = ConnectionPool(size=1, host=args.host, port=args.port, db=args.database,
+                          user=args.user, passwd=args.password)
+    with pool.connection() as connection:
+        if args.create_tables:
+            create_tables(connection)
+        stats = load_csv_files(connection, args.directory,
+                               local_infile=not args.no_local_infile)
+    pool.close()
+    for table, (rows, seconds) in stats.items():
+        print("{0: <16} {1: >12} rows {2: >8.2f}s {3: >10.0f} rows/s".format(
+            table, rows, seconds, rows / seconds if seconds else 0))
+    total_rows = sum(rows for rows, _ in stats.values())
+    total_seconds = sum(seconds for _, seconds in stats.values())
+    print("loaded {} rows in {:.2f}s".format(total_rows, total_seconds))
@@ -0,0 +1,248 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+    An on-disk table of node coordinates keyed by node id
+
+    ways_nodes.csv only holds node ids, so any question about a
+    way's geometry needs every node's location.  The store keeps
+    lat / lon as int32 (1e-7 degree units, the precision OSM uses)
+    in a memory-mapped file, so it costs no memory until it is
+    read, outlives the ingest and reopens instantly.
+
+    Two layouts, picked from the id range when the store is built:
+
+        dense   one slot per id between the smallest and the
+                largest; a lookup is an array index
+        sparse  the ids, sorted, next to their coordinates; a
+                lookup is a binary search (np.searchsorted)
+
+    Lookups take a whole array of node ids at once.
+
+        builder = NodeLocationBuilder('generated_data/node_locations')
+        builder.add_nodes(ids, lats, lons)
+        locations = builder.close()
+        lats, lons = locations.lookup(node_ids)     # NaN where unknown
+"""
+import json
+import os
+
+import numpy as np
+
+META_FILENAME = "meta.json"
+IDS_FILENAME = "ids.bin"
+COORDS_FILENAME = "coords.bin"
+
+# 1e-7 degrees, the resolution of OSM coordinates
+SCALE = 10000000
+# coordinate of a dense slot with no node
+MISSING = np.iinfo(np.int32).min
+
+# use the dense layout while the id range is at most this many times the node count
+DENSE_RATIO = 4
+# nodes buffered in python lists before they are appended to disk
+CHUNK_SIZE = 65536
+# ids handled at a time when the store is laid out
+LAYOUT_CHUNK = 1024 * 1024
+
+
+class NodeLocationBuilder():
+    """
+        Collects node locations and lays them out as a store
+
+        Nodes are appended to temporary files a chunk at a time,
+        so building takes constant memory however large the input.
+    """
+
+    def __init__(self, path, chunk_size=CHUNK_SIZE):
+        self._path = path
+        self._chunk_size = chunk_size
+        os.makedirs(path, exist_ok=True)
+        # a store being rebuilt must not be opened half way
+        if os.path.exists(os.path.join(path, META_FILENAME)):
+            os.remove(os.path.join(path, META_FILENAME))
+
+        self._ids_path = os.path.join(path, IDS_FILENAME + '.tmp')
+        self._coords_path = os.path.join(path, COORDS_FILENAME + '.tmp')
+        self._ids_handle = open(self._ids_path, 'wb')
+        self._coords_handle = open(self._coords_path, 'wb')
+        self._ids = []
+        self._lats = []
+        self._lons = []
+        self.count = 0
+
+    def add_node(self, node_id, lat, lon):
+        """
+            Add one node; values may be numbers or the strings
+            found in the XML
+        """
+        self._ids.append(node_id)
+        self._lats.append(lat)
+        self._lons.append(lon)
+        if len(self._ids) >= self._chunk_size:
+            self._write_chunk()
+
+    def add_nodes(self, node_ids, lats, lons):
+        """
+            Add sequences (or arrays) of nodes
+        """
+        self._ids.extend(node_ids)
+        self._lats.extend(lats)
+        self._lons.extend(lons)
+        if len(self._ids) >= self._chunk_size:
+            self._write_chunk()
+
+    def _write_chunk(self):
+        if not self._ids:
+            return
+        ids = np.array(self._ids, dtype=np.int64)
+        coords = np.empty((len(ids), 2), dtype=np.int32)
+        coords[:, 0] = np.rint(np.array(self._lats, dtype=np.float64) * SCALE)
+        coords[:, 1] = np.rint(np.array(self._lons, dtype=np.float64) * SCALE)
+        ids.tofile(self._ids_handle)
+        coords.tofile(self._coords_handle)
+        self.count += len(ids)
+        self._ids, self._lats, self._lons = [], [], []
+
+    def close(self):
+        """
+            Lay out the store and return it opened
+        """
+        self._write_chunk()
+        self._ids_handle.close()
+        self._coords_handle.close()
+
+        ids = np.memmap(self._ids_path, dtype=np.int64, mode='r') \
+            if self.count else np.empty(0, np.int64)
+        meta = {'count': self.count, 'scale': SCALE}
+        if self.count:
+            meta['min_id'] = int(ids.min())
+            meta['max_id'] = int(ids.max())
+            span = meta['max_id'] - meta['min_id'] + 1
+            meta['layout'] = 'dense' if span <= DENSE_RATIO * self.count else 'sparse'
+        else:
+            meta['min_id'] = meta['max_id'] = 0
+            meta['layout'] = 'sparse'
+
+        coords = np.memmap(self._coords_path, dtype=np.int32, mode='r', shape=(self.count, 2)) \
+            if self.count else np.empty((0, 2), np.int32)
+        if meta['layout'] == 'dense':
+            self._layout_dense(ids, coords, meta)
+        else:
+            self._layout_sparse(ids, coords)
+        del ids, coords
+        os.remove(self._ids_path)
+        os.remove(self._coords_path)
+
+        with open(os.path.join(self._path, META_FILENAME), 'w') as handle:
+            json.dump(meta, handle, indent=2)
+        return NodeLocations(self._path)
+
+    def _layout_dense(self, ids, coords, meta):
+        span = meta['max_id'] - meta['min_id'] + 1
+        table = np.memmap(os.path.join(self._path, COORDS_FILENAME), dtype=np.int32,
+                          mode='w+', shape=(span, 2))
+        table[:] = MISSING
+        for start in range(0, len(ids), LAYOUT_CHUNK):
+            chunk = slice(start, start + LAYOUT_CHUNK)
+            table[ids[chunk] - meta['min_id']] = coords[chunk]
+        table.flush()
+        del table
+        ids_path = os.path.join(self._path, IDS_FILENAME)
+        if os.path.exists(ids_path):
+            os.remove(ids_path)
+
+    def _layout_sparse(self, ids, coords):
+        # extracts list nodes by id, so the sort is usually a no-op
+        if len(ids) > 1 and not np.all(ids[1:] >= ids[:-1]):
+            order = np.argsort(ids, kind='stable')
+            ids = ids[order]
+            coords = coords[order]
+        ids.tofile(os.path.join(self._path, IDS_FILENAME))
+        np.ascontiguousarray(coords).tofile(os.path.join(self._path, COORDS_FILENAME))
+
+
+class NodeLocations():
+    """
+        A store written by NodeLocationBuilder, memory-mapped read only
+    """
+
+    def __init__(self, path):
+        with open(os.path.join(path, META_FILENAME)) as handle:
+            self.meta = json.load(handle)
+        self.path = path
+        self.layout = self.meta['layout']
+        self._min_id = self.meta['min_id']
+        self._scale = float(self.meta['scale'])
+
+        coords_path = os.path.join(path, COORDS_FILENAME)
+        if self.layout == 'dense':
+            span = self.meta['max_id'] - self._min_id + 1
+            self._ids = None
+            self._coords = np.memmap(coords_path, dtype=np.int32, mode='r', shape=(span, 2))
+        elif self.meta['count']:
+            self._ids = np.memmap(os.path.join(path, IDS_FILENAME), dtype=np.int64, mode='r')
+            self._coords = np.memmap(coords_path, dtype=np.int32, mode='r',
+                                     shape=(self.meta['count'], 2))
+        else:
+            self._ids = np.empty(0, np.int64)
+            self._coords = np.empty((0, 2), np.int32)
+
+    def __len__(self):
+        return self.meta['count']
+
+    def lookup_fixed(self, node_ids):
+        """
+            Return (coords, found): int32 (lat, lon) pairs in 1e-7
+            degrees for node_ids, and a mask of the ids in the store
+        """
+        node_ids = np.asarray(node_ids, dtype=np.int64)
+        if self.layout == 'dense':
+            slots = node_ids - self._min_id
+            found = (slots >= 0) & (slots < len(self._coords))
+            coords = np.full((len(node_ids), 2), MISSING, dtype=np.int32)
+            coords[found] = self._coords[slots[found]]
+            found &= coords[:, 0] != MISSING
+        else:
+            positions = np.searchsorted(self._ids, node_ids)
+            found = positions < len(self._ids)
+            found[found] = self._ids[positions[found]] == node_ids[found]
+            coords = np.full((len(node_ids), 2), MISSING, dtype=np.int32)
+            coords[found] = self._coords[positions[found]]
+        return coords, found
+
+    def lookup(self, node_ids):
+        """
+            Return (lats, lons) float arrays for node_ids,
+            NaN for ids that are not in the store
+        """
+        coords, found = self.lookup_fixed(node_ids)
+        lats = np.where(found, coords[:, 0] / self._scale, np.nan)
+        lons = np.where(found, coords[:, 1] / self._scale, np.nan)
+        return lats, lons
+
+
+def open_node_locations(path):
+    """
+        Open the store at path, or return None if there is none
+    """
+    if not os.path.exists(os.path.join(path, META_FILENAME)):
+        return None
+    return NodeLocations(path)
+
+
+def build_from_csv(nodes_csv, path):
+    """
+        Build a store from a nodes.csv (or .csv.gz / .csv.zst)
+        written by process_map
+    """
+    import csv
+    from csv_compression import open_text
+
+    builder = NodeLocationBuilder(path)
+    with open_text(nodes_csv) as handle:
+        for row in csv.reader(handle):
+            if row[0] == 'id':
+                # header row
+                continue
+            builder.add_node(row[0], row[1], row[2])
+    return builder.close()
@@ -0,0 +1,354 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+    Run audits of an OSM file together, in one streaming pass
+
+    Each audit is a visitor registered on an AuditEngine under a name.
+    AuditEngine.run parses the file once:
+
+    * every node / way / relation is parsed once into an Entity (its
+      tag, attributes and (k, v) tag pairs in document order) once
+      its children are in, and handed to the visit() of each audit.
+      visit() returns True when the audit needs no more entities
+      (e.g. it has found max_results examples); the pass ends early
+      once every audit has finished.
+    * audits with wants_paths also see every XML element as it opens
+      through visit_path(path, element), path being the list of tags
+      from the root down to it.  The pass is a little slower with one.
+
+    The results come back together as an AuditResults: {name: the
+    audit's result()}, with the entities visited and the seconds the
+    pass took.
+
+        engine = AuditEngine()
+        engine.register('tag_paths', TagPathCounts())
+        engine.register('node_keys', TagKeyAudit('node'))
+        engine.register('streets', TagValueCounts('addr:street'))
+        results = engine.run('maps/new_orleans_city.osm')
+        results['streets']['Bourbon Street']
+
+    An audit is a subclass of Audit; adding one adds no pass.
+
+    usage: python osm_audit.py map.osm
+"""
+import collections
+import pprint
+import re
+import sys
+import time
+import xml.etree.ElementTree as ET
+
+ENTITY_TAGS = ('node', 'way', 'relation')
+
+Entity = collections.namedtuple('Entity', 'tag attrib tags element')
+
+
+class Audit():
+    """
+        An audit for AuditEngine.  Subclasses override visit() and /
+        or, with wants_paths, visit_path(), and result().
+    """
+    wants_entities = True
+    wants_paths = False
+
+    def visit(self, entity):
+        """
+            See a node / way / relation; return True when
+            no more are needed
+        """
+        return False
+
+    def visit_path(self, path, element):
+        """
+            See an XML element as it opens (its attributes are in,
+            its children are not); path is only valid during the call
+        """
+
+    def result(self):
+        return None
+
+
+class TagPathCounts(Audit):
+    """
+        {tag path ('osm/node/tag'): elements}, in the order
+        the paths first appear
+    """
+    wants_entities = False
+    wants_paths = True
+
+    def __init__(self):
+        self.counts = {}
+
+    def visit_path(self, path, element):
+        tag_path = "/".join(path)
+        self.counts[tag_path] = self.counts.get(tag_path, 0) + 1
+
+    def result(self):
+        return self.counts
+
+
+class ElementCounts(Audit):
+    """
+        {XML tag: elements}, whatever their parent
+    """
+    wants_entities = False
+    wants_paths = True
+
+    def __init__(self):
+        self.counts = collections.Counter()
+
+    def visit_path(self, path, element):
+        self.counts[path[-1]] += 1
+
+    def result(self):
+        return self.counts
+
+
+class AttributeSamples(Audit):
+    """
+        {XML tag: {attribute: (elements with it, {value: elements})}},
+        the values in the order they first appear
+    """
+    wants_entities = False
+    wants_paths = True
+
+    def __init__(self, tags=None):
+        """
+            tags: the XML tags to describe (default: all of them)
+        """
+        self._tags = None if tags is None else set(tags)
+        self.attributes = collections.defaultdict(dict)
+
+    def visit_path(self, path, element):
+        if self._tags is not None and element.tag not in self._tags:
+            return
+        attributes = self.attributes[element.tag]
+        for key, value in element.attrib.items():
+            count, values = attributes.get(key, (0, {}))
+            values[value] = values.get(value, 0) + 1
+            attributes[key] = (count + 1, values)
+
+    def result(self):
+        return dict(self.attributes)
+
+
+class ChildTagCounts(Audit):
+    """
+        {parent XML tag: {child XML tag: elements}}
+    """
+    wants_entities = False
+    wants_paths = True
+
+    def __init__(self):
+        self.counts = collections.defaultdict(collections.Counter)
+
+    def visit_path(self, path, element):
+        if len(path) > 1:
+            self.counts[path[-2]][path[-1]] += 1
+
+    def result(self):
+        return dict(self.counts)
+
+
+class TagKeyAudit(Audit):
+    """
+        The "k" attributes of the tags of parent_tag (node, way or
+        relation) elements, with the set of values of each, in 4
+        buckets:
+
+        1. all lowercase and valid
+        2. all lowercase with a ':' in the middle, and valid
+        3. ones with bad characters
+        4. others (none of the above)
+    """
+    ALL_LOWER = re.compile(r'^([_a-z])*$')
+    LOWER_COLON = re.compile(r'^([_a-z])*:([_a-z])*$')
+    PROBLEMCHARS = re.compile(r'[^_a-z]')
+
+    def __init__(self, parent_tag):
+        self.parent_tag = parent_tag
+        self.lowercase_tags = {}
+        self.lowercase_colon_tags = {}
+        self.bad_char_tags = {}
+        self.other_tags = {}
+
+    def visit(self, entity):
+        if entity.tag != self.parent_tag:
+            return False
+        for k_val, v_val in entity.tags:
+            if self.ALL_LOWER.match(k_val):
+                bucket = self.lowercase_tags
+            elif self.LOWER_COLON.match(k_val):
+                bucket = self.lowercase_colon_tags
+            elif self.PROBLEMCHARS.match(k_val):
+                bucket = self.bad_char_tags
+            else:
+                bucket = self.other_tags
+            bucket.setdefault(k_val, set()).add(v_val)
+        return False
+
+    def result(self):
+        return (self.lowercase_tags, self.lowercase_colon_tags, self.bad_char_tags,
+                self.other_tags)
+
+
+class TagValueCounts(Audit):
+    """
+        {value: elements} of the tag_key tags (e.g. addr:street)
+    """
+
+    def __init__(self, tag_key):
+        self.tag_key = tag_key
+        self.counts = {}
+
+    def visit(self, entity):
+        for k_val, v_val in entity.tags:
+            if k_val == self.tag_key:
+                self.counts[v_val] = self.counts.get(v_val, 0) + 1
+        return False
+
+    def result(self):
+        return self.counts
+
+
+class ExampleEntities(Audit):
+    """
+        Up to max_results (element tag, {key: set of values}) examples
+        of the elements with a tag_key tag (equal to tag_value, when
+        given).  With attributes=True the element's attributes are
+        in the examples too, as "attribute: <name>" keys.
+    """
+
+    def __init__(self, tag_key, max_results=None, tag_value=None, attributes=False):
+        self.tag_key = tag_key
+        self.tag_value = tag_value
+        self.max_results = max_results
+        self.attributes = attributes
+        self.examples = []
+
+    def visit(self, entity):
+        found_an_example = False
+        for k_val, v_val in entity.tags:
+            if k_val == self.tag_key and (self.tag_value is None or v_val == self.tag_value):
+                found_an_example = True
+                break
+        if not found_an_example:
+            return False
+
+        example_dict = {}
+        if self.attributes:
+            for key, value in entity.attrib.items():
+                example_dict.setdefault("attribute: {}".format(key), set()).add(value)
+        for k_val, v_val in entity.tags:
+            example_dict.setdefault(k_val, set()).add(v_val)
+        self.examples.append((entity.tag, example_dict))
+        return bool(self.max_results) and len(self.examples) >= self.max_results
+
+    def result(self):
+        return self.examples
+
+
+class AuditResults(dict):
+    """
+        {audit name: result} of an AuditEngine pass, plus the
+        entities visited and the seconds the pass took
+    """
+
+    def __init__(self, results, entities, seconds):
+        super().__init__(results)
+        self.entities = entities
+        self.seconds = seconds
+
+
+class AuditEngine():
+    """
+        Runs the registered audits in one pass over an OSM file
+    """
+
+    def __init__(self):
+        self._audits = collections.OrderedDict()
+
+    def register(self, name, audit):
+        """
+            Add audit under name; returns the audit
+        """
+        if name in self._audits:
+            raise ValueError("An audit named '{}' is already registered".format(name))
+        self._audits[name] = audit
+        return audit
+
+    def run(self, osm_file):
+        """
+            Parse osm_file (a path or an open binary file) once,
+            visiting every registered audit; returns AuditResults
+        """
+        start = time.perf_counter()
+        path_audits = [audit for audit in self._audits.values() if audit.wants_paths]
+        active = [audit for audit in self._audits.values() if audit.wants_entities]
+        entities = 0
+
+        context = ET.iterparse(osm_file, events=('start', 'end'))
+        _, root = next(context)
+        path = [root.tag]
+        for audit in path_audits:
+            audit.visit_path(path, root)
+        for event, elem in context:
+            if event == 'start':
+                if path_audits:
+                    path.append(elem.tag)
+                    for audit in path_audits:
+                        audit.visit_path(path, elem)
+                continue
+            if path_audits:
+                path.pop()
+            if elem.tag not in ENTITY_TAGS:
+                continue
+
+            entities += 1
+            if active:
+                entity = Entity(elem.tag, elem.attrib,
+                                [(tag.attrib['k'], tag.attrib['v']) for tag in elem.iter('tag')],
+                                elem)
+                finished = [audit for audit in active if audit.visit(entity)]
+                if finished:
+                    active = [audit for audit in active if audit not in finished]
+                    if not active and not path_audits:
+                        break
+            root.clear()
+
+        results = [(name, audit.result()) for name, audit in self._audits.items()]
+        return AuditResults(results, entities, time.perf_counter() - start)
+
+
+def run_audits(osm_file, audits):
+    """
+        Run audits ({name: audit}) together in one pass
+        over osm_file; returns AuditResults
+    """
+    engine = AuditEngine()
+    for name, audit in audits.items():
+        engine.register(name, audit)
+    return engine.run(osm_file)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 2:
+        print("usage: python osm_audit.py map.osm")
+        sys.exit(1)
+    results = run_audits(sys.argv[1], collections.OrderedDict([
+        ('tag_paths', TagPathCounts()),
+        ('node_keys', TagKeyAudit('node')),
+        ('way_keys', TagKeyAudit('way')),
+        ('streets', TagValueCounts('addr:street')),
+    ]))
+    for tag_path, count in results['tag_paths'].items():
+        print("{0: <20} {1: >10}".format(tag_path, count))
+    for name in ('node_keys', 'way_keys'):
+        lowercase, lowercase_colon, bad_chars, other = results[name]
+        print("{}: {} lowercase, {} lowercase with a colon, {} with bad characters, "
+              "{} other keys".format(name, len(lowercase), len(lowercase_colon),
+                                     len(bad_chars), len(other)))
+        if bad_chars:
+            pprint.pprint(sorted(bad_chars))
+    print("{} distinct streets".format(len(results['streets'])))
+    print("audited {} elements in one pass of {:.2f}s".format(results.entities, results.seconds))
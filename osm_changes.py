@@ -0,0 +1,178 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+    Apply an OSM change file (.osc) to the SQLite database
+
+    Instead of regenerating the csv files and reloading every table,
+    an osmChange diff is streamed through the same shape_element /
+    fix_street_name logic as data.py and applied in place:
+
+        <create>, <modify>   upsert the node / way / relation and replace
+                             its tags (and way nodes / relation members)
+        <delete>             remove the node / way / relation and its
+                             child rows
+
+    Everything is applied in one transaction, in document order.
+    The R-tree of create_spatial_index.sql, if the database has one,
+    is updated node by node in the same transaction; the summary
+    tables of create_summaries.sql are rebuilt afterwards.
+
+    usage: python osm_changes.py changes.osc database_sqlite/new_orleans.db
+"""
+import collections
+import os
+import sqlite3
+import sys
+import time
+
+import xml.etree.ElementTree as ET
+
+import data
+import spatial_index
+
+INDEXES_SQL = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                           'database_sqlite', 'create_indexes.sql')
+SUMMARIES_SQL = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             'database_sqlite', 'create_summaries.sql')
+
+ACTIONS = ('create', 'modify', 'delete')
+
+UPSERT_NODE = """
+    insert or replace into node (node_id, node_lat, node_lon, node_user, node_uid,
+                                 node_version, node_changeset, node_timestamp)
+    values (?, ?, ?, ?, ?, ?, ?, ?)"""
+INSERT_NODE_TAG = "insert into node_tag (node_id, tag_key, tag_value, tag_type) values (?, ?, ?, ?)"
+DELETE_NODE_TAGS = "delete from node_tag where node_id = ?"
+DELETE_NODE = "delete from node where node_id = ?"
+
+UPSERT_WAY = """
+    insert or replace into way (way_id, way_user, way_uid, way_version,
+                                way_changeset, way_timestamp)
+    values (?, ?, ?, ?, ?, ?)"""
+INSERT_WAY_NODE = "insert into way_node (way_id, node_id, position) values (?, ?, ?)"
+INSERT_WAY_TAG = "insert into way_tag (way_id, tag_key, tag_value, tag_type) values (?, ?, ?, ?)"
+DELETE_WAY_NODES = "delete from way_node where way_id = ?"
+DELETE_WAY_TAGS = "delete from way_tag where way_id = ?"
+DELETE_WAY = "delete from way where way_id = ?"
+
+UPSERT_RELATION = """
+    insert or replace into relation (relation_id, relation_user, relation_uid, relation_version,
+                                     relation_changeset, relation_timestamp)
+    values (?, ?, ?, ?, ?, ?)"""
+INSERT_RELATION_MEMBER = """
+    insert into relation_member (relation_id, member_id, member_type, role, position)
+    values (?, ?, ?, ?, ?)"""
+INSERT_RELATION_TAG = """
+    insert into relation_tag (relation_id, tag_key, tag_value, tag_type) values (?, ?, ?, ?)"""
+DELETE_RELATION_MEMBERS = "delete from relation_member where relation_id = ?"
+DELETE_RELATION_TAGS = "delete from relation_tag where relation_id = ?"
+DELETE_RELATION = "delete from relation where relation_id = ?"
+
+
+def iter_changes(osc_file):
+    """
+        Yield (action, element) for each node / way / relation in an osmChange file
+    """
+    action = None
+    context = ET.iterparse(osc_file, events=('start', 'end'))
+    _, root = next(context)
+    for event, elem in context:
+        if event == 'start':
+            if elem.tag in ACTIONS:
+                action = elem
+            continue
+
+        if elem.tag in data.ELEMENT_TAGS and action is not None:
+            yield action.tag, elem
+            # drop each element once applied so memory stays flat
+            action.remove(elem)
+        elif elem.tag in ACTIONS:
+            action = None
+            root.clear()
+
+
+def apply_change(cursor, action, element, spatial=False):
+    """
+        Apply one changed element; with spatial, update
+        the R-tree entry of a changed node too
+    """
+    element_id = element.attrib.get('id')
+
+    if element.tag == 'node':
+        cursor.execute(DELETE_NODE_TAGS, (element_id,))
+        if action == 'delete':
+            cursor.execute(DELETE_NODE, (element_id,))
+        else:
+            el = data.shape_element_rows(element)
+            cursor.execute(UPSERT_NODE, el['node'])
+            cursor.executemany(INSERT_NODE_TAG, el['node_tags'])
+        if spatial:
+            spatial_index.refresh_node(cursor, element_id)
+
+    elif element.tag == 'way':
+        cursor.execute(DELETE_WAY_NODES, (element_id,))
+        cursor.execute(DELETE_WAY_TAGS, (element_id,))
+        if action == 'delete':
+            cursor.execute(DELETE_WAY, (element_id,))
+        else:
+            el = data.shape_element_rows(element)
+            cursor.execute(UPSERT_WAY, el['way'])
+            cursor.executemany(INSERT_WAY_NODE, el['way_nodes'])
+            cursor.executemany(INSERT_WAY_TAG, el['way_tags'])
+
+    elif element.tag == 'relation':
+        cursor.execute(DELETE_RELATION_MEMBERS, (element_id,))
+        cursor.execute(DELETE_RELATION_TAGS, (element_id,))
+        if action == 'delete':
+            cursor.execute(DELETE_RELATION, (element_id,))
+        else:
+            el = data.shape_element_rows(element)
+            cursor.execute(UPSERT_RELATION, el['relation'])
+            cursor.executemany(INSERT_RELATION_MEMBER, el['relation_members'])
+            cursor.executemany(INSERT_RELATION_TAG, el['relation_tags'])
+
+
+def apply_changes(osc_file, database_path):
+    """
+        Apply every change in osc_file to the database in a
+        single transaction.  Returns counts by (type, action).
+    """
+    connection = sqlite3.connect(database_path, isolation_level=None)
+    counts = collections.Counter()
+    try:
+        # lookups by node / way id need these; a no-op once they exist
+        with open(INDEXES_SQL) as handle:
+            connection.executescript(handle.read())
+
+        spatial = spatial_index.has_spatial_index(connection)
+        cursor = connection.cursor()
+        cursor.execute("begin")
+        try:
+            for action, element in iter_changes(osc_file):
+                apply_change(cursor, action, element, spatial)
+                counts[(element.tag, action)] += 1
+            cursor.execute("commit")
+        except Exception:
+            cursor.execute("rollback")
+            raise
+
+        # rebuild the summary tables, where the database has them
+        if cursor.execute("select count(*) from sqlite_master "
+                          "where type = 'table' and name = 'summary_user'").fetchone()[0]:
+            with open(SUMMARIES_SQL) as handle:
+                connection.executescript(handle.read())
+    finally:
+        connection.close()
+    return counts
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 3:
+        print("usage: python osm_changes.py changes.osc database.db")
+        sys.exit(1)
+
+    start = time.perf_counter()
+    counts = apply_changes(sys.argv[1], sys.argv[2])
+    for (element_type, action), count in sorted(counts.items()):
+        print("{0: <6} {1: <8} {2: >10}".format(element_type, action, count))
+    print("applied {} changes in {:.2f}s".format(sum(counts.values()), time.perf_counter() - start))
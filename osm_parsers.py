@@ -0,0 +1,256 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+    Parser backends that turn an OSM XML file into the shaped
+    records produced by data.shape_element
+
+    etree   ElementTree iterparse + shape_element (the original path)
+    expat   expat callbacks that build the shaped records directly,
+            without an intermediate Element tree
+    pbf     .osm.pbf input, decoded on a pool of workers (osm_pbf.py)
+
+    Every backend yields the same dictionaries, so the writers
+    downstream do not care which one was used.
+"""
+import time
+import xml.parsers.expat
+
+import data
+
+READ_SIZE = 64 * 1024
+
+
+def _open_input(osm_file):
+    """
+        Return (handle, should_close) for a path or file-like object
+    """
+    if hasattr(osm_file, 'read'):
+        return osm_file, False
+    return open(osm_file, 'rb'), True
+
+
+def iter_etree(osm_file, tags=data.ELEMENT_TAGS, rows=False, stage_seconds=None):
+    """
+        Shape the elements produced by data.get_element
+
+        stage_seconds: a dict of stage timers (see ingest_metrics.py)
+        to add the time spent shaping to
+    """
+    shape = data.shape_element_rows if rows else data.shape_element
+    if stage_seconds is None:
+        for element in data.get_element(osm_file, tags=tags):
+            el = shape(element)
+            if el:
+                yield el
+        return
+
+    clock = time.perf_counter
+    for element in data.get_element(osm_file, tags=tags):
+        start = clock()
+        el = shape(element)
+        seconds = clock() - start
+        # the consumer times all of next() as parse
+        stage_seconds['shape'] += seconds
+        stage_seconds['parse'] -= seconds
+        if el:
+            yield el
+
+
+def _node_dict(attrs):
+    return {field: attrs.get(field) for field in data.NODE_FIELDS}
+
+
+def _way_dict(attrs):
+    return {field: attrs.get(field) for field in data.WAY_FIELDS}
+
+
+def _node_row(attrs):
+    return tuple(map(attrs.get, data.NODE_FIELDS))
+
+
+def _way_row(attrs):
+    return tuple(map(attrs.get, data.WAY_FIELDS))
+
+
+def _relation_dict(attrs):
+    return {field: attrs.get(field) for field in data.RELATION_FIELDS}
+
+
+def _relation_row(attrs):
+    return tuple(map(attrs.get, data.RELATION_FIELDS))
+
+
+def _way_node_dict(element_id, ref, position):
+    return {'id': element_id, 'node_id': ref, 'position': position}
+
+
+def _way_node_row(element_id, ref, position):
+    return (element_id, ref, position)
+
+
+def _member_dict(element_id, attrs, position):
+    return {'id': element_id, 'member_id': attrs.get('ref'), 'member_type': attrs.get('type'),
+            'role': attrs.get('role'), 'position': position}
+
+
+def _member_row(element_id, attrs, position):
+    return (element_id, attrs.get('ref'), attrs.get('type'), attrs.get('role'), position)
+
+
+class _ExpatShaper():
+    """
+        expat callbacks that shape top level <node>, <way> and
+        <relation> elements as they are parsed
+
+        rows=True builds tuples (see data.shape_element_rows)
+        instead of dicts
+    """
+
+    def __init__(self, tags, rows=False, parser=None, base_offset=None):
+        self.records = []
+        # with a base_offset, records are (input byte offset, record) pairs
+        self._parser = parser
+        self._base_offset = base_offset
+        self._tags = set(tags) & set(data.ELEMENT_TAGS)
+        self._depth = 0
+        self._offset = None
+        self._current = None
+        self._element_id = None
+        self._element_tags = None
+        self._way_nodes = None
+        self._members = None
+
+        if rows:
+            self._shape_node, self._shape_way = _node_row, _way_row
+            self._shape_tag, self._shape_way_node = data.shape_tag_row, _way_node_row
+            self._shape_relation, self._shape_member = _relation_row, _member_row
+        else:
+            self._shape_node, self._shape_way = _node_dict, _way_dict
+            self._shape_tag, self._shape_way_node = data.shape_tag, _way_node_dict
+            self._shape_relation, self._shape_member = _relation_dict, _member_dict
+
+    def start_element(self, name, attrs):
+        self._depth += 1
+        if self._depth == 2:
+            if name not in self._tags:
+                return
+            self._element_id = attrs.get('id')
+            self._element_tags = []
+            if self._base_offset is not None:
+                self._offset = self._base_offset + self._parser.CurrentByteIndex
+            if name == 'node':
+                self._current = {'node': self._shape_node(attrs),
+                                 'node_tags': self._element_tags}
+            elif name == 'way':
+                self._way_nodes = []
+                self._current = {'way': self._shape_way(attrs),
+                                 'way_nodes': self._way_nodes,
+                                 'way_tags': self._element_tags}
+            else:
+                self._members = []
+                self._current = {'relation': self._shape_relation(attrs),
+                                 'relation_members': self._members,
+                                 'relation_tags': self._element_tags}
+
+        elif self._depth == 3 and self._current is not None:
+            if name == 'tag':
+                self._element_tags.append(self._shape_tag(self._element_id, attrs['k'], attrs['v']))
+            elif name == 'nd' and self._way_nodes is not None:
+                self._way_nodes.append(self._shape_way_node(self._element_id,
+                                                            attrs.get('ref'),
+                                                            len(self._way_nodes)))
+            elif name == 'member' and self._members is not None:
+                self._members.append(self._shape_member(self._element_id, attrs,
+                                                        len(self._members)))
+
+    def end_element(self, name):
+        if self._depth == 2 and self._current is not None:
+            if self._base_offset is not None:
+                self.records.append((self._offset, self._current))
+            else:
+                self.records.append(self._current)
+            self._current = None
+            self._way_nodes = None
+            self._members = None
+        self._depth -= 1
+
+
+def iter_expat(osm_file, tags=data.ELEMENT_TAGS, rows=False, base_offset=None):
+    """
+        Stream osm_file through expat and yield shaped records
+
+        With a base_offset, yield (offset, record) pairs instead, offset
+        being base_offset plus the position of the element's start tag
+        in osm_file (see checkpoint.py)
+    """
+    parser = xml.parsers.expat.ParserCreate()
+    shaper = _ExpatShaper(tags, rows, parser, base_offset)
+    parser.StartElementHandler = shaper.start_element
+    parser.EndElementHandler = shaper.end_element
+
+    handle, should_close = _open_input(osm_file)
+    try:
+        while True:
+            chunk = handle.read(READ_SIZE)
+            parser.Parse(chunk, not chunk)
+            if shaper.records:
+                for record in shaper.records:
+                    yield record
+                shaper.records = []
+            if not chunk:
+                break
+    finally:
+        if should_close:
+            handle.close()
+
+
+def iter_pbf(osm_file, tags=data.ELEMENT_TAGS, rows=False, workers=1):
+    """
+        Decode a .osm.pbf file and yield shaped records
+    """
+    # numpy is only needed for pbf input
+    import osm_pbf
+    return osm_pbf.iter_pbf(osm_file, tags=tags, rows=rows, workers=workers)
+
+
+PARSER_BACKENDS = {
+    'etree': iter_etree,
+    'expat': iter_expat,
+    'pbf': iter_pbf,
+}
+
+
+def is_pbf(osm_file):
+    """
+        True when osm_file is a .osm.pbf file: a path, or a file
+        object opened from one (e.g. an ingest_metrics.CountingReader)
+    """
+    name = getattr(osm_file, 'name', osm_file)
+    return isinstance(name, str) and name.lower().endswith('.pbf')
+
+
+def iter_shaped_elements(osm_file, tags=data.ELEMENT_TAGS, backend='expat', workers=1, rows=False,
+                         stage_seconds=None):
+    """
+        Yield shaped node / way / relation records from osm_file
+        using the named parser backend
+
+        rows=True yields tuple records (see data.shape_element_rows)
+
+        stage_seconds: stage timers the etree backend adds its shape
+        time to (the others shape while they parse)
+
+        .osm.pbf files always use the pbf backend, decoding
+        blobs on workers processes
+    """
+    if is_pbf(osm_file):
+        return iter_pbf(osm_file, tags=tags, rows=rows, workers=workers)
+
+    try:
+        parse = PARSER_BACKENDS[backend]
+    except KeyError:
+        raise ValueError("Unknown parser backend '{}', expected one of: {}".format(
+            backend, ", ".join(sorted(PARSER_BACKENDS))))
+    if stage_seconds is not None and backend == 'etree':
+        return iter_etree(osm_file, tags=tags, rows=rows, stage_seconds=stage_seconds)
+    return parse(osm_file, tags=tags, rows=rows)
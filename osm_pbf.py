@@ -0,0 +1,527 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+    Reader for .osm.pbf files
+
+    A PBF file is a sequence of blobs, each holding a zlib
+    compressed PrimitiveBlock of nodes, ways and relations.
+    The blobs are independent, so they are decompressed and
+    decoded on a pool of worker processes while the main
+    process reads the file and writes the results, in order.
+
+    The protobuf messages are decoded by hand (the format only
+    needs varints and length delimited fields).  Dense nodes -
+    which are most of any extract - are decoded with numpy:
+    the packed varints, zigzag and delta coding, coordinate
+    scaling and timestamps are all done on whole arrays.
+
+    Decoded elements come out as "raw" tuples:
+
+        ('node', attrs, tags, None)
+        ('way', attrs, tags, refs)
+        ('relation', attrs, tags, members)
+
+    where attrs holds the same string attribute values the XML
+    would, tags is a list of (k, v) and members a list of
+    (type, ref, role).  shape_raw_element turns them into the
+    records produced by data.shape_element.
+"""
+import collections
+import lzma
+import multiprocessing
+import struct
+import zlib
+
+import numpy as np
+
+import data
+
+MEMBER_TYPES = ('node', 'way', 'relation')
+
+BLOBS_IN_FLIGHT_PER_WORKER = 2
+
+# wire types
+VARINT = 0
+FIXED64 = 1
+LENGTH_DELIMITED = 2
+FIXED32 = 5
+
+
+# ================================================== #
+#               Protobuf wire format                 #
+# ================================================== #
+def _read_varint(buf, pos):
+    result = 0
+    shift = 0
+    while True:
+        byte = buf[pos]
+        pos += 1
+        result |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return result, pos
+        shift += 7
+
+
+def _zigzag(value):
+    return (value >> 1) ^ -(value & 1)
+
+
+def _signed64(value):
+    """
+        int32 / int64 fields encode negatives as 64 bit two's complement
+    """
+    return value - (1 << 64) if value >= (1 << 63) else value
+
+
+def _iter_fields(buf):
+    """
+        Yield (field_number, wire_type, value) for a message,
+        value being an int or a memoryview of the payload
+    """
+    buf = memoryview(buf)
+    pos = 0
+    end = len(buf)
+    while pos < end:
+        key, pos = _read_varint(buf, pos)
+        field, wire_type = key >> 3, key & 0x7
+        if wire_type == VARINT:
+            value, pos = _read_varint(buf, pos)
+        elif wire_type == LENGTH_DELIMITED:
+            size, pos = _read_varint(buf, pos)
+            value = buf[pos:pos + size]
+            pos += size
+        elif wire_type == FIXED64:
+            value = buf[pos:pos + 8]
+            pos += 8
+        elif wire_type == FIXED32:
+            value = buf[pos:pos + 4]
+            pos += 4
+        else:
+            raise ValueError("Unsupported protobuf wire type {}".format(wire_type))
+        yield field, wire_type, value
+
+
+def _packed_varints(buf):
+    """
+        Decode a packed repeated varint field to a python list
+    """
+    values = []
+    pos = 0
+    end = len(buf)
+    while pos < end:
+        value, pos = _read_varint(buf, pos)
+        values.append(value)
+    return values
+
+
+def _packed_varints_array(buf):
+    """
+        Vectorized decode of a packed repeated varint field
+        to a numpy uint64 array
+    """
+    raw = np.frombuffer(buf, dtype=np.uint8)
+    if not len(raw):
+        return np.zeros(0, dtype=np.uint64)
+
+    # the last byte of each varint has the high bit clear
+    is_last = raw < 0x80
+    last = np.flatnonzero(is_last)
+    starts = np.empty_like(last)
+    starts[0] = 0
+    starts[1:] = last[:-1] + 1
+
+    # which varint each byte belongs to, and its position in it
+    owner = np.cumsum(is_last) - is_last
+    position = np.arange(len(raw)) - starts[owner]
+
+    parts = (raw & 0x7f).astype(np.uint64) << (position * 7).astype(np.uint64)
+    # the 7 bit groups never overlap so adding is the same as or-ing
+    return np.add.reduceat(parts, starts)
+
+
+def _unzigzag_array(values):
+    return (values >> np.uint64(1)).astype(np.int64) ^ -(values & np.uint64(1)).astype(np.int64)
+
+
+# ================================================== #
+#               Blob reading                         #
+# ================================================== #
+def iter_blobs(pbf_file):
+    """
+        Yield (blob_type, blob_bytes) for every blob in pbf_file,
+        a path or an open binary file
+    """
+    if hasattr(pbf_file, 'read'):
+        handle, should_close = pbf_file, False
+    else:
+        handle, should_close = open(pbf_file, 'rb'), True
+    try:
+        while True:
+            size_bytes = handle.read(4)
+            if not size_bytes:
+                return
+            header_size, = struct.unpack('>I', size_bytes)
+
+            blob_type = None
+            blob_size = 0
+            for field, _, value in _iter_fields(handle.read(header_size)):
+                if field == 1:
+                    blob_type = bytes(value).decode('utf-8')
+                elif field == 3:
+                    blob_size = value
+
+            yield blob_type, handle.read(blob_size)
+    finally:
+        if should_close:
+            handle.close()
+
+
+def decompress_blob(blob):
+    """
+        Return the uncompressed payload of a Blob message
+    """
+    for field, _, value in _iter_fields(blob):
+        if field == 1:
+            return bytes(value)
+        elif field == 3:
+            return zlib.decompress(value)
+        elif field == 4:
+            return lzma.decompress(value)
+        elif field in (5, 6, 7):
+            raise ValueError("Unsupported PBF blob compression (field {})".format(field))
+    return b''
+
+
+# ================================================== #
+#               PrimitiveBlock decoding              #
+# ================================================== #
+class _Block():
+    """
+        The per-block settings every element needs to decode
+    """
+
+    def __init__(self):
+        self.strings = []
+        self.granularity = 100
+        self.lat_offset = 0
+        self.lon_offset = 0
+        self.date_granularity = 1000
+
+    def coordinate(self, offset, value):
+        return "{:.7f}".format((offset + self.granularity * value) / 1e9)
+
+    def timestamp(self, value):
+        seconds = value * self.date_granularity // 1000
+        return str(np.datetime64(seconds, 's')) + 'Z'
+
+
+def _decode_info(info_buf, block, attrs):
+    for field, _, value in _iter_fields(info_buf):
+        if field == 1:
+            attrs['version'] = str(value)
+        elif field == 2:
+            attrs['timestamp'] = block.timestamp(_signed64(value))
+        elif field == 3:
+            attrs['changeset'] = str(_signed64(value))
+        elif field == 4:
+            attrs['uid'] = str(_signed64(value))
+        elif field == 5:
+            attrs['user'] = block.strings[value]
+
+
+def _decode_tags(keys, vals, block):
+    strings = block.strings
+    return [(strings[k], strings[v]) for k, v in zip(keys, vals)]
+
+
+def _decode_node(buf, block):
+    attrs = {}
+    keys = vals = ()
+    lat = lon = 0
+    for field, _, value in _iter_fields(buf):
+        if field == 1:
+            attrs['id'] = str(_zigzag(value))
+        elif field == 2:
+            keys = _packed_varints(value)
+        elif field == 3:
+            vals = _packed_varints(value)
+        elif field == 4:
+            _decode_info(value, block, attrs)
+        elif field == 8:
+            lat = _zigzag(value)
+        elif field == 9:
+            lon = _zigzag(value)
+    attrs['lat'] = block.coordinate(block.lat_offset, lat)
+    attrs['lon'] = block.coordinate(block.lon_offset, lon)
+    return ('node', attrs, _decode_tags(keys, vals, block), None)
+
+
+def _decode_dense(buf, block):
+    """
+        Decode a DenseNodes message, vectorized with numpy
+    """
+    ids = lats = lons = keys_vals = None
+    info = {}
+    for field, _, value in _iter_fields(buf):
+        if field == 1:
+            ids = np.cumsum(_unzigzag_array(_packed_varints_array(value)))
+        elif field == 5:
+            for info_field, _, info_value in _iter_fields(value):
+                info[info_field] = _packed_varints_array(info_value)
+        elif field == 8:
+            lats = np.cumsum(_unzigzag_array(_packed_varints_array(value)))
+        elif field == 9:
+            lons = np.cumsum(_unzigzag_array(_packed_varints_array(value)))
+        elif field == 10:
+            keys_vals = _packed_varints_array(value).astype(np.int64)
+
+    if ids is None:
+        return []
+    count = len(ids)
+
+    lat_strings = np.char.mod('%.7f', (block.lat_offset + block.granularity * lats) / 1e9).tolist()
+    lon_strings = np.char.mod('%.7f', (block.lon_offset + block.granularity * lons) / 1e9).tolist()
+    id_strings = ids.astype(str).tolist()
+
+    columns = []
+    if 1 in info:
+        columns.append(('version', info[1].astype(np.int64).astype(str).tolist()))
+    if 2 in info:
+        seconds = np.cumsum(_unzigzag_array(info[2])) * block.date_granularity // 1000
+        stamps = np.datetime_as_string(seconds.astype('datetime64[s]'), unit='s')
+        columns.append(('timestamp', np.char.add(stamps, 'Z').tolist()))
+    if 3 in info:
+        columns.append(('changeset', np.cumsum(_unzigzag_array(info[3])).astype(str).tolist()))
+    if 4 in info:
+        columns.append(('uid', np.cumsum(_unzigzag_array(info[4])).astype(str).tolist()))
+    if 5 in info:
+        strings = block.strings
+        columns.append(('user', [strings[sid] for sid in np.cumsum(_unzigzag_array(info[5])).tolist()]))
+
+    # keys_vals is k, v, k, v, ..., 0 for each node in turn
+    tags = [[] for _ in range(count)]
+    if keys_vals is not None and len(keys_vals):
+        terminators = np.flatnonzero(keys_vals == 0)
+        begins = np.concatenate(([0], terminators[:-1] + 1))
+        strings = block.strings
+        flat = keys_vals.tolist()
+        for index in np.flatnonzero(terminators != begins).tolist():
+            pairs = flat[begins[index]:terminators[index]]
+            tags[index] = [(strings[k], strings[v]) for k, v in zip(pairs[0::2], pairs[1::2])]
+
+    elements = []
+    for i in range(count):
+        attrs = {'id': id_strings[i], 'lat': lat_strings[i], 'lon': lon_strings[i]}
+        for name, values in columns:
+            attrs[name] = values[i]
+        elements.append(('node', attrs, tags[i], None))
+    return elements
+
+
+def _decode_way(buf, block):
+    attrs = {}
+    keys = vals = refs = ()
+    for field, _, value in _iter_fields(buf):
+        if field == 1:
+            attrs['id'] = str(_signed64(value))
+        elif field == 2:
+            keys = _packed_varints(value)
+        elif field == 3:
+            vals = _packed_varints(value)
+        elif field == 4:
+            _decode_info(value, block, attrs)
+        elif field == 8:
+            refs = _packed_varints(value)
+
+    node_refs = []
+    ref = 0
+    for delta in refs:
+        ref += _zigzag(delta)
+        node_refs.append(str(ref))
+    return ('way', attrs, _decode_tags(keys, vals, block), node_refs)
+
+
+def _decode_relation(buf, block):
+    attrs = {}
+    keys = vals = roles = memids = types = ()
+    for field, _, value in _iter_fields(buf):
+        if field == 1:
+            attrs['id'] = str(_signed64(value))
+        elif field == 2:
+            keys = _packed_varints(value)
+        elif field == 3:
+            vals = _packed_varints(value)
+        elif field == 4:
+            _decode_info(value, block, attrs)
+        elif field == 8:
+            roles = _packed_varints(value)
+        elif field == 9:
+            memids = _packed_varints(value)
+        elif field == 10:
+            types = _packed_varints(value)
+
+    members = []
+    ref = 0
+    for member_type, delta, role in zip(types, memids, roles):
+        ref += _zigzag(delta)
+        members.append((MEMBER_TYPES[member_type], str(ref), block.strings[role]))
+    return ('relation', attrs, _decode_tags(keys, vals, block), members)
+
+
+def decode_primitive_block(payload, tags=('node', 'way', 'relation')):
+    """
+        Decode an uncompressed PrimitiveBlock into raw element tuples
+    """
+    block = _Block()
+    groups = []
+    for field, _, value in _iter_fields(payload):
+        if field == 1:
+            block.strings = [bytes(s).decode('utf-8') for f, _, s in _iter_fields(value) if f == 1]
+        elif field == 2:
+            groups.append(value)
+        elif field == 17:
+            block.granularity = value
+        elif field == 18:
+            block.date_granularity = value
+        elif field == 19:
+            block.lat_offset = _signed64(value)
+        elif field == 20:
+            block.lon_offset = _signed64(value)
+
+    elements = []
+    for group in groups:
+        for field, _, value in _iter_fields(group):
+            if field == 1 and 'node' in tags:
+                elements.append(_decode_node(value, block))
+            elif field == 2 and 'node' in tags:
+                elements.extend(_decode_dense(value, block))
+            elif field == 3 and 'way' in tags:
+                elements.append(_decode_way(value, block))
+            elif field == 4 and 'relation' in tags:
+                elements.append(_decode_relation(value, block))
+    return elements
+
+
+# ================================================== #
+#               Shaping                              #
+# ================================================== #
+def shape_raw_element(raw):
+    """
+        Shape a raw element tuple the same way data.shape_element
+        shapes the equivalent XML element
+    """
+    element_type, attrs, tags, refs = raw
+    element_id = attrs.get('id')
+    shaped_tags = [data.shape_tag(element_id, k, v) for k, v in tags]
+
+    if element_type == 'node':
+        return {'node': {field: attrs.get(field) for field in data.NODE_FIELDS},
+                'node_tags': shaped_tags}
+    elif element_type == 'way':
+        way_nodes = [{'id': element_id, 'node_id': ref, 'position': position}
+                     for position, ref in enumerate(refs)]
+        return {'way': {field: attrs.get(field) for field in data.WAY_FIELDS},
+                'way_nodes': way_nodes,
+                'way_tags': shaped_tags}
+    elif element_type == 'relation':
+        members = [{'id': element_id, 'member_id': ref, 'member_type': member_type,
+                    'role': role, 'position': position}
+                   for position, (member_type, ref, role) in enumerate(refs)]
+        return {'relation': {field: attrs.get(field) for field in data.RELATION_FIELDS},
+                'relation_members': members,
+                'relation_tags': shaped_tags}
+    return None
+
+
+def shape_raw_element_rows(raw):
+    """
+        Like shape_raw_element, but with tuple records
+        (see data.shape_element_rows)
+    """
+    element_type, attrs, tags, refs = raw
+    element_id = attrs.get('id')
+    shaped_tags = [data.shape_tag_row(element_id, k, v) for k, v in tags]
+
+    if element_type == 'node':
+        return {'node': tuple(map(attrs.get, data.NODE_FIELDS)), 'node_tags': shaped_tags}
+    elif element_type == 'way':
+        way_nodes = [(element_id, ref, position) for position, ref in enumerate(refs)]
+        return {'way': tuple(map(attrs.get, data.WAY_FIELDS)),
+                'way_nodes': way_nodes,
+                'way_tags': shaped_tags}
+    elif element_type == 'relation':
+        members = [(element_id, ref, member_type, role, position)
+                   for position, (member_type, ref, role) in enumerate(refs)]
+        return {'relation': tuple(map(attrs.get, data.RELATION_FIELDS)),
+                'relation_members': members,
+                'relation_tags': shaped_tags}
+    return None
+
+
+def _decode_blob_raw(args):
+    blob, tags = args
+    return decode_primitive_block(decompress_blob(blob), tags)
+
+
+def _decode_blob_shaped(args):
+    shaped = []
+    for raw in _decode_blob_raw(args):
+        el = shape_raw_element(raw)
+        if el:
+            shaped.append(el)
+    return shaped
+
+
+def _decode_blob_rows(args):
+    shaped = []
+    for raw in _decode_blob_raw(args):
+        el = shape_raw_element_rows(raw)
+        if el:
+            shaped.append(el)
+    return shaped
+
+
+def _iter_decoded(pbf_file, tags, workers, decode):
+    """
+        Run decode over every OSMData blob, on a process pool
+        when workers > 1, yielding the results in file order
+    """
+    jobs = ((blob, tags) for blob_type, blob in iter_blobs(pbf_file) if blob_type == 'OSMData')
+
+    if workers <= 1:
+        for job in jobs:
+            for item in decode(job):
+                yield item
+        return
+
+    # keep a bounded number of blobs in flight so memory stays flat
+    pool = multiprocessing.Pool(workers)
+    try:
+        pending = collections.deque()
+        for job in jobs:
+            pending.append(pool.apply_async(decode, (job,)))
+            if len(pending) >= workers * BLOBS_IN_FLIGHT_PER_WORKER:
+                for item in pending.popleft().get():
+                    yield item
+        while pending:
+            for item in pending.popleft().get():
+                yield item
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def iter_pbf_elements(pbf_file, tags=('node', 'way', 'relation'), workers=1):
+    """
+        Yield raw element tuples from pbf_file
+    """
+    return _iter_decoded(pbf_file, tuple(tags), workers, _decode_blob_raw)
+
+
+def iter_pbf(pbf_file, tags=data.ELEMENT_TAGS, rows=False, workers=1):
+    """
+        Yield shaped node / way records from pbf_file
+        (tuple records when rows is True)
+    """
+    decode = _decode_blob_rows if rows else _decode_blob_shaped
+    return _iter_decoded(pbf_file, tuple(tags), workers, decode)
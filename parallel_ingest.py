@@ -0,0 +1,235 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+    Multi-process sharded version of data.process_map
+
+    The input file is split into byte ranges whose boundaries
+    are aligned on the start of a top level <node>, <way> or
+    <relation> element.  Each shard is wrapped in an <osm> root
+    so it parses as a document of its own, shaped in a worker
+    process, and written to its own set of csv files.
+
+    When every shard is finished the per-shard csv files are
+    concatenated in shard order, so the merged output is the
+    same as a serial run.
+"""
+import multiprocessing
+import os
+import re
+import shutil
+import tempfile
+
+# start of any top level element we can split on
+ELEMENT_START_RE = re.compile(br'<(node|way|relation)[\s/>]')
+OSM_END = b'</osm>'
+
+SCAN_SIZE = 1024 * 1024
+SHARDS_PER_WORKER = 4
+
+
+def _find_element_start(handle, offset, limit):
+    """
+        Return the offset of the first top level element
+        that starts at or after offset (or limit if there is none)
+    """
+    handle.seek(offset)
+    position = offset
+    carry = b''
+    while position < limit:
+        block = handle.read(SCAN_SIZE)
+        if not block:
+            break
+        # carry the tail of the last block so a tag straddling blocks is found
+        chunk = carry + block
+        match = ELEMENT_START_RE.search(chunk)
+        if match:
+            return min(position - len(carry) + match.start(), limit)
+        position += len(block)
+        carry = chunk[-16:]
+    return limit
+
+
+def _find_document_end(handle, file_size):
+    """
+        Return the offset of the closing </osm> tag
+    """
+    tail_size = min(file_size, SCAN_SIZE)
+    handle.seek(file_size - tail_size)
+    tail = handle.read(tail_size)
+    end = tail.rfind(OSM_END)
+    if end < 0:
+        return file_size
+    return file_size - tail_size + end
+
+
+def find_shard_boundaries(file_in, num_shards):
+    """
+        Split file_in into at most num_shards (start, end) byte
+        ranges, each starting on a top level element
+    """
+    file_size = os.path.getsize(file_in)
+    with open(file_in, 'rb') as handle:
+        first = _find_element_start(handle, 0, file_size)
+        last = _find_document_end(handle, file_size)
+
+        starts = [first]
+        span = last - first
+        for i in range(1, num_shards):
+            target = first + (span * i) // num_shards
+            start = _find_element_start(handle, target, last)
+            if starts[-1] < start < last:
+                starts.append(start)
+
+    ends = starts[1:] + [last]
+    return list(zip(starts, ends))
+
+
+class ByteRangeReader():
+    """
+        File-like object that reads the byte range [start, end)
+        of a file, optionally wrapped with prefix and suffix bytes
+    """
+
+    def __init__(self, file_in, start, end, prefix=b'', suffix=b''):
+        self._handle = open(file_in, 'rb')
+        self._handle.seek(start)
+        self._remaining = end - start
+        self._prefix = prefix
+        self._suffix = suffix
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = self._remaining + len(self._prefix) + len(self._suffix)
+
+        data = b''
+        if self._prefix:
+            data = self._prefix[:size]
+            self._prefix = self._prefix[size:]
+            size -= len(data)
+
+        if size > 0 and self._remaining > 0:
+            chunk = self._handle.read(min(size, self._remaining))
+            self._remaining -= len(chunk)
+            if not chunk:
+                self._remaining = 0
+            data += chunk
+            size -= len(chunk)
+
+        if size > 0 and self._remaining == 0 and self._suffix:
+            data += self._suffix[:size]
+            self._suffix = self._suffix[size:]
+
+        return data
+
+    def close(self):
+        self._handle.close()
+
+
+def _process_shard(args):
+    """
+        Worker: shape one byte range into its own csv files
+    """
+    # imported here so the worker processes pick them up after fork/spawn
+    import data
+    from osm_parsers import iter_shaped_elements
+
+    (file_in, start, end, shard_directory, validate, backend, validator,
+     on_invalid, max_error_rate, compression, output_format) = args
+
+    os.makedirs(shard_directory)
+    # one compression thread per shard: the shards already run in parallel
+    writer = data.make_writer(shard_directory, output_format, compression, compress_workers=1)
+    # the shards only count rejects: a cluster of bad elements would put a
+    # shard over budget where the whole run is not.  The totals are checked
+    # once the shards are merged.
+    rejects = data.make_reject_sink(validate, on_invalid, shard_directory, max_error_rate,
+                                    enforce=False)
+
+    reader = ByteRangeReader(file_in, start, end, prefix=b'<osm>', suffix=b'</osm>')
+    try:
+        if validate is True:
+            data.ingest_elements(iter_shaped_elements(reader, tags=data.ELEMENT_TAGS, backend=backend),
+                                 writer,
+                                 validate,
+                                 validator,
+                                 rejects)
+        else:
+            data.ingest_rows(iter_shaped_elements(reader, tags=data.ELEMENT_TAGS, backend=backend,
+                                                  rows=True),
+                             writer)
+    finally:
+        reader.close()
+        writer.close()
+        if rejects is not None:
+            rejects.close()
+
+    if rejects is None:
+        return shard_directory, writer.filenames, None
+    return shard_directory, writer.filenames + rejects.filenames, rejects.summary()
+
+
+def merge_shards(shard_results, output_directory):
+    """
+        Concatenate per-shard files, in shard order,
+        into output_directory (parquet / arrow tables
+        a row group at a time)
+    """
+    from columnar_writer import is_columnar, merge_files
+
+    filenames = []
+    for _, shard_filenames, _ in shard_results:
+        filenames.extend(name for name in shard_filenames if name not in filenames)
+
+    for filename in filenames:
+        output_path = os.path.join(output_directory, filename)
+        if is_columnar(filename):
+            merge_files([os.path.join(shard_directory, filename)
+                         for shard_directory, shard_filenames, _ in shard_results
+                         if filename in shard_filenames],
+                        output_path)
+            continue
+        with open(output_path, 'wb') as output:
+            for shard_directory, shard_filenames, _ in shard_results:
+                if filename not in shard_filenames:
+                    continue
+                with open(os.path.join(shard_directory, filename), 'rb') as shard:
+                    shutil.copyfileobj(shard, output, SCAN_SIZE)
+
+
+def process_map_parallel(file_in, validate, workers=None, output_directory='generated_data',
+                         backend='expat', validator='compiled',
+                         on_invalid='raise', max_error_rate=0.01, compression=None,
+                         output_format='csv'):
+    """
+        Shard file_in, process the shards on a pool of
+        worker processes and merge the results
+    """
+    import data
+
+    workers = workers or os.cpu_count() or 1
+    boundaries = find_shard_boundaries(file_in, workers * SHARDS_PER_WORKER)
+
+    scratch = tempfile.mkdtemp(prefix='shards_', dir=output_directory)
+    try:
+        jobs = [(file_in, start, end, os.path.join(scratch, 'shard_{:05d}'.format(i)),
+                 validate, backend, validator, on_invalid, max_error_rate, compression, output_format)
+                for i, (start, end) in enumerate(boundaries)]
+
+        pool = multiprocessing.Pool(workers)
+        try:
+            # imap keeps the results in shard order
+            shard_results = list(pool.imap(_process_shard, jobs))
+        finally:
+            pool.close()
+            pool.join()
+
+        merge_shards(shard_results, output_directory)
+
+        rejects = data.make_reject_sink(validate, on_invalid, output_directory, max_error_rate)
+        if rejects is not None:
+            for _, _, summary in shard_results:
+                rejects.merge(summary)
+            print(rejects.write_summary())
+            rejects.check_budget(final=True)
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
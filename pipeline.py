@@ -0,0 +1,460 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+    A staged pipeline with bounded queues between the stages
+
+        parse -> [queue] -> shape -> [queue] -> validate -> [queue] -> write
+
+    Items travel between stages in numbered batches.  Each stage runs
+    on its own threads; a stage with kind='process' hands its batches
+    to a process pool so CPU heavy work runs outside the GIL.  Queues
+    are bounded, so a slow stage blocks the ones in front of it
+    (backpressure) and memory stays flat.  The sink puts batches back
+    in order, so the output matches a serial run.
+
+    Each stage reports its throughput, busy time and queue depth, so
+    the bottleneck is easy to spot: it is the stage whose input queue
+    is full while its output queue is empty.
+
+    With several workers batches finish out of order.  The source may
+    only run max_ahead batches ahead of the last one written, so one
+    slow batch cannot let the batches behind it pile up at the sink.
+"""
+import concurrent.futures
+import heapq
+import queue
+import threading
+import time
+
+_DONE = object()
+
+# how often blocked threads wake up to check for an abort
+POLL_INTERVAL = 0.1
+
+
+class Stage():
+    """
+        One step of the pipeline
+
+        function takes a list of items and returns a list of items.
+        It must be a module level function when kind is 'process'.
+    """
+
+    def __init__(self, name, function, workers=1, kind='thread'):
+        if kind not in ('thread', 'process'):
+            raise ValueError("Stage kind must be 'thread' or 'process', not '{}'".format(kind))
+        self.name = name
+        self.function = function
+        self.workers = workers
+        self.kind = kind
+        self.input_queue = None
+        self.stats = StageStats(name)
+
+
+class StageStats():
+    """
+        Counters for one stage (or the source / sink)
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.items = 0
+        self.batches = 0
+        self.busy_seconds = 0.0
+        self.max_queue_depth = 0
+        self._lock = threading.Lock()
+
+    def record(self, items, seconds):
+        with self._lock:
+            self.items += items
+            self.batches += 1
+            self.busy_seconds += seconds
+
+    def sample_queue(self, depth):
+        if depth > self.max_queue_depth:
+            self.max_queue_depth = depth
+
+    def as_dict(self, elapsed, workers=1, queue_depth=None, queue_size=None):
+        return {
+            'stage': self.name,
+            'items': self.items,
+            'batches': self.batches,
+            'items_per_second': self.items / elapsed if elapsed else 0.0,
+            'busy_seconds': round(self.busy_seconds, 3),
+            # share of the stage's worker time spent working rather than waiting
+            'utilization': self.busy_seconds / (elapsed * workers) if elapsed else 0.0,
+            'queue_depth': queue_depth,
+            'max_queue_depth': self.max_queue_depth,
+            'queue_size': queue_size,
+        }
+
+
+class Pipeline():
+
+    def __init__(self, source, stages, sink, queue_size=8, batch_size=1000,
+                 report_interval=None, report=print, max_ahead=None):
+        """
+            source: iterable of items (run on its own thread as the 'parse' step)
+            stages: list of Stage
+            sink: called with each item, in source order, on the caller's thread
+            queue_size: maximum number of batches waiting in front of each stage
+            batch_size: items per batch
+            report_interval: seconds between progress reports (None for no reports)
+            max_ahead: most batches read but not yet written (default:
+                what the queues and the stage workers hold)
+        """
+        self._source = source
+        self._stages = stages
+        self._sink = sink
+        self._queue_size = queue_size
+        self._batch_size = batch_size
+        self._report_interval = report_interval
+        self._report = report
+        if max_ahead is None:
+            max_ahead = (queue_size * (len(stages) + 1)
+                         + sum(stage.workers for stage in stages))
+        if max_ahead < 1:
+            raise ValueError("max_ahead must be at least 1, not {}".format(max_ahead))
+        # a slot per batch between the source and the sink
+        self._ahead = threading.Semaphore(max_ahead)
+
+        self._abort = threading.Event()
+        self._error = None
+        self._source_stats = StageStats('parse')
+        self._sink_stats = StageStats('write')
+        self._sink_queue = queue.Queue(queue_size)
+        self._started = None
+        self._executors = []
+
+    # ================================================== #
+    #               Queue helpers                        #
+    # ================================================== #
+    def _put(self, target, item):
+        """
+            Blocking put that gives up when the pipeline aborts
+        """
+        while not self._abort.is_set():
+            try:
+                target.put(item, timeout=POLL_INTERVAL)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _get(self, source):
+        while not self._abort.is_set():
+            try:
+                return source.get(timeout=POLL_INTERVAL)
+            except queue.Empty:
+                continue
+        return _DONE
+
+    def _acquire(self, semaphore):
+        """
+            Blocking acquire that gives up when the pipeline aborts
+        """
+        while not self._abort.is_set():
+            if semaphore.acquire(timeout=POLL_INTERVAL):
+                return True
+        return False
+
+    def _fail(self, error):
+        if self._error is None:
+            self._error = error
+        self._abort.set()
+
+    # ================================================== #
+    #               Threads                              #
+    # ================================================== #
+    def _run_source(self, first_queue, downstream_workers):
+        try:
+            sequence = 0
+            batch = []
+            start = time.perf_counter()
+            for item in self._source:
+                batch.append(item)
+                if len(batch) >= self._batch_size:
+                    self._source_stats.record(len(batch), time.perf_counter() - start)
+                    if not self._acquire(self._ahead) or not self._put(first_queue, (sequence, batch)):
+                        return
+                    sequence += 1
+                    batch = []
+                    start = time.perf_counter()
+            if batch:
+                self._source_stats.record(len(batch), time.perf_counter() - start)
+                if self._acquire(self._ahead):
+                    self._put(first_queue, (sequence, batch))
+        except Exception as error:
+            self._fail(error)
+        finally:
+            for _ in range(downstream_workers):
+                self._put(first_queue, _DONE)
+
+    def _run_stage(self, stage, executor, output_queue, finished):
+        """
+            Worker thread for stage.  The last worker to finish
+            tells every worker of the next stage to stop.
+        """
+        try:
+            while True:
+                item = self._get(stage.input_queue)
+                if item is _DONE:
+                    return
+                sequence, batch = item
+                stage.stats.sample_queue(stage.input_queue.qsize())
+
+                start = time.perf_counter()
+                if executor is None:
+                    result = stage.function(batch)
+                else:
+                    result = executor.submit(stage.function, batch).result()
+                stage.stats.record(len(batch), time.perf_counter() - start)
+
+                if not self._put(output_queue, (sequence, result)):
+                    return
+        except Exception as error:
+            self._fail(error)
+        finally:
+            finished(output_queue)
+
+    def _finisher(self, workers, downstream_workers):
+        """
+            Returns a callback that posts downstream_workers stop
+            markers once all workers of a stage have finished
+        """
+        lock = threading.Lock()
+        remaining = [workers]
+
+        def finished(output_queue):
+            with lock:
+                remaining[0] -= 1
+                last = remaining[0] == 0
+            if last:
+                for _ in range(downstream_workers):
+                    self._put(output_queue, _DONE)
+        return finished
+
+    def _run_reporter(self):
+        while not self._abort.wait(self._report_interval):
+            self._report(self.format_stats())
+
+    # ================================================== #
+    #               Public                               #
+    # ================================================== #
+    def stats(self):
+        """
+            Per-stage throughput and queue depth, as a list of dicts
+        """
+        elapsed = time.perf_counter() - self._started if self._started else 0.0
+        stats = [self._source_stats.as_dict(elapsed)]
+        for stage in self._stages:
+            stats.append(stage.stats.as_dict(elapsed, stage.workers,
+                                             stage.input_queue.qsize(), self._queue_size))
+        stats.append(self._sink_stats.as_dict(elapsed, 1, self._sink_queue.qsize(), self._queue_size))
+        return stats
+
+    def format_stats(self):
+        lines = []
+        for stage in self.stats():
+            queue_text = ""
+            if stage['queue_size']:
+                queue_text = "queue {0: >3}/{1} (max {2})".format(
+                    stage['queue_depth'], stage['queue_size'], stage['max_queue_depth'])
+            lines.append("{0: <10} {1: >10} items {2: >10.0f}/s  busy {3: >8.2f}s {4: >4.0%}  {5}".format(
+                stage['stage'], stage['items'], stage['items_per_second'],
+                stage['busy_seconds'], stage['utilization'], queue_text))
+        return "\n".join(lines)
+
+    def run(self):
+        """
+            Run the pipeline to completion and return the stats
+        """
+        self._started = time.perf_counter()
+
+        # wire up the queues: each stage reads from its own input queue
+        for stage in self._stages:
+            stage.input_queue = queue.Queue(self._queue_size)
+        queues = [stage.input_queue for stage in self._stages] + [self._sink_queue]
+        workers = [stage.workers for stage in self._stages] + [1]
+
+        threads = [threading.Thread(target=self._run_source, args=(queues[0], workers[0]),
+                                    name='pipeline-parse', daemon=True)]
+        for index, stage in enumerate(self._stages):
+            executor = None
+            if stage.kind == 'process':
+                executor = concurrent.futures.ProcessPoolExecutor(stage.workers)
+                self._executors.append(executor)
+            finished = self._finisher(stage.workers, workers[index + 1])
+            for number in range(stage.workers):
+                threads.append(threading.Thread(
+                    target=self._run_stage,
+                    args=(stage, executor, queues[index + 1], finished),
+                    name='pipeline-{}-{}'.format(stage.name, number),
+                    daemon=True))
+
+        if self._report_interval:
+            threading.Thread(target=self._run_reporter, name='pipeline-report', daemon=True).start()
+
+        for thread in threads:
+            thread.start()
+
+        try:
+            self._drain_sink()
+        except Exception as error:
+            self._fail(error)
+        finally:
+            self._abort.set()
+            for thread in threads:
+                thread.join()
+            for executor in self._executors:
+                executor.shutdown()
+
+        if self._error is not None:
+            raise self._error
+        return self.stats()
+
+    def _drain_sink(self):
+        """
+            Feed results to the sink in sequence order.  waiting holds
+            at most max_ahead batches: the source needs a slot for
+            each, and a slot comes back as its batch is written.
+        """
+        waiting = []
+        next_sequence = 0
+        while True:
+            item = self._get(self._sink_queue)
+            if item is _DONE:
+                break
+            self._sink_stats.sample_queue(self._sink_queue.qsize())
+            heapq.heappush(waiting, item)
+            while waiting and waiting[0][0] == next_sequence:
+                _, batch = heapq.heappop(waiting)
+                start = time.perf_counter()
+                for result in batch:
+                    self._sink(result)
+                self._sink_stats.record(len(batch), time.perf_counter() - start)
+                next_sequence += 1
+                self._ahead.release()
+        if self._abort.is_set() and self._error is not None:
+            raise self._error
+
+
+# ================================================== #
+#               process_map on the pipeline          #
+# ================================================== #
+def shape_batch(elements):
+    """
+        shape stage: XML elements to shaped dict records
+    """
+    import data
+    shaped = []
+    for element in elements:
+        el = data.shape_element(element)
+        if el:
+            shaped.append(el)
+    return shaped
+
+
+def shape_rows_batch(elements):
+    """
+        shape stage: XML elements to tuple records
+    """
+    import data
+    shaped = []
+    for element in elements:
+        el = data.shape_element_rows(element)
+        if el:
+            shaped.append(el)
+    return shaped
+
+
+_validators = {}
+
+
+def validate_batch(records, validator_name='compiled'):
+    """
+        validate stage: pair each record with its errors
+        (None when it is valid)
+    """
+    import data
+    # one validator per thread / process, they keep state between calls
+    key = (threading.get_ident(), validator_name)
+    validator = _validators.get(key)
+    if validator is None:
+        validator = _validators[key] = data.make_validator(validator_name)
+
+    results = []
+    for record in records:
+        if validator.validate(record, data.SCHEMA) is True:
+            results.append((record, None))
+        else:
+            results.append((record, validator.errors))
+    return results
+
+
+def validate_cerberus_batch(records):
+    return validate_batch(records, 'cerberus')
+
+
+def process_map_pipeline(file_in, validate, output_directory='generated_data',
+                         validator='compiled', on_invalid='raise', max_error_rate=0.01,
+                         shape_workers=1, validate_workers=1, kind='thread',
+                         queue_size=8, batch_size=1000, report_interval=10.0, compression=None,
+                         output_format='csv'):
+    """
+        data.process_map as a staged pipeline:
+        parse (ElementTree iterparse) -> shape -> validate -> write
+
+        shape_workers / validate_workers: workers per stage
+        kind: 'thread' or 'process' pools for the shape and validate stages
+        report_interval: seconds between stage reports (None for none)
+        compression: 'gzip' or 'zstd' for compressed csv files
+        output_format: 'csv', 'parquet' or 'arrow' (see columnar_writer.py)
+
+        Returns the final per-stage stats.
+    """
+    import data
+
+    writer = data.make_writer(output_directory, output_format, compression)
+    rejects = data.make_reject_sink(validate, on_invalid, output_directory, max_error_rate)
+
+    if validate is True:
+        stages = [Stage('shape', shape_batch, shape_workers, kind),
+                  Stage('validate',
+                        validate_cerberus_batch if validator == 'cerberus' else validate_batch,
+                        validate_workers, kind)]
+
+        def sink(result):
+            el, errors = result
+            if rejects is not None:
+                rejects.num_checked += 1
+            if errors is not None:
+                if rejects is None:
+                    data.raise_validation_error(errors)
+                rejects.reject(el, errors)
+                return
+            data.write_element(el, writer)
+    else:
+        stages = [Stage('shape', shape_rows_batch, shape_workers, kind)]
+
+        def sink(el):
+            data.write_element_rows(el, writer)
+
+    pipeline = Pipeline(data.get_element(file_in, tags=data.ELEMENT_TAGS),
+                        stages,
+                        sink,
+                        queue_size=queue_size,
+                        batch_size=batch_size,
+                        report_interval=report_interval)
+    try:
+        stats = pipeline.run()
+    finally:
+        writer.close()
+        if rejects is not None:
+            rejects.close()
+            print(rejects.write_summary())
+    if rejects is not None:
+        rejects.check_budget(final=True)
+
+    print(pipeline.format_stats())
+    return stats
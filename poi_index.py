@@ -0,0 +1,489 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+    An in-memory grid index of the named points of interest, for
+    nearest, radius and box queries answered a batch at a time
+
+    The points are the nodes MapParser._parse_node_tags
+    (database_mysql/parsemap.py) loads into map_node: nodes with a
+    name (or name:en), with their amenity, shop, cuisine and
+    denomination.
+
+    The points are sorted into a grid of cells sized to hold about
+    POINTS_PER_CELL points each.  cell_starts holds the first point
+    of every cell, so the cells of one grid row, from one column to
+    another, are one slice of the arrays.  A query measures the
+    points of a block of cells around it, and grows the block until
+    k of them lie closer than any point outside the block can be.
+    The queries of a batch are measured together with numpy.
+
+    Tag values are kept as codes into a vocabulary per field.  A
+    filter picks out the matching points and grids just those, the
+    first time it is used, so a rare amenity costs no more to
+    search than a common one.
+
+    The index is saved like node_locations.py: meta.json next to
+    raw arrays, memory-mapped when it is opened.  Extracts that
+    cross the antimeridian are not handled.
+
+        index = build_poi_index('maps/new_orleans_city.osm', 'generated_data/poi_index')
+        index = PoiIndex('generated_data/poi_index')
+        rows, metres = index.nearest(lats, lons, k=5, amenity='restaurant')
+        index.ids[rows], index.values('name', rows)
+
+    usage: python poi_index.py map.osm generated_data/poi_index
+"""
+import json
+import os
+import sys
+
+import numpy as np
+
+import data
+
+META_FILENAME = "meta.json"
+IDS_FILENAME = "ids.bin"
+COORDS_FILENAME = "coords.bin"
+CELL_STARTS_FILENAME = "cell_starts.bin"
+
+# the tags kept for each point, as MapParser._parse_node_tags keeps them
+FIELDS = ('name', 'amenity', 'shop', 'cuisine', 'denomination')
+# 1e-7 degrees, as node_locations.py
+SCALE = 10000000
+EARTH_RADIUS = 6371008.8
+METRES_PER_DEGREE = EARTH_RADIUS * np.pi / 180
+
+# mean points per grid cell
+POINTS_PER_CELL = 8
+# the grid never has more cells than this
+MAX_CELLS = 4 * 1024 * 1024
+# queries measured together; bounds the memory of a batch
+QUERY_CHUNK = 4096
+
+
+def haversine(lats1, lons1, lats2, lons2):
+    """
+        Great circle distances in metres between
+        arrays of points given in degrees
+    """
+    lats1, lons1, lats2, lons2 = (np.radians(values) for values in (lats1, lons1, lats2, lons2))
+    a = (np.sin((lats2 - lats1) / 2) ** 2
+         + np.cos(lats1) * np.cos(lats2) * np.sin((lons2 - lons1) / 2) ** 2)
+    return 2 * EARTH_RADIUS * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+def _layout(lats, lons, points_per_cell=POINTS_PER_CELL):
+    """
+        (order, grid, cell_starts): order sorts the points by grid
+        cell, grid holds the cell geometry and cell_starts[c] is the
+        first of the sorted points in cell c
+    """
+    count = len(lats)
+    if not count:
+        grid = {'min_lat': 0.0, 'min_lon': 0.0, 'cell_lat': 1.0, 'cell_lon': 1.0,
+                'rows': 1, 'cols': 1}
+        return np.empty(0, np.int64), grid, np.zeros(2, np.int64)
+
+    min_lat, max_lat = float(lats.min()), float(lats.max())
+    min_lon, max_lon = float(lons.min()), float(lons.max())
+    cos_mid = np.cos(np.radians((min_lat + max_lat) / 2))
+    height = max(max_lat - min_lat, 1e-6) * METRES_PER_DEGREE
+    width = max(max_lon - min_lon, 1e-6) * METRES_PER_DEGREE * cos_mid
+    cell = np.sqrt(height * width * points_per_cell / count)
+    while True:
+        cell_lat = cell / METRES_PER_DEGREE
+        cell_lon = cell_lat / cos_mid
+        rows = int((max_lat - min_lat) / cell_lat) + 1
+        cols = int((max_lon - min_lon) / cell_lon) + 1
+        if rows * cols <= MAX_CELLS:
+            break
+        cell *= 2
+
+    grid = {'min_lat': min_lat, 'min_lon': min_lon, 'cell_lat': cell_lat, 'cell_lon': cell_lon,
+            'rows': rows, 'cols': cols}
+    cells = (np.minimum(((lats - min_lat) / cell_lat).astype(np.int64), rows - 1) * cols
+             + np.minimum(((lons - min_lon) / cell_lon).astype(np.int64), cols - 1))
+    order = np.argsort(cells, kind='stable')
+    cell_starts = np.searchsorted(cells[order], np.arange(rows * cols + 1)).astype(np.int64)
+    return order, grid, cell_starts
+
+
+class _Grid():
+    """
+        Points in grid cell order: lats, lons and their
+        rows in the PoiIndex (points)
+    """
+
+    def __init__(self, lats, lons, points, grid, cell_starts):
+        self.lats = lats
+        self.lons = lons
+        self.points = points
+        self.cell_starts = cell_starts
+        self.min_lat = grid['min_lat']
+        self.min_lon = grid['min_lon']
+        self.cell_lat = grid['cell_lat']
+        self.cell_lon = grid['cell_lon']
+        self.rows = grid['rows']
+        self.cols = grid['cols']
+
+    def __len__(self):
+        return len(self.lats)
+
+    def cell_of(self, lats, lons):
+        """
+            (row, col) of the cells holding lats, lons;
+            points outside the grid get the nearest cell
+        """
+        rows = np.clip(np.floor((lats - self.min_lat) / self.cell_lat), 0, self.rows - 1)
+        cols = np.clip(np.floor((lons - self.min_lon) / self.cell_lon), 0, self.cols - 1)
+        return rows.astype(np.int64), cols.astype(np.int64)
+
+    def block(self, rows, cols, reach_rows, reach_cols):
+        """
+            (first row, last row, first col, last col) of the blocks
+            reaching reach cells each way from rows, cols
+        """
+        return (np.maximum(rows - reach_rows, 0), np.minimum(rows + reach_rows, self.rows - 1),
+                np.maximum(cols - reach_cols, 0), np.minimum(cols + reach_cols, self.cols - 1))
+
+    def candidates(self, row0, row1, col0, col1):
+        """
+            (query, point) pairs of every point in the blocks;
+            query indexes the block arrays
+        """
+        row_counts = row1 - row0 + 1
+        query_of_row = np.repeat(np.arange(len(row0)), row_counts)
+        row_offsets = np.cumsum(row_counts) - row_counts
+        grid_rows = row0[query_of_row] + np.arange(len(query_of_row)) - row_offsets[query_of_row]
+        starts = self.cell_starts[grid_rows * self.cols + col0[query_of_row]]
+        ends = self.cell_starts[grid_rows * self.cols + col1[query_of_row] + 1]
+        lengths = ends - starts
+        queries = np.repeat(query_of_row, lengths)
+        offsets = np.cumsum(lengths) - lengths
+        points = np.repeat(starts - offsets, lengths) + np.arange(lengths.sum())
+        return queries, points
+
+    def covered(self, lats, lons, row0, row1, col0, col1):
+        """
+            Metres from each query to the nearest edge of its block:
+            no point outside the block is closer.  Edges on the
+            border of the grid have nothing beyond them.
+        """
+        south = self.min_lat + row0 * self.cell_lat
+        north = self.min_lat + (row1 + 1) * self.cell_lat
+        west = self.min_lon + col0 * self.cell_lon
+        east = self.min_lon + (col1 + 1) * self.cell_lon
+        cos_lats = np.cos(np.radians(lats))
+
+        def across_meridian(delta_lon):
+            # the distance to a meridian delta_lon degrees away
+            delta_lon = np.radians(np.clip(delta_lon, 0, 90))
+            return EARTH_RADIUS * np.arcsin(np.clip(cos_lats * np.sin(delta_lon), 0, 1))
+
+        distances = [np.where(row0 == 0, np.inf, (lats - south) * METRES_PER_DEGREE),
+                     np.where(row1 == self.rows - 1, np.inf, (north - lats) * METRES_PER_DEGREE),
+                     np.where(col0 == 0, np.inf, across_meridian(lons - west)),
+                     np.where(col1 == self.cols - 1, np.inf, across_meridian(east - lons))]
+        return np.maximum(np.minimum.reduce(distances), 0)
+
+    def reach_for(self, lats, radius):
+        """
+            (rows, cols) of cells each way a block needs
+            to hold every point within radius metres
+        """
+        delta_lat = radius / METRES_PER_DEGREE
+        cos_lats = np.maximum(np.cos(np.radians(np.minimum(np.abs(lats) + delta_lat, 89.9))), 1e-9)
+        reach_rows = np.ceil(delta_lat / self.cell_lat) + 1
+        reach_cols = np.ceil(delta_lat / cos_lats / self.cell_lon) + 1
+        return (np.full(len(lats), min(reach_rows, self.rows), np.int64),
+                np.minimum(reach_cols, self.cols).astype(np.int64))
+
+
+class PoiIndex():
+    """
+        An index saved by PoiIndexBuilder, memory-mapped read only
+
+        ids, lats and lons are arrays over the points; the rows
+        the queries return index them
+    """
+
+    def __init__(self, path):
+        with open(os.path.join(path, META_FILENAME)) as handle:
+            self.meta = json.load(handle)
+        self.path = path
+        count = self.meta['count']
+        self._scale = float(self.meta['scale'])
+        self.vocabularies = self.meta['vocabularies']
+        if count:
+            self.ids = np.memmap(os.path.join(path, IDS_FILENAME), dtype=np.int64, mode='r')
+            coords = np.memmap(os.path.join(path, COORDS_FILENAME), dtype=np.int32, mode='r',
+                               shape=(count, 2))
+            self._codes = {field: np.memmap(os.path.join(path, field + '.bin'), dtype=np.int32,
+                                            mode='r')
+                           for field in FIELDS}
+            cell_starts = np.fromfile(os.path.join(path, CELL_STARTS_FILENAME), dtype=np.int64)
+        else:
+            self.ids = np.empty(0, np.int64)
+            coords = np.empty((0, 2), np.int32)
+            self._codes = {field: np.empty(0, np.int32) for field in FIELDS}
+            cell_starts = np.zeros(2, np.int64)
+        self.lats = coords[:, 0] / self._scale
+        self.lons = coords[:, 1] / self._scale
+        # the saved points are in grid cell order
+        self._grids = {(): _Grid(self.lats, self.lons, np.arange(count), self.meta['grid'],
+                                 cell_starts)}
+
+    def __len__(self):
+        return self.meta['count']
+
+    def values(self, field, rows):
+        """
+            The field ('name', 'amenity', ...) of the points
+            at rows, None where they have none
+        """
+        vocabulary = self.vocabularies[field]
+        codes = self._codes[field]
+        return [vocabulary[codes[row]] if row >= 0 and codes[row] >= 0 else None
+                for row in np.asarray(rows).ravel()]
+
+    def matching(self, **filters):
+        """
+            A mask of the points matching filters: field=value,
+            or field=[values] for any of them
+        """
+        mask = np.ones(len(self), dtype=bool)
+        for field, wanted in filters.items():
+            if field not in FIELDS:
+                raise ValueError("Cannot filter on '{}', expected one of: {}".format(
+                    field, ", ".join(FIELDS)))
+            if isinstance(wanted, str):
+                wanted = [wanted]
+            vocabulary = self.vocabularies[field]
+            codes = [vocabulary.index(value) for value in wanted if value in vocabulary]
+            mask &= np.isin(self._codes[field], codes)
+        return mask
+
+    def _grid(self, filters):
+        """
+            The grid of the points matching filters, made the
+            first time those filters are used
+        """
+        key = tuple(sorted((field, wanted if isinstance(wanted, str) else tuple(sorted(wanted)))
+                           for field, wanted in filters.items()))
+        if key not in self._grids:
+            points = np.flatnonzero(self.matching(**filters))
+            lats = self.lats[points]
+            lons = self.lons[points]
+            order, grid, cell_starts = _layout(lats, lons)
+            self._grids[key] = _Grid(lats[order], lons[order], points[order], grid, cell_starts)
+        return self._grids[key]
+
+    def nearest(self, lats, lons, k=10, **filters):
+        """
+            (rows, metres): the k points nearest each of the
+            query points, nearest first, as (queries, k) arrays.
+            Rows are -1 (and metres inf) past the last point.
+            filters are field=value or field=[values].
+        """
+        lats = np.atleast_1d(np.asarray(lats, dtype=np.float64))
+        lons = np.atleast_1d(np.asarray(lons, dtype=np.float64))
+        grid = self._grid(filters)
+        rows = np.full((len(lats), k), -1, dtype=np.int64)
+        metres = np.full((len(lats), k), np.inf)
+        if not len(grid) or k <= 0:
+            return rows, metres
+        # the block that holds about k points at the mean density
+        per_cell = len(grid) / float(grid.rows * grid.cols)
+        first_reach = int(np.ceil(np.sqrt(k / per_cell) / 2))
+        for start in range(0, len(lats), QUERY_CHUNK):
+            chunk = slice(start, start + QUERY_CHUNK)
+            self._nearest_chunk(grid, lats[chunk], lons[chunk], k, first_reach,
+                                rows[chunk], metres[chunk])
+        return rows, metres
+
+    def _nearest_chunk(self, grid, lats, lons, k, reach, rows, metres):
+        pending = np.arange(len(lats))
+        cell_rows, cell_cols = grid.cell_of(lats, lons)
+        reach = np.full(len(lats), reach, dtype=np.int64)
+        while len(pending):
+            row0, row1, col0, col1 = grid.block(cell_rows[pending], cell_cols[pending],
+                                                reach, reach)
+            queries, points = grid.candidates(row0, row1, col0, col1)
+            distances = haversine(lats[pending][queries], lons[pending][queries],
+                                  grid.lats[points], grid.lons[points])
+            order = np.lexsort((distances, queries))
+            queries, points, distances = queries[order], points[order], distances[order]
+            ranks = np.arange(len(queries)) - np.searchsorted(queries, queries)
+
+            covered = grid.covered(lats[pending], lons[pending], row0, row1, col0, col1)
+            inside = np.bincount(queries[distances <= covered[queries]], minlength=len(pending))
+            whole = (row0 == 0) & (row1 == grid.rows - 1) & (col0 == 0) & (col1 == grid.cols - 1)
+            done = (inside >= k) | whole
+
+            take = (ranks < k) & done[queries]
+            rows[pending[queries[take]], ranks[take]] = grid.points[points[take]]
+            metres[pending[queries[take]], ranks[take]] = distances[take]
+            pending = pending[~done]
+            reach = reach[~done] * 2
+
+    def within_radius(self, lats, lons, radius, **filters):
+        """
+            (offsets, rows, metres): the points within radius metres
+            of each query point, nearest first.  Those of query i
+            are rows[offsets[i]:offsets[i + 1]].
+        """
+        lats = np.atleast_1d(np.asarray(lats, dtype=np.float64))
+        lons = np.atleast_1d(np.asarray(lons, dtype=np.float64))
+        grid = self._grid(filters)
+        counts = np.zeros(len(lats), dtype=np.int64)
+        found_rows = []
+        found_metres = []
+        if len(grid):
+            for start in range(0, len(lats), QUERY_CHUNK):
+                chunk = slice(start, start + QUERY_CHUNK)
+                chunk_lats, chunk_lons = lats[chunk], lons[chunk]
+                cell_rows, cell_cols = grid.cell_of(chunk_lats, chunk_lons)
+                reach_rows, reach_cols = grid.reach_for(chunk_lats, radius)
+                queries, points = grid.candidates(*grid.block(cell_rows, cell_cols,
+                                                              reach_rows, reach_cols))
+                distances = haversine(chunk_lats[queries], chunk_lons[queries],
+                                      grid.lats[points], grid.lons[points])
+                near = distances <= radius
+                queries, points, distances = queries[near], points[near], distances[near]
+                order = np.lexsort((distances, queries))
+                counts[chunk] = np.bincount(queries, minlength=len(chunk_lats))
+                found_rows.append(grid.points[points[order]])
+                found_metres.append(distances[order])
+        offsets = np.zeros(len(lats) + 1, dtype=np.int64)
+        np.cumsum(counts, out=offsets[1:])
+        if not found_rows:
+            return offsets, np.empty(0, np.int64), np.empty(0)
+        return offsets, np.concatenate(found_rows), np.concatenate(found_metres)
+
+    def within_box(self, min_lat, min_lon, max_lat, max_lon, **filters):
+        """
+            The rows of the points inside the box, in no order
+        """
+        grid = self._grid(filters)
+        if not len(grid):
+            return np.empty(0, np.int64)
+        (row0,), (col0,) = grid.cell_of(np.array([min_lat]), np.array([min_lon]))
+        (row1,), (col1,) = grid.cell_of(np.array([max_lat]), np.array([max_lon]))
+        _, points = grid.candidates(np.array([row0]), np.array([row1]),
+                                    np.array([col0]), np.array([col1]))
+        inside = ((grid.lats[points] >= min_lat) & (grid.lats[points] <= max_lat)
+                  & (grid.lons[points] >= min_lon) & (grid.lons[points] <= max_lon))
+        return grid.points[points[inside]]
+
+
+class PoiIndexBuilder():
+    """
+        Collects points and saves them as an index
+    """
+
+    def __init__(self, path):
+        self._path = path
+        os.makedirs(path, exist_ok=True)
+        # an index being rebuilt must not be opened half way
+        if os.path.exists(os.path.join(path, META_FILENAME)):
+            os.remove(os.path.join(path, META_FILENAME))
+        self._ids = []
+        self._lats = []
+        self._lons = []
+        self._codes = {field: [] for field in FIELDS}
+        self._vocabularies = {field: {} for field in FIELDS}
+
+    def add_point(self, node_id, lat, lon, **values):
+        """
+            Add one point; lat / lon may be numbers or strings,
+            values are the FIELDS it has
+        """
+        self._ids.append(int(node_id))
+        self._lats.append(float(lat))
+        self._lons.append(float(lon))
+        for field in FIELDS:
+            value = values.get(field)
+            if value is None:
+                self._codes[field].append(-1)
+            else:
+                self._codes[field].append(self._vocabularies[field].setdefault(
+                    value, len(self._vocabularies[field])))
+
+    def close(self):
+        """
+            Save the index and return it opened
+        """
+        ids = np.array(self._ids, dtype=np.int64)
+        coords = np.empty((len(ids), 2), dtype=np.int32)
+        coords[:, 0] = np.rint(np.array(self._lats, dtype=np.float64) * SCALE)
+        coords[:, 1] = np.rint(np.array(self._lons, dtype=np.float64) * SCALE)
+        # grid the rounded positions, as they are read back
+        order, grid, cell_starts = _layout(coords[:, 0] / float(SCALE), coords[:, 1] / float(SCALE))
+
+        ids[order].tofile(os.path.join(self._path, IDS_FILENAME))
+        np.ascontiguousarray(coords[order]).tofile(os.path.join(self._path, COORDS_FILENAME))
+        cell_starts.tofile(os.path.join(self._path, CELL_STARTS_FILENAME))
+        vocabularies = {}
+        for field in FIELDS:
+            np.array(self._codes[field], dtype=np.int32)[order].tofile(
+                os.path.join(self._path, field + '.bin'))
+            vocabulary = self._vocabularies[field]
+            vocabularies[field] = sorted(vocabulary, key=vocabulary.get)
+
+        meta = {'count': len(ids), 'scale': SCALE, 'grid': grid, 'vocabularies': vocabularies}
+        with open(os.path.join(self._path, META_FILENAME), 'w') as handle:
+            json.dump(meta, handle)
+        return PoiIndex(self._path)
+
+
+def open_poi_index(path):
+    """
+        Open the index at path, or return None if there is none
+    """
+    if not os.path.exists(os.path.join(path, META_FILENAME)):
+        return None
+    return PoiIndex(path)
+
+
+def point_of_interest(node_row, tag_rows):
+    """
+        {field: value} of a shaped node with a name (or
+        name:en), None for any other node
+    """
+    values = {}
+    english_name = None
+    for _, key, value, tag_type in tag_rows:
+        if tag_type == 'regular' and key in FIELDS:
+            values.setdefault(key, value)
+        elif tag_type == 'name' and key == 'en':
+            english_name = value
+    values.setdefault('name', english_name)
+    if values['name'] is None or node_row[1] is None or node_row[2] is None:
+        return None
+    return values
+
+
+def build_poi_index(osm_file, path, backend=data.DEFAULT_BACKEND, workers=1):
+    """
+        Build an index of the named nodes of osm_file
+        (OSM XML or .osm.pbf) at path
+    """
+    from osm_parsers import iter_shaped_elements
+
+    builder = PoiIndexBuilder(path)
+    for el in iter_shaped_elements(osm_file, tags=('node',), backend=backend, workers=workers,
+                                   rows=True):
+        if not el['node_tags']:
+            continue
+        values = point_of_interest(el['node'], el['node_tags'])
+        if values is not None:
+            builder.add_point(el['node'][0], el['node'][1], el['node'][2], **values)
+    return builder.close()
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 3:
+        print("usage: python poi_index.py map.osm output_directory")
+        sys.exit(1)
+    index = build_poi_index(sys.argv[1], sys.argv[2])
+    print("{} points of interest in {}".format(len(index), sys.argv[2]))
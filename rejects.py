@@ -0,0 +1,180 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+    provides RejectSink, the dead-letter sink for records
+    that fail schema validation
+
+    Instead of raising on the first bad element, process_map can
+    hand failing elements to a RejectSink.  Each failing table
+    ('node', 'node_tags', 'way', ...) gets a <table>_rejects.jsonl
+    file with one line per rejected element:
+
+        {"id": "123", "reason": {...cerberus errors...}, "record": ...}
+
+    The whole element is rejected (none of its rows are written to
+    the csv files) so the output stays referentially consistent.
+
+    The ingest only aborts when the share of rejected elements goes
+    over the error-rate budget: during the run once min_checked
+    elements have been seen, and on the totals once it has finished
+    (check_budget(final=True)), so small runs are held to the budget
+    too.  The sinks of parallel shards do not enforce it (enforce=
+    False): their summaries are merged and the totals checked.
+"""
+import collections
+import json
+import os
+
+REJECTS_SUFFIX = "_rejects.jsonl"
+SUMMARY_FILENAME = "rejects_summary.json"
+
+
+class ErrorBudgetExceeded(Exception):
+    """
+        Raised when too many elements have been rejected
+    """
+
+
+def _error_fields(errors, prefix):
+    """
+        Flatten a cerberus error tree into dotted field names,
+        e.g. 'node.lat' or 'node_tags.key' (list indexes are dropped)
+    """
+    for field, messages in errors.items():
+        name = prefix if isinstance(field, int) else (
+            "{}.{}".format(prefix, field) if prefix else field)
+        for message in messages:
+            if isinstance(message, dict):
+                for nested in _error_fields(message, name):
+                    yield nested
+            else:
+                yield name
+
+
+class RejectSink():
+
+    def __init__(self, output_directory, max_error_rate=0.01, min_checked=1000, append=False,
+                 enforce=True):
+        """
+            max_error_rate: largest share of rejected elements allowed
+            min_checked: elements to see before the budget is enforced
+            append: add to existing rejects files (when resuming)
+            enforce: False to only count, never raise (for shards)
+        """
+        self._output_directory = output_directory
+        self._append = append
+        self._max_error_rate = max_error_rate
+        self._min_checked = min_checked
+        self._enforce = enforce
+        self._filehandles = {}
+        self._tables = set()
+        self.num_checked = 0
+        self.num_rejected = 0
+        self.field_counts = collections.Counter()
+
+    def __del__(self):
+        """
+            destructor - cleanup open handles
+        """
+        self.close()
+
+    def close(self):
+        """
+            close the rejects files
+        """
+        for handle in self._filehandles.values():
+            handle.close()
+        self._filehandles = {}
+
+    @property
+    def filenames(self):
+        """
+            names of the rejects files written so far
+        """
+        return sorted(table + REJECTS_SUFFIX for table in self._tables)
+
+    def _handle(self, table):
+        handle = self._filehandles.get(table)
+        if handle is None:
+            filepath = os.path.join(self._output_directory, table + REJECTS_SUFFIX)
+            handle = open(filepath, 'a' if self._append else 'w', encoding='utf-8')
+            self._filehandles[table] = handle
+            self._tables.add(table)
+        return handle
+
+    def reject(self, element, errors):
+        """
+            Record a shaped element that failed validation with
+            errors (validator.errors), then enforce the budget
+        """
+        self.num_rejected += 1
+        # count each failing field once per element
+        self.field_counts.update(set(_error_fields(errors, '')))
+
+        main = element.get('node') or element.get('way') or element.get('relation') or {}
+        element_id = main.get('id') if isinstance(main, dict) else None
+
+        for table, reason in errors.items():
+            line = {'id': element_id, 'reason': reason, 'record': element.get(table)}
+            self._handle(table).write(json.dumps(line, default=str) + "\n")
+
+        self.check_budget()
+
+    def check_budget(self, final=False):
+        """
+            Raise ErrorBudgetExceeded once the reject rate is over budget.
+            Mid-run the rate is enforced from min_checked elements on;
+            final=True checks the totals of a whole run, however few.
+            A sink made with enforce=False never raises.
+        """
+        if not self._enforce or not self.num_checked or (self.num_checked < self._min_checked and not final):
+            return
+        rate = self.num_rejected / float(self.num_checked)
+        if rate > self._max_error_rate:
+            raise ErrorBudgetExceeded(
+                "{} of {} elements rejected ({:.2%}), over the {:.2%} budget".format(
+                    self.num_rejected, self.num_checked, rate, self._max_error_rate))
+
+    def summary(self):
+        """
+            Reject counts overall and by field (number of rejected
+            elements with at least one error in that field)
+        """
+        return {
+            'checked': self.num_checked,
+            'rejected': self.num_rejected,
+            'by_field': dict(self.field_counts.most_common()),
+        }
+
+    def flush(self):
+        for handle in self._filehandles.values():
+            handle.flush()
+
+    def restore(self, summary, filenames):
+        """
+            Carry on from the summary and rejects files of an earlier
+            run (see checkpoint.py)
+        """
+        self.merge(summary)
+        self._tables.update(filename[:-len(REJECTS_SUFFIX)] for filename in filenames)
+
+    def merge(self, summary):
+        """
+            Fold in the summary of another sink (e.g. a parallel shard)
+        """
+        self.num_checked += summary['checked']
+        self.num_rejected += summary['rejected']
+        self.field_counts.update(summary['by_field'])
+
+    def write_summary(self):
+        """
+            Write rejects_summary.json and return the report text
+        """
+        summary = self.summary()
+        with open(os.path.join(self._output_directory, SUMMARY_FILENAME), 'w') as handle:
+            json.dump(summary, handle, indent=2)
+
+        lines = ["rejected {} of {} elements".format(summary['rejected'], summary['checked'])]
+        for field, count in summary['by_field'].items():
+            lines.append("  {0: <30} {1: >10}".format(field, count))
+        return "\n".join(lines)
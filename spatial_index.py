@@ -0,0 +1,228 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+    Nearest-neighbour and bounding box queries on the SQLite R-tree
+
+    create_spatial_index.sql (run by sqlite_loader.py) puts the points
+    of interest, the nodes tagged amenity or shop, in the poi_rtree
+    R-tree virtual table, with their amenity, shop and name.
+
+    Database.get_closest_nodes in database_mysql/db.py measures the
+    distance to every node and sorts them all, on every call.  An
+    R-tree finds the nodes inside a box by reading the few pages that
+    cover it, so SpatialIndex.nearest searches outward instead:
+
+    * the first box is sized to hold about k nodes, from the mean
+      density of the points (of the matching points, with a filter)
+    * the points in the box are measured with the haversine formula
+    * once k of them lie within the circle the box encloses, they
+      are the k nearest; until then the radius is doubled
+
+    The density for each filter is found by a scan of the R-tree the
+    first time it is asked for, then kept.  Extracts that cross the
+    antimeridian are not handled.
+
+    usage: python spatial_index.py database_sqlite/new_orleans.db lat lon
+                                   [-k 10] [--amenity restaurant]
+"""
+import argparse
+import math
+import sqlite3
+
+EARTH_RADIUS = 6371008.8
+
+# the columns of a point after node_id, and those a search can filter on
+COLUMNS = ('lat', 'lon', 'amenity', 'shop', 'name')
+FILTERS = ('amenity', 'shop', 'name')
+
+# keep poi_rtree in step with one node of the node and node_tag tables
+DELETE_POI = "delete from poi_rtree where node_id = ?"
+INSERT_POI = """
+    insert into poi_rtree
+    select node_id, node_lat, node_lat, node_lon, node_lon, node_lat, node_lon,
+           (select tag_value from node_tag
+             where node_tag.node_id = node.node_id and tag_key = 'amenity' and tag_type = 'regular'
+             limit 1),
+           (select tag_value from node_tag
+             where node_tag.node_id = node.node_id and tag_key = 'shop' and tag_type = 'regular'
+             limit 1),
+           (select tag_value from node_tag
+             where node_tag.node_id = node.node_id and tag_key = 'name' and tag_type = 'regular'
+             limit 1)
+      from node
+     where node_id = ? and node_lat is not null and node_lon is not null
+       and node_id in (select node_id from node_tag
+                        where tag_key in ('amenity', 'shop') and tag_type = 'regular')"""
+
+
+def has_spatial_index(connection):
+    return connection.execute("select count(*) from sqlite_master "
+                              "where type = 'table' and name = 'poi_rtree'").fetchone()[0] > 0
+
+
+def refresh_node(cursor, node_id):
+    """
+        Replace the R-tree entry of node_id with what the node and
+        node_tag tables now hold (nothing, for a deleted node or
+        one no longer tagged amenity or shop)
+    """
+    cursor.execute(DELETE_POI, (node_id,))
+    cursor.execute(INSERT_POI, (node_id,))
+
+
+def haversine(lat1, lon1, lat2, lon2):
+    """
+        Great circle distance in metres between two
+        points given in degrees
+    """
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = (math.sin((lat2 - lat1) / 2) ** 2
+         + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2)
+    return 2 * EARTH_RADIUS * math.asin(math.sqrt(min(a, 1.0)))
+
+
+def bounding_box(lat, lon, radius):
+    """
+        (min_lat, max_lat, min_lon, max_lon) of the smallest box
+        holding every point within radius metres of lat, lon
+    """
+    angle = radius / EARTH_RADIUS
+    min_lat = lat - math.degrees(angle)
+    max_lat = lat + math.degrees(angle)
+    if min_lat <= -90 or max_lat >= 90 or math.sin(angle) >= math.cos(math.radians(lat)):
+        # the circle holds a pole: every longitude
+        return max(min_lat, -90.0), min(max_lat, 90.0), -180.0, 180.0
+    delta_lon = math.degrees(math.asin(math.sin(angle) / math.cos(math.radians(lat))))
+    return min_lat, max_lat, lon - delta_lon, lon + delta_lon
+
+
+def _where(filters):
+    """
+        (sql conditions, parameters) for filters {column: value}
+    """
+    conditions = []
+    parameters = []
+    for column, value in sorted(filters.items()):
+        if column not in FILTERS:
+            raise ValueError("Cannot filter on '{}', expected one of: {}".format(
+                column, ", ".join(FILTERS)))
+        conditions.append("{} = ?".format(column))
+        parameters.append(value)
+    return conditions, parameters
+
+
+class SpatialIndex(object):
+
+    def __init__(self, database):
+        """
+            database: the path of a database built by sqlite_loader.py
+            (or with create_spatial_index.sql), or an open connection
+        """
+        if isinstance(database, sqlite3.Connection):
+            self._connection = database
+            self._owns_connection = False
+        else:
+            self._connection = sqlite3.connect(database)
+            self._owns_connection = True
+        if not has_spatial_index(self._connection):
+            raise ValueError("The database has no poi_rtree table; "
+                             "run database_sqlite/create_spatial_index.sql")
+        # filters -> (count, min_lat, max_lat, min_lon, max_lon)
+        self._extents = {}
+
+    def close(self):
+        if self._owns_connection and self._connection is not None:
+            self._connection.close()
+        self._connection = None
+
+    def _extent(self, filters):
+        """
+            (count, min_lat, max_lat, min_lon, max_lon)
+            of the points matching filters
+        """
+        key = tuple(sorted(filters.items()))
+        if key not in self._extents:
+            conditions, parameters = _where(filters)
+            sql = "select count(*), min(min_lat), max(max_lat), min(min_lon), max(max_lon) from poi_rtree"
+            if conditions:
+                sql += " where " + " and ".join(conditions)
+            self._extents[key] = self._connection.execute(sql, parameters).fetchone()
+        return self._extents[key]
+
+    def within(self, min_lat, min_lon, max_lat, max_lon, **filters):
+        """
+            The (node_id, lat, lon, amenity, shop, name) of the
+            points inside the box, unordered
+        """
+        conditions, parameters = _where(filters)
+        sql = """
+            select node_id, {}
+              from poi_rtree
+             where min_lat <= ? and max_lat >= ?
+               and min_lon <= ? and max_lon >= ?""".format(", ".join(COLUMNS))
+        for condition in conditions:
+            sql += " and " + condition
+        return self._connection.execute(
+            sql, [max_lat, min_lat, max_lon, min_lon] + parameters).fetchall()
+
+    def nearest(self, lat, lon, k=10, max_distance=None, **filters):
+        """
+            The k points nearest lat, lon, nearest first, as the
+            rows of within() with the distance in metres in front.
+            Only points within max_distance metres, if given;
+            filters are column=value, e.g. amenity='cafe'.
+        """
+        count, min_lat, max_lat, min_lon, max_lon = self._extent(filters)
+        if not count or k <= 0:
+            return []
+        # the radius of a circle holding k points, at the mean density
+        height = math.radians(max_lat - min_lat) * EARTH_RADIUS
+        width = (math.radians(max_lon - min_lon) * EARTH_RADIUS
+                 * math.cos(math.radians((min_lat + max_lat) / 2)))
+        radius = math.sqrt(max(height * width, 1.0) * min(k, count) / count / math.pi)
+        if max_distance is not None:
+            radius = min(radius, max_distance)
+        while True:
+            box = bounding_box(lat, lon, radius)
+            measured = sorted((haversine(lat, lon, row[1], row[2]),) + tuple(row)
+                              for row in self.within(box[0], box[2], box[1], box[3], **filters))
+            if max_distance is not None and radius >= max_distance:
+                return [row for row in measured if row[0] <= max_distance][:k]
+            covers_all = (box[0] <= min_lat and box[1] >= max_lat
+                          and box[2] <= min_lon and box[3] >= max_lon)
+            if covers_all or sum(1 for row in measured if row[0] <= radius) >= k:
+                return measured[:k]
+            radius *= 2
+            if max_distance is not None:
+                radius = min(radius, max_distance)
+
+    def nearest_to_node(self, node_id, k=10, max_distance=None, **filters):
+        """
+            nearest() to the position of node_id, leaving out
+            node_id itself.  [] for a node not in the database.
+        """
+        position = self._connection.execute(
+            "select node_lat, node_lon from node where node_id = ?", (node_id,)).fetchone()
+        if position is None or position[0] is None:
+            return []
+        rows = self.nearest(position[0], position[1], k + 1, max_distance, **filters)
+        return [row for row in rows if row[1] != int(node_id)][:k]
+
+
+if __name__ == '__main__':
+    arguments = argparse.ArgumentParser(description="The points of interest nearest a point")
+    arguments.add_argument('database')
+    arguments.add_argument('lat', type=float)
+    arguments.add_argument('lon', type=float)
+    arguments.add_argument('-k', type=int, default=10)
+    arguments.add_argument('--max-distance', type=float, help="metres")
+    for column in FILTERS:
+        arguments.add_argument('--' + column)
+    args = arguments.parse_args()
+
+    index = SpatialIndex(args.database)
+    filters = {column: getattr(args, column) for column in FILTERS
+               if getattr(args, column) is not None}
+    for row in index.nearest(args.lat, args.lon, args.k, args.max_distance, **filters):
+        print("{0: >10.1f}m  {1}".format(row[0], "  ".join(str(value) for value in row[1:])))
+    index.close()
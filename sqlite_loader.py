@@ -0,0 +1,389 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+    Load an OSM file straight into the SQLite database
+
+    load_tables.sql imports the csv files written by data.py: every
+    row is written out as csv text, then parsed again by .import.
+    Here the shaped records of data.py go straight into the tables:
+
+    * SqliteWriter batches the rows of each table and inserts them
+      with executemany, BATCH_SIZE rows a call, committing every
+      COMMIT_ROWS rows
+    * the load runs with journal_mode=OFF, synchronous=OFF, a
+      CACHE_MB page cache and an exclusive lock.  A crash mid-load
+      leaves a database to rebuild, as an interrupted .import does.
+    * the tables are loaded without secondary indexes; the indexes
+      of create_indexes.sql are built once all the rows are in, then
+      the R-tree of create_spatial_index.sql and the summary tables
+      of create_summaries.sql
+    * foreign keys stay declared but unenforced during the load
+      (SQLite has no ALTER TABLE ... ADD CONSTRAINT).  With
+      check_foreign_keys=True, PRAGMA foreign_key_check runs at the
+      end and reports the rows that point outside the extract.
+    * with workers > 1 an XML file is split into byte ranges (see
+      parallel_ingest.py) shaped into rows on a pool of worker
+      processes; the rows come back in shard order to the one
+      SqliteWriter.  SQLite takes one writer, so the inserts stay
+      serial and bound the gain.  A .osm.pbf file has its blocks
+      decoded on the workers instead.
+
+    Missing attributes are stored as NULL, where .import stores ''.
+
+    usage: python sqlite_loader.py map.osm database_sqlite/new_orleans.db
+                                   [--validate] [--workers N] [--check-foreign-keys]
+"""
+import argparse
+import collections
+import multiprocessing
+import os
+import re
+import sqlite3
+import time
+
+import data
+from schema import schema as SCHEMA
+from street_map_csv_writer import TABLES, StreetMapWriter
+
+SQL_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'database_sqlite')
+TABLES_SQL = os.path.join(SQL_DIRECTORY, 'create_tables.sql')
+INDEXES_SQL = os.path.join(SQL_DIRECTORY, 'create_indexes.sql')
+SPATIAL_SQL = os.path.join(SQL_DIRECTORY, 'create_spatial_index.sql')
+SUMMARIES_SQL = os.path.join(SQL_DIRECTORY, 'create_summaries.sql')
+
+# writer name -> sqlite table; the columns are in *_FIELDS order
+SQL_TABLES = {'node': 'node',
+              'node_tags': 'node_tag',
+              'way': 'way',
+              'way_nodes': 'way_node',
+              'way_tags': 'way_tag',
+              'relation': 'relation',
+              'relation_members': 'relation_member',
+              'relation_tags': 'relation_tag'}
+
+# rows per executemany call
+BATCH_SIZE = 10000
+# rows per transaction
+COMMIT_ROWS = 1000000
+# XML shard size: the rows of SHARDS_AHEAD shards a worker
+# wait in memory for the inserts
+SHARD_BYTES = 8 * 1024 * 1024
+SHARDS_AHEAD = 2
+CACHE_MB = 256
+# bytes per page of a new database; larger pages mean fewer b-tree splits
+PAGE_SIZE = 16384
+LOAD_PRAGMAS = ['journal_mode = OFF',
+                'synchronous = OFF',
+                'cache_size = -{}'.format(CACHE_MB * 1024),
+                'temp_store = MEMORY',
+                'locking_mode = EXCLUSIVE',
+                'foreign_keys = OFF']
+
+
+def float_columns(writer_name, fields):
+    """
+        Positions of the schema.py float fields of a table
+    """
+    table_schema = SCHEMA[writer_name]
+    if table_schema['type'] == 'list':
+        table_schema = table_schema['schema']
+    return [position for position, field in enumerate(fields)
+            if table_schema['schema'][field]['type'] == 'float']
+
+
+def _with_floats(row, columns):
+    # sqlite before 3.47 can round text to REAL 1 ulp off; float() does not
+    row = list(row)
+    for column in columns:
+        if row[column] not in (None, ''):
+            row[column] = float(row[column])
+    return row
+
+
+class SqliteWriter(StreetMapWriter):
+    """
+        Inserts the rows of the eight tables into an open
+        connection (made with isolation_level=None)
+    """
+
+    def __init__(self, connection, batch_size=BATCH_SIZE, commit_rows=COMMIT_ROWS):
+        self._connection = connection
+        self._batch_size = batch_size
+        self._commit_rows = commit_rows
+        self._fields = {}
+        self._inserts = {}
+        self._floats = {}
+        self._batches = {}
+        self._row_counts = {}
+        for writer_name, _, fields in TABLES:
+            self._fields[writer_name] = fields
+            self._inserts[writer_name] = "insert into {} values ({})".format(
+                SQL_TABLES[writer_name], ", ".join("?" * len(fields)))
+            self._floats[writer_name] = float_columns(writer_name, fields)
+            self._batches[writer_name] = []
+            self._row_counts[writer_name] = 0
+        self._uncommitted = 0
+        self._connection.execute("begin")
+
+    def close(self):
+        """
+            insert the batched rows and commit
+        """
+        if self._connection is None:
+            return
+        for writer_name, batch in self._batches.items():
+            if batch:
+                self._write_batch(writer_name, batch)
+        self._connection.execute("commit")
+        self._connection = None
+
+    def flush(self):
+        """
+            insert the batched rows and commit them
+        """
+        for writer_name, batch in self._batches.items():
+            if batch:
+                self._write_batch(writer_name, batch)
+        self._connection.execute("commit")
+        self._uncommitted = 0
+        self._connection.execute("begin")
+
+    @property
+    def row_counts(self):
+        """
+            {table: rows written}, batched rows included
+        """
+        return {SQL_TABLES[writer_name]: count for writer_name, count in self._row_counts.items()}
+
+    def _write_batch(self, writer_name, batch):
+        """
+            Insert and empty the batch for writer_name
+        """
+        floats = self._floats[writer_name]
+        if floats:
+            batch[:] = [_with_floats(row, floats) for row in batch]
+        self._connection.executemany(self._inserts[writer_name], batch)
+        self._uncommitted += len(batch)
+        del batch[:]
+        if self._uncommitted >= self._commit_rows:
+            self._connection.execute("commit")
+            self._uncommitted = 0
+            self._connection.execute("begin")
+
+    def add_row(self, writer_name, row):
+        batch = self._batches[writer_name]
+        batch.append(row)
+        self._row_counts[writer_name] += 1
+        if len(batch) >= self._batch_size:
+            self._write_batch(writer_name, batch)
+
+    def add_rows(self, writer_name, rows):
+        batch = self._batches[writer_name]
+        batch.extend(rows)
+        self._row_counts[writer_name] += len(rows)
+        if len(batch) >= self._batch_size:
+            self._write_batch(writer_name, batch)
+
+
+class ShardRows(StreetMapWriter):
+    """
+        Keeps the rows of one shard, {writer name: [rows]},
+        to send back to the loading process
+    """
+
+    def __init__(self):
+        self.rows = {writer_name: [] for writer_name, _, _ in TABLES}
+
+    def add_row(self, writer_name, row):
+        self.rows[writer_name].append(row)
+
+    def add_rows(self, writer_name, rows):
+        self.rows[writer_name].extend(rows)
+
+
+def _shard_rows(args):
+    """
+        Worker: the rows of one byte range of an XML file
+    """
+    from osm_parsers import iter_shaped_elements
+    from parallel_ingest import ByteRangeReader
+
+    file_in, start, end, backend = args
+    shard = ShardRows()
+    reader = ByteRangeReader(file_in, start, end, prefix=b'<osm>', suffix=b'</osm>')
+    try:
+        data.ingest_rows(iter_shaped_elements(reader, tags=data.ELEMENT_TAGS, backend=backend,
+                                              rows=True),
+                         shard)
+    finally:
+        reader.close()
+    return shard.rows
+
+
+def insert_shards(file_in, writer, backend, workers):
+    """
+        Shape the shards of file_in (OSM XML) on workers processes
+        and add their rows to writer, in shard order.  At most
+        SHARDS_AHEAD shards a worker wait for the writer.
+    """
+    from parallel_ingest import SHARDS_PER_WORKER, find_shard_boundaries
+
+    num_shards = max(workers * SHARDS_PER_WORKER, os.path.getsize(file_in) // SHARD_BYTES)
+    boundaries = find_shard_boundaries(file_in, num_shards)
+    jobs = [(file_in, start, end, backend) for start, end in boundaries]
+    pool = multiprocessing.Pool(workers)
+    try:
+        pending = collections.deque()
+        for job in jobs:
+            pending.append(pool.apply_async(_shard_rows, (job,)))
+            if len(pending) >= workers * SHARDS_AHEAD:
+                _add_shard(writer, pending.popleft().get())
+        while pending:
+            _add_shard(writer, pending.popleft().get())
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def _add_shard(writer, shard_rows):
+    for writer_name, rows in shard_rows.items():
+        if rows:
+            writer.add_rows(writer_name, rows)
+
+
+def index_names(indexes_sql):
+    """
+        The names of the indexes an index script creates
+    """
+    with open(indexes_sql) as handle:
+        return re.findall(r'create\s+index\s+(?:if\s+not\s+exists\s+)?(\w+)',
+                          handle.read(), re.IGNORECASE)
+
+
+def table_names(tables_sql):
+    """
+        The names of the tables a table script creates
+    """
+    with open(tables_sql) as handle:
+        return re.findall(r'create\s+table\s+(?:if\s+not\s+exists\s+)?(\w+)',
+                          handle.read(), re.IGNORECASE)
+
+
+def prepare_tables(connection):
+    """
+        Create the tables, or, when the database already has
+        them, add the missing ones (e.g. from an older
+        create_tables.sql), empty every table and drop
+        their secondary indexes
+    """
+    exists = connection.execute(
+        "select count(*) from sqlite_master where type = 'table' and name = 'node'").fetchone()[0]
+    if not exists:
+        connection.execute("pragma page_size = {}".format(PAGE_SIZE))
+    with open(TABLES_SQL) as handle:
+        connection.executescript(handle.read())
+    if not exists:
+        return
+    for name in index_names(INDEXES_SQL):
+        connection.execute("drop index if exists {}".format(name))
+    # way_coord and way_metric too: they describe the extract loaded before
+    for table in table_names(TABLES_SQL):
+        connection.execute("delete from {}".format(table))
+
+
+def foreign_key_errors(connection):
+    """
+        {(table, parent table): rows whose foreign key has no parent row}
+    """
+    counts = collections.Counter()
+    for table, _, parent, _ in connection.execute("pragma foreign_key_check"):
+        counts[(table, parent)] += 1
+    return counts
+
+
+def load(file_in, database_path, validate=False, backend=data.DEFAULT_BACKEND, workers=1,
+         validator='compiled', check_foreign_keys=False, batch_size=BATCH_SIZE):
+    """
+        Load file_in (OSM XML or .osm.pbf) into the database at
+        database_path, replacing what the tables held.
+
+        validate / validator / backend / workers are as in
+        data.process_map; invalid elements raise.  Without
+        validation an XML file is shaped on workers processes
+        (see insert_shards).
+
+        Returns a dict of the rows loaded per table, the seconds
+        spent loading, indexing, building the R-tree and building
+        the summary tables, rows_per_second and, with
+        check_foreign_keys, the foreign_key_errors found.
+    """
+    from osm_parsers import is_pbf, iter_shaped_elements
+
+    start = time.perf_counter()
+    connection = sqlite3.connect(database_path, isolation_level=None)
+    try:
+        for pragma in LOAD_PRAGMAS:
+            connection.execute("pragma " + pragma)
+        prepare_tables(connection)
+
+        writer = SqliteWriter(connection, batch_size=batch_size)
+        # without a journal there is no rollback: a failed
+        # load leaves the tables to load again
+        if workers > 1 and validate is not True and not is_pbf(file_in):
+            insert_shards(file_in, writer, backend, workers)
+        elif validate is True:
+            records = iter_shaped_elements(file_in, tags=data.ELEMENT_TAGS, backend=backend,
+                                           workers=workers)
+            data.ingest_elements(records, writer, validate, validator)
+        else:
+            records = iter_shaped_elements(file_in, tags=data.ELEMENT_TAGS, backend=backend,
+                                           workers=workers, rows=True)
+            data.ingest_rows(records, writer)
+        writer.close()
+        loaded = time.perf_counter()
+
+        with open(INDEXES_SQL) as handle:
+            connection.executescript(handle.read())
+        indexed = time.perf_counter()
+        with open(SPATIAL_SQL) as handle:
+            connection.executescript(handle.read())
+        spatial = time.perf_counter()
+        with open(SUMMARIES_SQL) as handle:
+            connection.executescript(handle.read())
+        summarized = time.perf_counter()
+
+        stats = {'rows': writer.row_counts,
+                 'load_seconds': loaded - start,
+                 'index_seconds': indexed - loaded,
+                 'spatial_seconds': spatial - indexed,
+                 'summary_seconds': summarized - spatial}
+        total_rows = sum(stats['rows'].values())
+        stats['rows_per_second'] = total_rows / stats['load_seconds'] if stats['load_seconds'] else None
+        if check_foreign_keys:
+            stats['foreign_key_errors'] = foreign_key_errors(connection)
+    finally:
+        connection.close()
+    return stats
+
+
+if __name__ == '__main__':
+    arguments = argparse.ArgumentParser(description="Load an OSM file into the SQLite database")
+    arguments.add_argument('osm_file')
+    arguments.add_argument('database')
+    arguments.add_argument('--validate', action='store_true')
+    arguments.add_argument('--backend', default=data.DEFAULT_BACKEND)
+    arguments.add_argument('--workers', type=int, default=1, help="XML shard parsers / pbf decode workers")
+    arguments.add_argument('--check-foreign-keys', action='store_true',
+                           help="count rows referring to elements outside the extract")
+    args = arguments.parse_args()
+
+    stats = load(args.osm_file, args.database, validate=args.validate, backend=args.backend,
+                 workers=args.workers, check_foreign_keys=args.check_foreign_keys)
+    for table, count in stats['rows'].items():
+        print("{0: <16} {1: >12}".format(table, count))
+    print("loaded {} rows in {:.2f}s ({:.0f} rows/s), indexes built in {:.2f}s, "
+          "R-tree in {:.2f}s, summaries in {:.2f}s".format(
+              sum(stats['rows'].values()), stats['load_seconds'], stats['rows_per_second'] or 0,
+              stats['index_seconds'], stats['spatial_seconds'], stats['summary_seconds']))
+    for (table, parent), count in sorted(stats.get('foreign_key_errors', {}).items()):
+        print("{} rows of {} refer to a missing {}".format(count, table, parent))
@@ -4,13 +4,16 @@
     This object handles opening and writing
     to various csv files
 
+    StreetMapWriter is the interface shared with the
+    columnar writer (see columnar_writer.py)
+
 """
 
 # -*- coding: utf-8 -*-
 import csv
-import codecs
 import os.path
-import sys
+
+import csv_compression
 
 # This is what we're using for the wrangling course
 NODES_FILENAME = "nodes.csv"
@@ -18,82 +21,85 @@ NODE_TAGS_FILENAME = "nodes_tags.csv"
 WAYS_FILENAME = "ways.csv"
 WAY_NODES_FILENAME = "ways_nodes.csv"
 WAY_TAGS_FILENAME = "ways_tags.csv"
+RELATIONS_FILENAME = "relations.csv"
+RELATION_MEMBERS_FILENAME = "relations_members.csv"
+RELATION_TAGS_FILENAME = "relations_tags.csv"
 
 NODE_FIELDS = ['id', 'lat', 'lon', 'user', 'uid', 'version', 'changeset', 'timestamp']
 NODE_TAGS_FIELDS = ['id', 'key', 'value', 'type']
 WAY_FIELDS = ['id', 'user', 'uid', 'version', 'changeset', 'timestamp']
 WAY_NODES_FIELDS = ['id', 'node_id', 'position']
 WAY_TAGS_FIELDS = ['id', 'key', 'value', 'type']
+RELATION_FIELDS = ['id', 'user', 'uid', 'version', 'changeset', 'timestamp']
+RELATION_MEMBERS_FIELDS = ['id', 'member_id', 'member_type', 'role', 'position']
+RELATION_TAGS_FIELDS = ['id', 'key', 'value', 'type']
 
-class StreetMapCsvWriter():
+# (writer name, csv filename, fields) of each table, in output order
+TABLES = [('node', NODES_FILENAME, NODE_FIELDS),
+          ('node_tags', NODE_TAGS_FILENAME, NODE_TAGS_FIELDS),
+          ('way', WAYS_FILENAME, WAY_FIELDS),
+          ('way_nodes', WAY_NODES_FILENAME, WAY_NODES_FIELDS),
+          ('way_tags', WAY_TAGS_FILENAME, WAY_TAGS_FIELDS),
+          ('relation', RELATIONS_FILENAME, RELATION_FIELDS),
+          ('relation_members', RELATION_MEMBERS_FILENAME, RELATION_MEMBERS_FIELDS),
+          ('relation_tags', RELATION_TAGS_FILENAME, RELATION_TAGS_FIELDS)]
 
-    def __init__(self, add_csv_headers, output_directory):
-        self._writers = {}
-        self._filehandles = []
-        self._add_csv_headers = add_csv_headers
-        self._output_directory = output_directory
-        self._num_nodes = 0
-        self._num_node_tags = 0
-        self._num_ways = 0
+# rows are buffered per table and written with writerows in batches
+BATCH_SIZE = 4096
+# bytes of file buffering for each csv file
+WRITE_BUFFER_SIZE = 1024 * 1024
 
-        self._setup_for_wrangling_course()
 
-    def __del__(self):
-        """
-            destructor - cleanup open handles
-        """
-        for handle in self._filehandles:
-            handle.close()
+class StreetMapWriter():
+    """
+        Turns records into rows of the eight tables. Subclasses
+        store the rows: they implement add_row, add_rows, flush,
+        close and the filenames, row_counts and byte_counts
+        properties, and fill _fields with the field list of
+        each table.
+    """
 
-    def _make_output_path(self, filename):
-        """
-            append filename to output directory
-        """
-        return os.path.join(self._output_directory, filename)
+    def add_row(self, writer_name, row):
+        raise NotImplementedError
 
-    def _setup_for_wrangling_course(self):
-        """
-            create CSV writer for each record type
-            used in the OSM project
-        """
-        self._add_writer('node', NODES_FILENAME, NODE_FIELDS)
-        self._add_writer('node_tags', NODE_TAGS_FILENAME, NODE_TAGS_FIELDS)
-        self._add_writer('way', WAYS_FILENAME, WAY_FIELDS)
-        self._add_writer('way_nodes', WAY_NODES_FILENAME, WAY_NODES_FIELDS)
-        self._add_writer('way_tags', WAY_TAGS_FILENAME, WAY_TAGS_FIELDS)
+    def add_rows(self, writer_name, rows):
+        raise NotImplementedError
 
-    def _add_writer(self, writer_name, filename, fieldlist):
+    def flush(self):
+        raise NotImplementedError
+
+    def close(self):
+        raise NotImplementedError
+
+    def _dict_to_row(self, writer_name, dictionary):
         """
-            Build a CSV writer identified by writer_name
+            Order a record dictionary by the writer's fields,
+            the way csv.DictWriter does
         """
-        
-        # determine full output path
-        filepath = os.path.join(self._output_directory, filename)
-
+        fields = self._fields[writer_name]
+        if len(dictionary) > len(fields) or not dictionary.keys() <= set(fields):
+            wrong_fields = [key for key in dictionary if key not in fields]
+            raise ValueError("dict contains fields not in fieldnames: "
+                             + ", ".join(repr(key) for key in wrong_fields))
+        return [dictionary.get(field, '') for field in fields]
 
-        codec = codecs.open(filepath, 'w', encoding='utf-8')
-        self._filehandles.append(codec)
-        writer = csv.DictWriter(codec, fieldlist)
-        if self._add_csv_headers:
-            writer.writeheader()
-        self._writers[writer_name] = writer
-        
     def _add_rows(self, writer_name, list_of_dictionaries):
         """
-            Add a list of records to the CSV writer
+            Add a list of records to the table
             identified by writer_name
         """
         assert(isinstance(list_of_dictionaries, list))
-        self._writers[writer_name].writerows(list_of_dictionaries)
+        self.add_rows(writer_name,
+                      [self._dict_to_row(writer_name, dictionary) for dictionary in list_of_dictionaries])
         
     def _add_row(self, writer_name, dictionary):
         """
-            Add a single record to the CSV writer
+            Add a single record to the table
             identified by writer_name
         """
         assert(isinstance(dictionary, dict))
-        self._writers[writer_name].writerow(dictionary)
-        
+        self.add_row(writer_name, self._dict_to_row(writer_name, dictionary))
+
     # Convenience functions
     #
     def add_node(self, node_dictionary):
@@ -115,9 +121,6 @@ class StreetMapCsvWriter():
           'changeset': 5288876
         }
         """
-        self._num_nodes += 1
-        if self._num_nodes % 100000 == 0:
-            print("n: {}".format(self._num_nodes))
         self._add_row('node', node_dictionary)
 
     def add_node_tags(self, list_of_tag_dicts):
@@ -133,9 +136,6 @@ class StreetMapCsvWriter():
                 'type': 'regular'},
             ]
         """
-        self._num_node_tags += 1
-        if self._num_node_tags % 100000 == 0:
-            print("nt: {}".format(self._num_node_tags))
         self._add_rows('node_tags', list_of_tag_dicts)
 
     def add_way(self, way_dictionary):
@@ -147,9 +147,6 @@ class StreetMapCsvWriter():
              'timestamp': '2013-03-13T15:58:04Z',
              'changeset': 15353317},
          """
-        self._num_ways += 1
-        if self._num_ways % 10000 == 0:
-            print("w: {}".format(self._num_ways))
         self._add_row('way', way_dictionary)
 
     def add_way_nodes(self, list_of_waynode_dicts):
@@ -179,6 +176,248 @@ class StreetMapCsvWriter():
         """
         self._add_rows('way_tags', list_of_tag_dicts)
 
+    def add_relation(self, relation_dictionary):
+        """
+            {'id': 1837290,
+             'user': 'woodpeck_repair',
+             'uid': 145231,
+             'version': '4',
+             'timestamp': '2012-03-14T08:44:29Z',
+             'changeset': 11021837},
+        """
+        self._add_row('relation', relation_dictionary)
+
+    def add_relation_members(self, list_of_member_dicts):
+        """
+              [{'id': 1837290, 'member_id': 384119204, 'member_type': 'way',
+                'role': 'outer', 'position': 0},
+               {'id': 1837290, 'member_id': 34231896, 'member_type': 'way',
+                'role': 'inner', 'position': 1}],
+        """
+        self._add_rows('relation_members', list_of_member_dicts)
+
+    def add_relation_tags(self, list_of_tag_dicts):
+        """
+              [{'id': 1837290, 'key': 'type', 'value': 'multipolygon', 'type': 'regular'}]
+        """
+        self._add_rows('relation_tags', list_of_tag_dicts)
+
+    # Tuple records, in *_FIELDS order (see data.shape_element_rows)
+    #
+    def add_node_row(self, node_row):
+        """
+            (id, lat, lon, user, uid, version, changeset, timestamp)
+        """
+        self.add_row('node', node_row)
+
+    def add_node_tag_rows(self, tag_rows):
+        """
+            [(id, key, value, type), ...]
+        """
+        self.add_rows('node_tags', tag_rows)
+
+    def add_way_row(self, way_row):
+        """
+            (id, user, uid, version, changeset, timestamp)
+        """
+        self.add_row('way', way_row)
+
+    def add_way_node_rows(self, way_node_rows):
+        """
+            [(id, node_id, position), ...]
+        """
+        self.add_rows('way_nodes', way_node_rows)
+
+    def add_way_tag_rows(self, tag_rows):
+        """
+            [(id, key, value, type), ...]
+        """
+        self.add_rows('way_tags', tag_rows)
+
+    def add_relation_row(self, relation_row):
+        """
+            (id, user, uid, version, changeset, timestamp)
+        """
+        self.add_row('relation', relation_row)
+
+    def add_relation_member_rows(self, member_rows):
+        """
+            [(id, member_id, member_type, role, position), ...]
+        """
+        self.add_rows('relation_members', member_rows)
+
+    def add_relation_tag_rows(self, tag_rows):
+        """
+            [(id, key, value, type), ...]
+        """
+        self.add_rows('relation_tags', tag_rows)
+
+
+class StreetMapCsvWriter(StreetMapWriter):
+
+    def __init__(self, add_csv_headers, output_directory, append=False,
+                 compression=None, compress_workers=None):
+        """
+            append=True adds to existing csv files (when resuming
+            from a checkpoint) instead of truncating them
+
+            compression='gzip' or 'zstd' writes nodes.csv.gz etc.,
+            compressed on compress_workers background threads
+            (see csv_compression.py)
+        """
+        csv_compression.check_compression(compression)
+        self._compression = compression
+        self._executor = None
+        if compression is not None:
+            self._executor = csv_compression.make_executor(compress_workers)
+            self._compress = csv_compression.make_compressor(compression)
+        self._writers = {}
+        self._handles = {}
+        self._fields = {}
+        self._batches = {}
+        self._row_counts = {}
+        self._filenames = []
+        self._filehandles = []
+        self._add_csv_headers = add_csv_headers
+        self._append = append
+        self._output_directory = output_directory
+
+        self._setup_for_wrangling_course()
+
+    def __del__(self):
+        """
+            destructor - cleanup open handles
+        """
+        self.close()
+
+    def close(self):
+        """
+            flush and close all of the csv files
+        """
+        self.flush()
+        for handle in self._filehandles:
+            handle.close()
+        self._filehandles = []
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+    def flush(self):
+        """
+            write out any batched rows and flush the files
+        """
+        for writer_name, batch in self._batches.items():
+            if batch:
+                self._write_batch(writer_name, batch)
+        for handle in self._filehandles:
+            handle.flush()
+
+    @property
+    def filenames(self):
+        """
+            names of the csv files written, in the
+            order the writers were added
+        """
+        return list(self._filenames)
+
+    @property
+    def row_counts(self):
+        """
+            {filename: rows written}, batched rows included
+        """
+        return {filename: self._row_counts[writer_name]
+                for writer_name, filename in zip(self._writers, self._filenames)}
+
+    @property
+    def byte_counts(self):
+        """
+            {filename: bytes written}, not counting rows
+            still in the batches
+        """
+        if self._compression is not None:
+            return {filename: handle.bytes_written
+                    for filename, handle in zip(self._filenames, self._filehandles)}
+        return {filename: handle.tell()
+                for filename, handle in zip(self._filenames, self._filehandles)}
+
+    def restore_row_counts(self, row_counts):
+        """
+            Carry on counting from the row_counts of an earlier run
+        """
+        for writer_name, filename in zip(self._writers, self._filenames):
+            self._row_counts[writer_name] = row_counts.get(filename, 0)
+
+    def _make_output_path(self, filename):
+        """
+            append filename to output directory
+        """
+        return os.path.join(self._output_directory, filename)
+
+    def _setup_for_wrangling_course(self):
+        """
+            create CSV writer for each record type
+            used in the OSM project
+        """
+        for writer_name, filename, fields in TABLES:
+            self._add_writer(writer_name, filename, fields)
+
+    def _add_writer(self, writer_name, filename, fieldlist):
+        """
+            Build a CSV writer identified by writer_name
+        """
+        
+        # determine full output path
+        filename = csv_compression.compressed_filename(filename, self._compression)
+        filepath = os.path.join(self._output_directory, filename)
+
+        if self._compression is None:
+            handle = open(filepath, 'a' if self._append else 'w', encoding='utf-8', newline='',
+                          buffering=WRITE_BUFFER_SIZE)
+        else:
+            handle = csv_compression.CompressedTextFile(filepath, self._compress, self._executor,
+                                                           append=self._append)
+        self._handles[writer_name] = handle
+        self._filehandles.append(handle)
+        self._filenames.append(filename)
+        writer = csv.writer(handle)
+        if self._add_csv_headers and not self._append:
+            writer.writerow(fieldlist)
+        self._writers[writer_name] = writer
+        self._fields[writer_name] = fieldlist
+        self._batches[writer_name] = []
+        self._row_counts[writer_name] = 0
+
+    def _write_batch(self, writer_name, batch):
+        """
+            Write out and empty the batch for writer_name
+        """
+        self._writers[writer_name].writerows(batch)
+        del batch[:]
+        if self._compression is not None:
+            self._handles[writer_name].spill()
+
+    def add_row(self, writer_name, row):
+        """
+            Add a single tuple, in the writer's field order,
+            to the batch for writer_name
+        """
+        batch = self._batches[writer_name]
+        batch.append(row)
+        self._row_counts[writer_name] += 1
+        if len(batch) >= BATCH_SIZE:
+            self._write_batch(writer_name, batch)
+
+    def add_rows(self, writer_name, rows):
+        """
+            Add tuples, in the writer's field order,
+            to the batch for writer_name
+        """
+        batch = self._batches[writer_name]
+        batch.extend(rows)
+        self._row_counts[writer_name] += len(rows)
+        if len(batch) >= BATCH_SIZE:
+            self._write_batch(writer_name, batch)
+
 
 if __name__ == '__main__':
 
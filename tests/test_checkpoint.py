@@ -0,0 +1,93 @@
+import gzip
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'benchmarks'))
+
+import checkpoint
+import data
+import synthetic_osm
+
+EVERY = 1000
+
+
+class Interrupted(Exception):
+    pass
+
+
+def interrupt_after(monkeypatch, checkpoints, elements):
+    """
+        Make the next run stop elements elements after its
+        checkpoints-th checkpoint, as a crash would
+    """
+    track = checkpoint.Checkpointer.track
+    save = checkpoint.Checkpointer.save
+    saved = []
+
+    def counting_save(self, offset):
+        save(self, offset)
+        saved.append(offset)
+
+    def interrupted_track(self, records):
+        after = 0
+        for el in track(self, records):
+            if len(saved) >= checkpoints:
+                if after == elements:
+                    raise Interrupted()
+                after += 1
+            yield el
+
+    monkeypatch.setattr(checkpoint.Checkpointer, 'save', counting_save)
+    monkeypatch.setattr(checkpoint.Checkpointer, 'track', interrupted_track)
+
+
+def read_outputs(directory):
+    """
+        {file name: uncompressed bytes} of the csv files in directory
+    """
+    outputs = {}
+    for filename in sorted(os.listdir(directory)):
+        path = os.path.join(directory, filename)
+        if filename.endswith('.csv'):
+            with open(path, 'rb') as handle:
+                outputs[filename] = handle.read()
+        elif filename.endswith('.csv.gz'):
+            # every flush is its own gzip member, so compare what they hold
+            with gzip.open(path, 'rb') as handle:
+                outputs[filename] = handle.read()
+    return outputs
+
+
+@pytest.mark.parametrize('compression', [None, 'gzip'])
+@pytest.mark.parametrize('validate', [False, True])
+def test_resume_matches_an_uninterrupted_run(tmp_path, monkeypatch, compression, validate):
+    osm_file = str(tmp_path / 'synthetic.osm')
+    synthetic_osm.generate_osm(osm_file, 6000)
+
+    expected_directory = tmp_path / 'expected'
+    expected_directory.mkdir()
+    data.process_map(osm_file, validate, output_directory=str(expected_directory),
+                     compression=compression)
+    expected = read_outputs(str(expected_directory))
+    assert expected and all(expected.values())
+
+    directory = tmp_path / 'resumed'
+    directory.mkdir()
+    with monkeypatch.context() as patch:
+        interrupt_after(patch, 3, 400)
+        with pytest.raises(Interrupted):
+            data.process_map(osm_file, validate, output_directory=str(directory),
+                             compression=compression, checkpoint_every=EVERY)
+    state = checkpoint.load_checkpoint(str(directory / checkpoint.CHECKPOINT_FILENAME))
+    assert state['elements'] == 3 * EVERY
+    # the rows written after the checkpoint are on disk, to be cut back
+    assert any(os.path.getsize(str(directory / filename)) > entry['bytes']
+               for filename, entry in state['files'].items())
+
+    data.process_map(osm_file, validate, output_directory=str(directory),
+                     compression=compression, checkpoint_every=EVERY, resume=True)
+    assert not os.path.exists(str(directory / checkpoint.CHECKPOINT_FILENAME))
+    assert read_outputs(str(directory)) == expected
@@ -0,0 +1,151 @@
+import os
+import random
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from clip import BLOCK_SHIFT, BoundingBox, IdBitmap, Polygon, select
+
+BLOCK = 1 << BLOCK_SHIFT
+
+
+def test_id_bitmap_block_edges():
+    edges = [0, 1, BLOCK - 1, BLOCK, BLOCK + 1, 2 * BLOCK - 1, 10 ** 10,
+             -1, -BLOCK + 1, -BLOCK, -BLOCK - 1, -2 * BLOCK, -10 ** 10]
+    for added in edges:
+        bitmap = IdBitmap()
+        bitmap.add([added])
+        assert len(bitmap) == 1
+        assert bitmap.contains(edges).tolist() == [edge == added for edge in edges]
+        assert added in bitmap
+
+
+def test_id_bitmap_matches_a_set():
+    rng = np.random.default_rng(0)
+    bitmap = IdBitmap()
+    added = set()
+    # several adds, so the directory and the rows grow in between
+    for low, high in [(0, 2000), (-2000, 0), (-10 ** 6, 10 ** 6), (10 ** 9, 10 ** 9 + 5000)]:
+        ids = rng.integers(low, high, 3000)
+        bitmap.add(ids)
+        added.update(ids.tolist())
+        probe = np.concatenate([ids, rng.integers(low - 1000, high + 1000, 3000)])
+        assert bitmap.contains(probe).tolist() == [int(i) in added for i in probe]
+    assert len(bitmap) == len(added)
+    bitmap.add([])
+    assert len(bitmap) == len(added)
+
+
+# ================================================== #
+#               select against brute force           #
+# ================================================== #
+def make_extract(seed=1):
+    """
+        Random nodes, ways and relations, some with negative ids
+    """
+    rng = random.Random(seed)
+    node_ids = rng.sample(range(-3000, 3000), 1500)
+    nodes = [(node_id, rng.uniform(29.0, 31.0), rng.uniform(-91.0, -89.0)) for node_id in node_ids]
+    way_ids = rng.sample(range(-500, 500), 300)
+    ways = [(way_id, [rng.choice(node_ids) for _ in range(rng.randint(2, 8))]) for way_id in way_ids]
+    relation_ids = rng.sample(range(-100, 100), 60)
+    relations = []
+    for relation_id in relation_ids:
+        members = []
+        for _ in range(rng.randint(1, 4)):
+            kind = rng.choice(['node', 'way', 'relation'])
+            ref = rng.choice({'node': node_ids, 'way': way_ids, 'relation': relation_ids}[kind])
+            members.append((kind, ref))
+        relations.append((relation_id, members))
+    return nodes, ways, relations
+
+
+def write_extract(path, nodes, ways, relations):
+    lines = ['<?xml version="1.0" encoding="UTF-8"?>', '<osm version="0.6">']
+    for node_id, lat, lon in nodes:
+        lines.append('  <node id="{}" lat="{!r}" lon="{!r}"/>'.format(node_id, lat, lon))
+    for way_id, refs in ways:
+        lines.append('  <way id="{}">{}</way>'.format(
+            way_id, ''.join('<nd ref="{}"/>'.format(ref) for ref in refs)))
+    for relation_id, members in relations:
+        lines.append('  <relation id="{}">{}</relation>'.format(
+            relation_id, ''.join('<member type="{}" ref="{}" role=""/>'.format(*member)
+                                 for member in members)))
+    lines.append('</osm>')
+    with open(path, 'w') as handle:
+        handle.write('\n'.join(lines) + '\n')
+
+
+def in_ring(ring, lat, lon):
+    inside = False
+    previous = ring[-1]
+    for current in ring:
+        if (current[0] > lat) != (previous[0] > lat):
+            edge_lon = ((previous[1] - current[1]) * (lat - current[0]) / (previous[0] - current[0])
+                        + current[1])
+            if lon < edge_lon:
+                inside = not inside
+        previous = current
+    return inside
+
+
+def brute_force(nodes, ways, relations, inside, complete_ways):
+    """
+        The ids clip keeps, one element at a time
+    """
+    kept_nodes = {node_id for node_id, lat, lon in nodes if inside(lat, lon)}
+    kept_ways = {way_id for way_id, refs in ways if any(ref in kept_nodes for ref in refs)}
+    way_nodes = set()
+    if complete_ways:
+        for way_id, refs in ways:
+            if way_id in kept_ways:
+                way_nodes.update(refs)
+    kept_relations = set()
+    # a relation member counts once the relation is read, as in the file
+    for relation_id, members in relations:
+        for kind, ref in members:
+            if ((kind == 'node' and (ref in kept_nodes or ref in way_nodes))
+                    or (kind == 'way' and ref in kept_ways)
+                    or (kind == 'relation' and ref in kept_relations)):
+                kept_relations.add(relation_id)
+                break
+    return kept_nodes | way_nodes, kept_ways, kept_relations
+
+
+RING = [(29.2, -90.8), (30.9, -90.6), (30.5, -89.2), (29.4, -89.5)]
+HOLE = [(29.8, -90.2), (30.3, -90.2), (30.3, -89.8), (29.8, -89.8)]
+
+
+def box_contains(lat, lon):
+    return 29.5 <= lat <= 30.2 and -90.5 <= lon <= -89.6
+
+
+def polygon_contains(lat, lon):
+    return in_ring(RING, lat, lon) and not in_ring(HOLE, lat, lon)
+
+
+@pytest.mark.parametrize('complete_ways', [False, True])
+@pytest.mark.parametrize('area, inside', [
+    (BoundingBox(29.5, -90.5, 30.2, -89.6), box_contains),
+    (Polygon([RING], [HOLE]), polygon_contains),
+])
+def test_select_matches_brute_force(tmp_path, area, inside, complete_ways):
+    nodes, ways, relations = make_extract()
+    osm_file = str(tmp_path / 'extract.osm')
+    write_extract(osm_file, nodes, ways, relations)
+
+    selector = select(osm_file, area, complete_ways=complete_ways)
+    expected_nodes, expected_ways, expected_relations = brute_force(
+        nodes, ways, relations, inside, complete_ways)
+    assert expected_nodes and expected_ways and expected_relations
+
+    node_ids = np.array([node[0] for node in nodes])
+    kept = selector.nodes.contains(node_ids) | selector.way_nodes.contains(node_ids)
+    assert set(node_ids[kept].tolist()) == expected_nodes
+    way_ids = np.array([way[0] for way in ways])
+    assert set(way_ids[selector.ways.contains(way_ids)].tolist()) == expected_ways
+    relation_ids = np.array([relation[0] for relation in relations])
+    assert set(relation_ids[selector.relations.contains(relation_ids)].tolist()) == expected_relations
@@ -0,0 +1,134 @@
+import copy
+import os
+import sys
+
+import cerberus
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'benchmarks'))
+
+import data
+import osm_parsers
+import synthetic_osm
+from fast_validator import CompiledValidator
+from schema import schema as SCHEMA
+
+MAIN = {'node': 'node_tags', 'way': 'way_tags', 'relation': 'relation_tags'}
+
+# SCHEMA with regex rules, for the regex checks
+REGEX_SCHEMA = copy.deepcopy(SCHEMA)
+for _main, _tags in MAIN.items():
+    REGEX_SCHEMA[_main]['schema']['timestamp']['regex'] = r'\d{4}-\d\d-\d\dT\d\d:\d\d:\d\dZ'
+    REGEX_SCHEMA[_tags]['schema']['schema']['key']['regex'] = '[a-z_:]+'
+    REGEX_SCHEMA[_tags]['schema']['schema']['type']['regex'] = '[a-z_]+'
+
+
+@pytest.fixture(scope='module')
+def records(tmp_path_factory):
+    """
+        Shaped dict records of a synthetic extract, with one of each
+        element type that has tags first
+    """
+    osm_file = str(tmp_path_factory.mktemp('validator') / 'synthetic.osm')
+    synthetic_osm.generate_osm(osm_file, 2000)
+    shaped = list(osm_parsers.iter_shaped_elements(osm_file, tags=data.ELEMENT_TAGS))
+    tagged = []
+    for main, tags in MAIN.items():
+        tagged.extend([el for el in shaped if main in el and el[tags]][:1])
+    assert len(tagged) == 3
+    return tagged + shaped[::20]
+
+
+def mutations(el):
+    """
+        Copies of el with one thing wrong in each
+    """
+    main = next(name for name in MAIN if name in el)
+    tags = MAIN[main]
+    changes = [
+        (main, 'id', 'not a number'),
+        (main, 'uid', None),
+        (main, 'changeset', 1.5),
+        (main, 'user', 42),
+        (main, 'version', 1),
+        (main, 'timestamp', '2010-01-01 00:00:00'),
+        (main, 'timestamp', '2010-01-01T00:00:00Z\n'),
+        (main, 'timestamp', ['2010-01-01T00:00:00Z']),
+    ]
+    if main == 'node':
+        changes += [(main, 'lat', 'north'), (main, 'lon', None), (main, 'lat', True)]
+    for table, field, value in changes:
+        mutated = copy.deepcopy(el)
+        mutated[table][field] = value
+        yield mutated
+    for field in ('id', 'user', 'timestamp'):
+        mutated = copy.deepcopy(el)
+        del mutated[main][field]
+        yield mutated
+    mutated = copy.deepcopy(el)
+    mutated[main]['unknown'] = 'x'
+    yield mutated
+    for value in ('not a list', None, {'key': 'name'}):
+        mutated = copy.deepcopy(el)
+        mutated[tags] = value
+        yield mutated
+    mutated = copy.deepcopy(el)
+    mutated['unknown_table'] = []
+    yield mutated
+    if el[tags]:
+        for field, value in (('key', 'Bad Key!'), ('key', 7), ('value', None), ('type', 'Upper'),
+                             ('id', 'x')):
+            mutated = copy.deepcopy(el)
+            mutated[tags][-1][field] = value
+            yield mutated
+        mutated = copy.deepcopy(el)
+        del mutated[tags][0]['value']
+        yield mutated
+        mutated = copy.deepcopy(el)
+        mutated[tags].append('not a dict')
+        yield mutated
+
+
+def assert_same(document, schema):
+    expected = cerberus.Validator()
+    compiled = CompiledValidator(schema)
+    assert compiled.validate(document, schema) == expected.validate(document, schema)
+    assert compiled.errors == expected.errors
+    assert compiled.document == expected.document
+
+
+@pytest.mark.parametrize('schema', [SCHEMA, REGEX_SCHEMA], ids=['schema', 'regex'])
+def test_valid_records(records, schema):
+    for el in records:
+        assert CompiledValidator(schema).validate(el, schema)
+        assert_same(el, schema)
+
+
+@pytest.mark.parametrize('schema', [SCHEMA, REGEX_SCHEMA], ids=['schema', 'regex'])
+def test_invalid_records(records, schema):
+    invalid = 0
+    for el in records[:10]:
+        for mutated in mutations(el):
+            assert_same(mutated, schema)
+            invalid += not cerberus.Validator().validate(mutated, schema)
+    assert invalid
+
+
+def test_regex_rules_are_checked(records):
+    el = copy.deepcopy(records[0])
+    el['node_tags'][0]['key'] = 'Bad Key!'
+    compiled = CompiledValidator(REGEX_SCHEMA)
+    assert compiled.validate(el, REGEX_SCHEMA) is False
+    assert compiled.errors == {'node_tags': [{0: [{'key': ["value does not match regex '[a-z_:]+'"]}]}]}
+    assert CompiledValidator(SCHEMA).validate(el, SCHEMA) is True
+
+
+def test_one_validator_across_records(records):
+    # one instance of each over every record, as ingest_elements uses them
+    expected = cerberus.Validator()
+    compiled = CompiledValidator(SCHEMA)
+    for el in records[:10]:
+        for document in [el] + list(mutations(el)):
+            assert compiled.validate(document, SCHEMA) == expected.validate(document, SCHEMA)
+            assert compiled.errors == expected.errors
@@ -0,0 +1,30 @@
+import csv
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import mysql_loader
+
+FIELDS = ['id', 'key', 'value', 'type']
+
+
+def write_csv(path, rows):
+    with open(path, 'w', newline='', encoding='utf-8') as handle:
+        csv.writer(handle).writerows(rows)
+
+
+def test_csv_rows_keep_values_of_not_null_columns(tmp_path):
+    path = str(tmp_path / 'ways_tags.csv')
+    write_csv(path, [FIELDS, ['1', 'name', '', 'regular'], ['2', 'note', 'NULL', ''],
+                     ['3', 'fixme', '""', 'regular']])
+    # as in way_tag: every column NOT NULL but tag_type
+    rows = list(mysql_loader._csv_rows(path, FIELDS, [False, False, False, True]))
+    assert rows == [['1', 'name', '', 'regular'], ['2', 'note', 'NULL', None],
+                    ['3', 'fixme', '""', 'regular']]
+
+
+def test_load_data_reads_the_word_null_as_text():
+    # LOAD DATA gives an unquoted NULL field as NULL; it must load as 'NULL'
+    assert mysql_loader._field_value('@c2', False) == "coalesce(@c2, 'NULL')"
+    assert mysql_loader._field_value('@c3', True) == "nullif(coalesce(@c3, 'NULL'), '')"
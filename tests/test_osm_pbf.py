@@ -0,0 +1,245 @@
+import json
+import os
+import struct
+import sys
+import zlib
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import data
+import osm_parsers
+import osm_pbf
+
+TIMESTAMP = 1262304000  # 2010-01-01T00:00:00Z
+
+# (id, lat, lon, tags), in nanodegrees / 100 (the default granularity)
+DENSE_NODES = [
+    (-1, 299500000, -900700000, []),
+    (-2, 299510000, -900710000, [('amenity', 'cafe'), ('addr:street', 'Royal Street')]),
+    (100, 299520000, -900720000, []),
+    (101, 299530000, -900730000, [('name', 'Jackson Square')]),
+]
+NODES = [
+    (-3, 299540000, -900740000, [('shop', 'books')]),
+    (102, 299550000, -900750000, []),
+]
+WAYS = [
+    (-10, [-1, -2, 100], [('highway', 'residential'), ('name', 'Royal Street')]),
+    (20, [100, 101, 102, -3], []),
+]
+RELATIONS = [
+    (-30, [('node', -1, 'stop'), ('way', -10, ''), ('relation', 40, 'subarea')],
+     [('type', 'route')]),
+    (40, [('way', 20, 'outer'), ('node', 102, '')], [('type', 'multipolygon')]),
+]
+
+
+# ================================================== #
+#               Protobuf encoding                    #
+# ================================================== #
+def varint(value):
+    value &= (1 << 64) - 1
+    out = bytearray()
+    while True:
+        byte = value & 0x7f
+        value >>= 7
+        if value:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return bytes(out)
+
+
+def zigzag(value):
+    return (value << 1) ^ (value >> 63)
+
+
+def field_varint(field, value):
+    return varint(field << 3) + varint(value)
+
+
+def field_bytes(field, value):
+    return varint(field << 3 | 2) + varint(len(value)) + value
+
+
+def packed(field, values):
+    return field_bytes(field, b''.join(varint(value) for value in values))
+
+
+def deltas(values):
+    previous = 0
+    for value in values:
+        yield zigzag(value - previous)
+        previous = value
+
+
+class StringTable():
+
+    def __init__(self):
+        self.strings = ['']
+
+    def __call__(self, string):
+        if string not in self.strings:
+            self.strings.append(string)
+        return self.strings.index(string)
+
+    def encode(self):
+        return field_bytes(1, b''.join(field_bytes(1, s.encode('utf-8')) for s in self.strings))
+
+
+def info(strings, element_id):
+    return (field_varint(1, 1) + field_varint(2, TIMESTAMP) + field_varint(3, 7000 + abs(element_id))
+            + field_varint(4, 42) + field_varint(5, strings('mapper')))
+
+
+def dense_nodes(strings, nodes):
+    keys_vals = []
+    for _, _, _, tags in nodes:
+        for key, value in tags:
+            keys_vals.extend((strings(key), strings(value)))
+        keys_vals.append(0)
+    ids = [node[0] for node in nodes]
+    dense_info = (packed(1, [1] * len(nodes))
+                  + packed(2, deltas([TIMESTAMP] * len(nodes)))
+                  + packed(3, deltas([7000 + abs(node_id) for node_id in ids]))
+                  + packed(4, deltas([42] * len(nodes)))
+                  + packed(5, deltas([strings('mapper')] * len(nodes))))
+    return field_bytes(2, packed(1, deltas(ids)) + field_bytes(5, dense_info)
+                       + packed(8, deltas([node[1] for node in nodes]))
+                       + packed(9, deltas([node[2] for node in nodes]))
+                       + packed(10, keys_vals))
+
+
+def tag_fields(strings, tags):
+    return (packed(2, [strings(key) for key, _ in tags])
+            + packed(3, [strings(value) for _, value in tags]))
+
+
+def node(strings, node_id, lat, lon, tags):
+    return field_bytes(1, field_varint(1, zigzag(node_id)) + tag_fields(strings, tags)
+                       + field_bytes(4, info(strings, node_id))
+                       + field_varint(8, zigzag(lat)) + field_varint(9, zigzag(lon)))
+
+
+def way(strings, way_id, refs, tags):
+    return field_bytes(3, field_varint(1, way_id) + tag_fields(strings, tags)
+                       + field_bytes(4, info(strings, way_id)) + packed(8, deltas(refs)))
+
+
+def relation(strings, relation_id, members, tags):
+    member_types = osm_pbf.MEMBER_TYPES
+    return field_bytes(4, field_varint(1, relation_id) + tag_fields(strings, tags)
+                       + field_bytes(4, info(strings, relation_id))
+                       + packed(8, [strings(role) for _, _, role in members])
+                       + packed(9, deltas([ref for _, ref, _ in members]))
+                       + packed(10, [member_types.index(kind) for kind, _, _ in members]))
+
+
+def primitive_block(groups):
+    """
+        A PrimitiveBlock of groups, each a function of the string table
+    """
+    strings = StringTable()
+    encoded = [field_bytes(2, group(strings)) for group in groups]
+    return strings.encode() + b''.join(encoded)
+
+
+def file_block(blob_type, payload, compress):
+    if compress:
+        blob = field_varint(2, len(payload)) + field_bytes(3, zlib.compress(payload))
+    else:
+        blob = field_bytes(1, payload)
+    header = field_bytes(1, blob_type.encode('utf-8')) + field_varint(3, len(blob))
+    return struct.pack('>I', len(header)) + header + blob
+
+
+def write_pbf(path):
+    osm_header = field_bytes(4, b'OsmSchema-V0.6') + field_bytes(4, b'DenseNodes')
+    with open(path, 'wb') as handle:
+        handle.write(file_block('OSMHeader', osm_header, compress=False))
+        handle.write(file_block('OSMData', primitive_block([
+            lambda strings: dense_nodes(strings, DENSE_NODES),
+            lambda strings: b''.join(node(strings, *values) for values in NODES),
+        ]), compress=True))
+        handle.write(file_block('OSMData', primitive_block([
+            lambda strings: b''.join(way(strings, *values) for values in WAYS),
+            lambda strings: b''.join(relation(strings, *values) for values in RELATIONS),
+        ]), compress=False))
+
+
+# ================================================== #
+#               The matching XML                     #
+# ================================================== #
+def xml_attributes(element_id):
+    return ('id="{}" version="1" timestamp="2010-01-01T00:00:00Z" changeset="{}" uid="42" '
+            'user="mapper"'.format(element_id, 7000 + abs(element_id)))
+
+
+def xml_tags(tags):
+    return ''.join('<tag k="{}" v="{}"/>'.format(key, value) for key, value in tags)
+
+
+def write_xml(path):
+    lines = ['<?xml version="1.0" encoding="UTF-8"?>', '<osm version="0.6">']
+    for node_id, lat, lon, tags in DENSE_NODES + NODES:
+        lines.append('<node {} lat="{:.7f}" lon="{:.7f}">{}</node>'.format(
+            xml_attributes(node_id), lat / 1e7, lon / 1e7, xml_tags(tags)))
+    for way_id, refs, tags in WAYS:
+        lines.append('<way {}>{}{}</way>'.format(
+            xml_attributes(way_id), ''.join('<nd ref="{}"/>'.format(ref) for ref in refs),
+            xml_tags(tags)))
+    for relation_id, members, tags in RELATIONS:
+        lines.append('<relation {}>{}{}</relation>'.format(
+            xml_attributes(relation_id),
+            ''.join('<member type="{}" ref="{}" role="{}"/>'.format(*member) for member in members),
+            xml_tags(tags)))
+    lines.append('</osm>')
+    with open(path, 'w', encoding='utf-8') as handle:
+        handle.write('\n'.join(lines) + '\n')
+
+
+@pytest.fixture
+def osm_files(tmp_path):
+    pbf_file = str(tmp_path / 'fixture.osm.pbf')
+    xml_file = str(tmp_path / 'fixture.osm')
+    write_pbf(pbf_file)
+    write_xml(xml_file)
+    return pbf_file, xml_file
+
+
+@pytest.mark.parametrize('backend', ['expat', 'etree'])
+@pytest.mark.parametrize('rows', [True, False])
+def test_pbf_matches_xml(osm_files, backend, rows):
+    pbf_file, xml_file = osm_files
+    tags = data.ELEMENT_TAGS
+    expected = list(osm_parsers.iter_shaped_elements(xml_file, tags=tags, backend=backend, rows=rows))
+    assert len(expected) == len(DENSE_NODES) + len(NODES) + len(WAYS) + len(RELATIONS)
+    assert list(osm_pbf.iter_pbf(pbf_file, tags=tags, rows=rows)) == expected
+
+
+def test_negative_ids(osm_files):
+    pbf_file, _ = osm_files
+    ids = {(raw[0], raw[1]['id']) for raw in osm_pbf.iter_pbf_elements(pbf_file)}
+    assert {('node', '-1'), ('node', '-2'), ('node', '-3'),
+            ('way', '-10'), ('relation', '-30')} <= ids
+    members = [raw[3] for raw in osm_pbf.iter_pbf_elements(pbf_file) if raw[0] == 'relation']
+    assert members[0] == [('node', '-1', 'stop'), ('way', '-10', ''), ('relation', '40', 'subarea')]
+
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_metrics_report_pbf_progress(osm_files, tmp_path, workers):
+    pbf_file, xml_file = osm_files
+    metrics_file = str(tmp_path / 'metrics.jsonl')
+    output = tmp_path / 'out'
+    output.mkdir()
+    data.process_map(pbf_file, False, workers=workers, output_directory=str(output),
+                     metrics=metrics_file)
+    with open(metrics_file) as handle:
+        final = [json.loads(line) for line in handle][-1]
+    size = os.path.getsize(pbf_file)
+    assert final['final']
+    assert final['input']['bytes_total'] == final['input']['bytes_read'] == size
+    assert final['input']['fraction'] == 1.0
+    assert final['elements'] == len(DENSE_NODES) + len(NODES) + len(WAYS) + len(RELATIONS)
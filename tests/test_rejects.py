@@ -0,0 +1,54 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import data
+from rejects import ErrorBudgetExceeded
+
+NODE = ('<node id="{}" lat="{}" lon="-90.0" user="u" uid="1" version="1" changeset="1" '
+        'timestamp="2010-01-01T00:00:00Z"/>\n')
+
+
+def write_osm(path, nodes, bad):
+    """
+        nodes nodes, of which the ids in bad have an invalid lat
+    """
+    with open(path, 'w') as handle:
+        handle.write('<?xml version="1.0"?>\n<osm version="0.6">\n')
+        for node_id in range(1, nodes + 1):
+            handle.write(NODE.format(node_id, 'abc' if node_id in bad else '29.9'))
+        handle.write('</osm>\n')
+
+
+def rejected(summary_path):
+    with open(summary_path) as handle:
+        return handle.read()
+
+
+@pytest.mark.parametrize('workers', [1, 3])
+def test_clustered_rejects_within_budget(tmp_path, workers):
+    # 100 bad nodes in a row near the end: 0.5% of the run,
+    # but over 1% of the shard they fall in
+    osm_file = str(tmp_path / 'clustered.osm')
+    write_osm(osm_file, 20000, set(range(15001, 15101)))
+    output = tmp_path / 'out'
+    output.mkdir()
+    data.process_map(osm_file, validate=True, workers=workers, output_directory=str(output),
+                     on_invalid='reject', max_error_rate=0.01)
+    assert '"rejected": 100' in rejected(str(output / 'rejects_summary.json'))
+    with open(str(output / 'nodes.csv')) as handle:
+        assert sum(1 for _ in handle) == 20000 - 100
+
+
+@pytest.mark.parametrize('workers', [1, 3])
+def test_over_budget_raises(tmp_path, workers):
+    osm_file = str(tmp_path / 'dirty.osm')
+    write_osm(osm_file, 20000, set(range(15001, 15301)))
+    output = tmp_path / 'out'
+    output.mkdir()
+    with pytest.raises(ErrorBudgetExceeded):
+        data.process_map(osm_file, validate=True, workers=workers, output_directory=str(output),
+                         on_invalid='reject', max_error_rate=0.01)
@@ -0,0 +1,64 @@
+import os
+import sqlite3
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'benchmarks'))
+
+import sqlite_loader
+import synthetic_osm
+
+# the tables of create_tables.sql before relations and way geometry
+OLD_TABLES = ['node', 'node_tag', 'way', 'way_node', 'way_tag']
+
+
+def table_counts(database_path):
+    connection = sqlite3.connect(database_path)
+    try:
+        return {table: connection.execute("select count(*) from {}".format(table)).fetchone()[0]
+                for table in sqlite_loader.table_names(sqlite_loader.TABLES_SQL)}
+    finally:
+        connection.close()
+
+
+def test_load_into_an_older_database(tmp_path):
+    osm_file = str(tmp_path / 'synthetic.osm')
+    synthetic_osm.generate_osm(osm_file, 2000)
+    expected = table_counts(_load(osm_file, str(tmp_path / 'fresh.db')))
+
+    database_path = str(tmp_path / 'old.db')
+    connection = sqlite3.connect(database_path)
+    with open(sqlite_loader.TABLES_SQL) as handle:
+        connection.executescript(handle.read())
+    for table in sqlite_loader.table_names(sqlite_loader.TABLES_SQL):
+        if table not in OLD_TABLES:
+            connection.execute("drop table {}".format(table))
+    connection.close()
+
+    sqlite_loader.load(osm_file, database_path)
+    assert table_counts(database_path) == expected
+    assert expected['relation'] and expected['relation_member']
+
+
+def test_reload_replaces_every_table(tmp_path):
+    first_file = str(tmp_path / 'first.osm')
+    second_file = str(tmp_path / 'second.osm')
+    synthetic_osm.generate_osm(first_file, 3000)
+    synthetic_osm.generate_osm(second_file, 1000)
+    expected = table_counts(_load(second_file, str(tmp_path / 'fresh.db')))
+
+    database_path = _load(first_file, str(tmp_path / 'reloaded.db'))
+    connection = sqlite3.connect(database_path)
+    connection.execute("insert into way_coord select way_id, position, 29.9, -90.0 from way_node")
+    connection.execute("insert into way_metric (way_id, length) select way_id, 1.0 from way")
+    connection.commit()
+    connection.close()
+
+    sqlite_loader.load(second_file, database_path)
+    assert table_counts(database_path) == expected
+    assert expected['way_coord'] == expected['way_metric'] == 0
+
+
+def _load(osm_file, database_path):
+    sqlite_loader.load(osm_file, database_path)
+    return database_path
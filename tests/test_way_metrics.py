@@ -0,0 +1,57 @@
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from way_geometry import WayBatch
+from way_metrics import compute_way_metrics
+
+
+def make_batch(ways):
+    """
+        A WayBatch of ways, each a list of (node id, lat, lon)
+    """
+    offsets = np.zeros(len(ways) + 1, dtype=np.int64)
+    np.cumsum([len(way) for way in ways], out=offsets[1:])
+    points = [point for way in ways for point in way]
+    return WayBatch(np.arange(1, len(ways) + 1, dtype=np.int64), offsets,
+                    np.array([point[0] for point in points], dtype=np.int64),
+                    np.array([point[1] for point in points], dtype=np.float64),
+                    np.array([point[2] for point in points], dtype=np.float64))
+
+
+WAY = [(1, 29.1, -90.1), (2, 29.5, -90.2), (3, 29.3, -90.0)]
+OTHER_WAY = [(4, 30.0, -89.0), (5, 30.2, -89.5)]
+
+
+def test_bounding_box_with_empty_ways():
+    batches = [
+        ([WAY, []], [0]),
+        ([WAY, [], OTHER_WAY], [0, 2]),
+        ([[], WAY, [], [], OTHER_WAY, []], [1, 4]),
+    ]
+    for ways, real in batches:
+        metrics = compute_way_metrics(make_batch(ways))
+        for position, way in zip(real, (WAY, OTHER_WAY)):
+            assert metrics['min_lat'][position] == min(point[1] for point in way)
+            assert metrics['max_lat'][position] == max(point[1] for point in way)
+            assert metrics['min_lon'][position] == min(point[2] for point in way)
+            assert metrics['max_lon'][position] == max(point[2] for point in way)
+        for position, way in enumerate(ways):
+            if not way:
+                for field in ('min_lat', 'max_lat', 'min_lon', 'max_lon', 'length'):
+                    assert np.isnan(metrics[field][position])
+
+
+def test_bounding_box_matches_each_way_alone():
+    ways = [WAY, [], OTHER_WAY, []]
+    together = compute_way_metrics(make_batch(ways))
+    for position, way in enumerate(ways):
+        if not way:
+            continue
+        alone = compute_way_metrics(make_batch([way]))
+        for field in ('length', 'min_lat', 'max_lat', 'min_lon', 'max_lon',
+                      'centroid_lat', 'centroid_lon'):
+            assert np.isclose(together[field][position], alone[field][0])
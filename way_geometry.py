@@ -0,0 +1,223 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+    Way geometry assembly on top of the node location store
+
+    WayGeometry collects ways (id + node refs) into batches.  Each
+    batch is resolved with one vectorized lookup in the store
+    (node_locations.py) and handed to its consumers as a WayBatch:
+    flat lat / lon arrays with an offsets array marking where each
+    way starts, e.g. for three ways of 3, 2 and 4 nodes
+
+        way_ids  [w0, w1, w2]
+        offsets  [0, 3, 5, 9]
+        lats     [a0, a1, a2, b0, b1, c0, c1, c2, c3]
+
+    WayCoordsWriter, the default consumer, writes ways_coords.csv:
+    one (way id, position, lat, lon) row per way node, so way
+    geometry no longer needs a join against the node table.
+    way_metrics.WayMetricsWriter adds ways_metrics.csv.
+
+    During a serial ingest IngestGeometry fills the store from the
+    node records as they go by and starts assembling ways at the
+    first way (OSM files list all nodes before any way).
+"""
+import collections
+import csv
+import os
+
+import numpy as np
+
+from csv_compression import find_table, open_text
+from node_locations import NodeLocationBuilder, build_from_csv
+from street_map_csv_writer import WRITE_BUFFER_SIZE
+
+WAYS_COORDS_FILENAME = "ways_coords.csv"
+WAYS_COORDS_FIELDS = ['id', 'position', 'lat', 'lon']
+
+# ways resolved per lookup
+BATCH_SIZE = 4096
+
+WayBatch = collections.namedtuple('WayBatch', 'way_ids offsets node_ids lats lons')
+
+
+class WayGeometry():
+    """
+        Batches ways and hands resolved WayBatches to consumers
+    """
+
+    def __init__(self, locations, consumers, batch_size=BATCH_SIZE):
+        """
+            locations: node_locations.NodeLocations
+            consumers: objects with write(way_batch) and close()
+        """
+        self._locations = locations
+        self._consumers = consumers
+        self._batch_size = batch_size
+        self._way_ids = []
+        self._refs = []
+        self._counts = []
+
+    def add_way(self, way_id, node_refs):
+        """
+            node_refs: the way's node ids, in order
+        """
+        self._way_ids.append(way_id)
+        self._refs.extend(node_refs)
+        self._counts.append(len(node_refs))
+        if len(self._way_ids) >= self._batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self._way_ids:
+            return
+        offsets = np.zeros(len(self._counts) + 1, dtype=np.int64)
+        np.cumsum(self._counts, out=offsets[1:])
+        node_ids = np.array(self._refs, dtype=np.int64)
+        lats, lons = self._locations.lookup(node_ids)
+        batch = WayBatch(np.array(self._way_ids, dtype=np.int64), offsets, node_ids, lats, lons)
+        for consumer in self._consumers:
+            consumer.write(batch)
+        self._way_ids, self._refs, self._counts = [], [], []
+
+    def close(self):
+        self.flush()
+        for consumer in self._consumers:
+            consumer.close()
+
+
+class WayCoordsWriter():
+    """
+        Writes each WayBatch to ways_coords.csv
+    """
+
+    def __init__(self, output_directory, add_csv_headers=False):
+        self._handle = open(os.path.join(output_directory, WAYS_COORDS_FILENAME), 'w',
+                            encoding='utf-8', newline='', buffering=WRITE_BUFFER_SIZE)
+        self._writer = csv.writer(self._handle)
+        if add_csv_headers:
+            self._writer.writerow(WAYS_COORDS_FIELDS)
+
+    def write(self, batch):
+        counts = np.diff(batch.offsets)
+        way_ids = np.repeat(batch.way_ids, counts)
+        positions = np.arange(len(way_ids)) - np.repeat(batch.offsets[:-1], counts)
+        # rounding to 1e-7 gives back the digits of the source file
+        lats = np.round(batch.lats, 7).tolist()
+        lons = np.round(batch.lons, 7).tolist()
+        if np.isnan(batch.lats).any():
+            # nodes missing from the extract get empty coordinates
+            lats = [None if lat != lat else lat for lat in lats]
+            lons = [None if lon != lon else lon for lon in lons]
+        self._writer.writerows(zip(way_ids.tolist(), positions.tolist(), lats, lons))
+
+    def close(self):
+        self._handle.close()
+
+
+def _node_location(node):
+    """
+        (id, lat, lon) of a shaped node dict or tuple
+    """
+    if isinstance(node, dict):
+        return node['id'], node['lat'], node['lon']
+    return node[0], node[1], node[2]
+
+
+def _way_refs(way_nodes):
+    if way_nodes and isinstance(way_nodes[0], dict):
+        return [way_node['node_id'] for way_node in way_nodes]
+    return [way_node[1] for way_node in way_nodes]
+
+
+def default_consumers(output_directory, metrics=False):
+    """
+        ways_coords.csv, plus ways_metrics.csv when metrics is True
+    """
+    consumers = [WayCoordsWriter(output_directory)]
+    if metrics:
+        from way_metrics import WayMetricsWriter
+        consumers.append(WayMetricsWriter(output_directory))
+    return consumers
+
+
+class IngestGeometry():
+    """
+        Builds the node location store and the way geometry from the
+        shaped records of a serial ingest
+    """
+
+    def __init__(self, path, output_directory, consumers=None):
+        """
+            path: directory of the node location store
+            consumers: WayBatch consumers (default: ways_coords.csv)
+        """
+        self._builder = NodeLocationBuilder(path)
+        self._output_directory = output_directory
+        self._consumers = consumers
+        self._geometry = None
+
+    def _start_ways(self):
+        locations = self._builder.close()
+        consumers = self._consumers
+        if consumers is None:
+            consumers = default_consumers(self._output_directory)
+        self._geometry = WayGeometry(locations, consumers)
+
+    def track(self, records):
+        """
+            Yield records, feeding their nodes and ways
+            to the store and the way geometry on the way
+        """
+        for el in records:
+            if 'node' in el:
+                if self._geometry is not None:
+                    raise ValueError("node {} follows a way: node locations need the nodes first"
+                                     .format(_node_location(el['node'])[0]))
+                self._builder.add_node(*_node_location(el['node']))
+            elif 'way' in el:
+                if self._geometry is None:
+                    self._start_ways()
+                way = el['way']
+                self._geometry.add_way(way['id'] if isinstance(way, dict) else way[0],
+                                       _way_refs(el['way_nodes']))
+            yield el
+
+    def close(self):
+        if self._geometry is None:
+            self._start_ways()
+        self._geometry.close()
+
+
+def _iter_csv(filepath):
+    with open_text(filepath) as handle:
+        for row in csv.reader(handle):
+            if row[0] != 'id':
+                # not a header row
+                yield row
+
+
+def build_way_geometry(output_directory, path, consumers=None):
+    """
+        Build the node location store and the way geometry from
+        the nodes.csv, ways.csv and ways_nodes.csv in output_directory,
+        plain or compressed (for runs that do not go through
+        IngestGeometry)
+    """
+    locations = build_from_csv(find_table(output_directory, 'nodes.csv'), path)
+    if consumers is None:
+        consumers = default_consumers(output_directory)
+    geometry = WayGeometry(locations, consumers)
+
+    # both files list the ways in the same order; ways without
+    # nodes only appear in ways.csv
+    way_nodes = _iter_csv(find_table(output_directory, 'ways_nodes.csv'))
+    way_node = next(way_nodes, None)
+    for way in _iter_csv(find_table(output_directory, 'ways.csv')):
+        refs = []
+        while way_node is not None and way_node[0] == way[0]:
+            refs.append(way_node[1])
+            way_node = next(way_nodes, None)
+        geometry.add_way(way[0], refs)
+    geometry.close()
+    return locations